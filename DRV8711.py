@@ -1,36 +1,211 @@
 #!/usr/bin/env python
 
-import spidev
-from time import sleep
+from argparse import ArgumentParser
+
+try:
+    import spidev
+except ImportError:
+    # Simulated SPI backend for testing without Raspberry Pi
+    import spidev_sim as spidev
+
+import config as cfg
+
+# Register addresses
+REGISTERS = {
+    "CTRL": 0x00,
+    "TORQUE": 0x01,
+    "OFF": 0x02,
+    "BLANK": 0x03,
+    "DECAY": 0x04,
+    "STALL": 0x05,
+    "DRIVE": 0x06,
+    "STATUS": 0x07,
+}
+
+# Register values after reset
+RESET = {
+    "CTRL": 0xC10,
+    "TORQUE": 0x1FF,
+    "OFF": 0x030,
+    "BLANK": 0x080,
+    "DECAY": 0x110,
+    "STALL": 0x040,
+    "DRIVE": 0xA59,
+    "STATUS": 0x000,
+}
+
+# Register fields: register, bit offset, bit width
+FIELDS = {
+    "ENBL": ("CTRL", 0, 1),       # Enable motor
+    "RDIR": ("CTRL", 1, 1),       # Reverse DIR pin
+    "RSTEP": ("CTRL", 2, 1),      # Advance one step
+    "MODE": ("CTRL", 3, 4),       # Microstepping 1/2^MODE
+    "EXSTALL": ("CTRL", 7, 1),    # External stall detection
+    "ISGAIN": ("CTRL", 8, 2),     # Current sense gain 5, 10, 20, 40
+    "DTIME": ("CTRL", 10, 2),     # Dead time 400, 450, 650, 850 ns
+    "TORQUE": ("TORQUE", 0, 8),   # Full scale current
+    "SMPLTH": ("TORQUE", 8, 3),   # Back EMF sample threshold
+    "TOFF": ("OFF", 0, 8),        # Fixed off time in 500 ns steps
+    "PWMMODE": ("OFF", 8, 1),     # Bypass indexer
+    "TBLANK": ("BLANK", 0, 8),    # Current trip blanking time in 20 ns steps
+    "ABT": ("BLANK", 8, 1),       # Adaptive blanking time
+    "TDECAY": ("DECAY", 0, 8),    # Mixed decay transition time in 500 ns steps
+    "DECMOD": ("DECAY", 8, 3),    # Decay mode
+    "SDTHR": ("STALL", 0, 8),     # Stall detect threshold
+    "SDCNT": ("STALL", 8, 2),     # Steps before stall is asserted
+    "VDIV": ("STALL", 10, 2),     # Back EMF divider
+    "OCPTH": ("DRIVE", 0, 2),     # Overcurrent threshold
+    "OCPDEG": ("DRIVE", 2, 2),    # Overcurrent deglitch time
+    "TDRIVEN": ("DRIVE", 4, 2),   # Low side gate drive time
+    "TDRIVEP": ("DRIVE", 6, 2),   # High side gate drive time
+    "IDRIVEN": ("DRIVE", 8, 2),   # Low side gate drive peak current
+    "IDRIVEP": ("DRIVE", 10, 2),  # High side gate drive peak current
+    "OTS": ("STATUS", 0, 1),      # Overtemperature shutdown
+    "AOCP": ("STATUS", 1, 1),     # Channel A overcurrent shutdown
+    "BOCP": ("STATUS", 2, 1),     # Channel B overcurrent shutdown
+    "APDF": ("STATUS", 3, 1),     # Channel A predriver fault
+    "BPDF": ("STATUS", 4, 1),     # Channel B predriver fault
+    "UVLO": ("STATUS", 5, 1),     # Undervoltage lockout
+    "STD": ("STATUS", 6, 1),      # Stall detected
+    "STDLAT": ("STATUS", 7, 1),   # Latched stall detect
+}
+
+STATUS_FIELDS = ("OTS", "AOCP", "BOCP", "APDF", "BPDF", "UVLO", "STD", "STDLAT")
 
 
 class DRV8711(object):
+    """
+    Driver of the DRV8711 stepper motor pre-driver over SPI.
 
-    __REG_CTRL = 0x00
-    __REG_TORQUE = 0x01
-    __REG_OFF = 0x02
-    __REG_BLANK = 0x03
-    __REG_DECAY = 0x04
-    __REG_STALL = 0x05
-    __REG_DRIVE = 0x06
-    __REG_STATUS = 0x07
+    All registers are mirrored in a shadow. Field changes only update the
+    shadow and mark the register dirty if its value changed or is not yet
+    known to be on the device, flush() then writes each dirty register with
+    a single 16 bit frame. Reads are served from the shadow unless a refresh
+    is requested, only STATUS changes on the device by itself.
 
-    def __init__(self, cs=0):
+    Attributes:
+        device (SpiDev): SPI device
+    """
+
+    def __init__(self, bus=0, cs=0, speed=cfg.drivers["DRV8711"]["spi_speed_hz"]):
         self.device = spidev.SpiDev()
-        self.device.open(0, cs)
+        self.device.open(bus, cs)
         self.device.mode = 0
-        self.device.cshigh = False
+        # Chip select of DRV8711 is active high
+        self.device.cshigh = True
+        self.device.max_speed_hz = speed
+        self._shadow = dict(RESET)
+        self._dirty = set()
+        # Registers whose shadow matches the device
+        self._synced = set()
+
+    def _transfer(self, frame):
+        response = self.device.xfer2([frame >> 8, frame & 0xFF])
+        return (response[0] << 8 | response[1]) & 0xFFF
+
+    def read_register(self, name, refresh=False):
+        """Reads register value, from the device if refresh is set."""
+        if refresh:
+            self._shadow[name] = self._transfer(0x8000 | REGISTERS[name] << 12)
+            self._dirty.discard(name)
+            self._synced.add(name)
+        return self._shadow[name]
+
+    def write_register(self, name, value):
+        """Sets register value in shadow, written by flush()."""
+        value &= 0xFFF
+        if name in self._synced and self._shadow[name] == value:
+            return
+        self._shadow[name] = value
+        self._dirty.add(name)
+
+    def get(self, field, refresh=False):
+        """Gets field value, from the device if refresh is set."""
+        name, offset, width = FIELDS[field]
+        return (self.read_register(name, refresh) >> offset) & ((1 << width) - 1)
+
+    def set(self, field, value):
+        """Sets field value in shadow, written by flush()."""
+        name, offset, width = FIELDS[field]
+        mask = ((1 << width) - 1) << offset
+        if value << offset & ~mask:
+            raise ValueError("Value out of range for {}: {}".format(field, value))
+        self.write_register(name, (self._shadow[name] & ~mask) | (value << offset))
 
-    def get_control(self):
-        return self.read_register(__REG_CTRL)
+    def flush(self):
+        """Writes dirty registers to the device.
 
-    def read_register(self, address):
-        return self.device.xfer2([address, 0x00])
+        Returns:
+            n (int): Number of written registers
+        """
+        # Control register last, so the motor is enabled with final settings
+        names = sorted(self._dirty, key=lambda name: (name == "CTRL", REGISTERS[name]))
+        for name in names:
+            self._transfer(REGISTERS[name] << 12 | self._shadow[name])
+        self._synced.update(names)
+        self._dirty.clear()
+        return len(names)
+
+    def refresh(self):
+        """Reads all registers from the device into the shadow."""
+        for name in REGISTERS:
+            self.read_register(name, refresh=True)
+
+    def configure(self, settings):
+        """Applies field settings in one batch.
+
+        Parameters:
+            settings (dict): Field values by field name
+
+        Returns:
+            n (int): Number of written registers
+        """
+        for field, value in settings.items():
+            self.set(field, value)
+        return self.flush()
+
+    def set_mode(self, mode):
+        """Sets microstepping mode 1/mode."""
+        if mode not in cfg.drivers["DRV8711"]["modes"]:
+            raise ValueError("Mode not available: {}".format(mode))
+        self.set("MODE", mode.bit_length() - 1)
+        self.flush()
+
+    def get_control(self, refresh=False):
+        """Gets value of CTRL register."""
+        return self.read_register("CTRL", refresh)
+
+    def get_status(self, refresh=True):
+        """Gets fault and stall flags, read from the device by default.
+
+        Returns:
+            status (dict): Flags by STATUS field name
+        """
+        value = self.read_register("STATUS", refresh)
+        return {field: bool(value >> FIELDS[field][1] & 1) for field in STATUS_FIELDS}
+
+    def clear_status(self):
+        """Clears latched fault and stall flags."""
+        self._synced.discard("STATUS")
+        self.write_register("STATUS", 0)
+        self.flush()
+
+    def close(self):
+        self.device.close()
 
 
 def main():
-    drv8711 = DRV8711()
-    drv8711.get_control()
+    parser = ArgumentParser(description="Configures DRV8711 and prints its registers")
+    parser.add_argument("-b", "--bus", dest="bus", type=int, help="SPI bus", default=0)
+    parser.add_argument("-c", "--cs", dest="cs", type=int, help="SPI chip select", default=0)
+    args = parser.parse_args()
+
+    drv8711 = DRV8711(args.bus, args.cs)
+    drv8711.configure(cfg.drivers["DRV8711"]["registers"])
+    drv8711.refresh()
+    for name in REGISTERS:
+        print("{:6} 0x{:03X}".format(name, drv8711.read_register(name)))
+    drv8711.close()
 
 
 if __name__ == "__main__":
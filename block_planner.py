@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+from collections import deque
+import cProfile
+import math
+from multiprocessing import Pool
+import os
+import time
+
+import config as cfg
+from kinematics import axis
+from motion_planner import MotionPlanner
+from motion_planner import _mm_to_steps_ax
+from motion_planner import _switch_mode
+
+
+# Motion planner of the current (worker) process
+_mp = MotionPlanner()
+
+
+class Block(object):
+    """
+    A planned block of a GCode program.
+
+    Attributes:
+        gcode (GCode): GCode of the block
+        start (dict): Axis coordinates before the block in mm
+        end (dict): Axis coordinates after the block in mm
+        plane (str): Selected plane after the block
+        ix (list): Step timing intervals for X axis movement
+        iy (list): Step timing intervals for Y axis movement
+        iz (list): Step timing intervals for Z axis movement
+        plan_start (float): Timestamp when planning started
+        plan_time (float): Time spent planning the block in seconds
+        plan_pid (int): Id of the process that planned the block
+        planner (str): Name of the motion planner function used
+        feed_limit (float): Feed rate in mm/min an arc was limited to by its
+            centripetal acceleration, None if it runs at the programmed feed
+    """
+
+    def __init__(self, gcode, start, plane):
+        self.gcode = gcode
+        self.start = dict(start)
+        self.end = dict(start)
+        self.plane = plane
+        self.ix = []
+        self.iy = []
+        self.iz = []
+        self.plan_start = 0.0
+        self.plan_time = 0.0
+        self.plan_pid = None
+        self.planner = None
+        self.feed_limit = None
+
+    def is_feed_move(self):
+        """Checks if block is a feed move."""
+        return self.gcode.get("G") in ("01", "02", "03")
+
+
+def _end_coordinates(gcode, start):
+    """Calculates axis coordinates after GCode without planning it."""
+    g = gcode.get("G")
+    end = dict(start)
+    if g in ("00", "01", "02", "03"):
+        for key in ("X", "Y", "Z"):
+            val = gcode.get(key)
+            if val is not None:
+                end[key] = val
+    elif g == "28":
+        for key in ("X", "Y", "Z"):
+            end[key] = axis(key).limits[0]
+    return end
+
+
+def _plane(gcode, plane):
+    """Returns selected plane after GCode."""
+    return {"17": "XY", "18": "XZ", "19": "YZ"}.get(gcode.get("G"), plane)
+
+
+def resolve_blocks(gcodes, coordinates, plane="XY"):
+    """Resolves absolute start coordinates and plane of each block.
+    Blocks only depend on each other through these, so once resolved
+    they can be planned independently.
+
+    Parameters:
+        gcodes (list): GCode objects
+        coordinates (dict): Axis coordinates before the first block in mm
+        plane (str): Selected plane before the first block
+
+    Returns:
+        blocks (generator): Tuples of GCode, start coordinates and plane
+    """
+    for gcode in gcodes:
+        yield gcode, coordinates, plane
+        coordinates = _end_coordinates(gcode, coordinates)
+        plane = _plane(gcode, plane)
+
+
+def resolve_end(gcodes, coordinates, plane="XY"):
+    """Resolves axis coordinates and plane after the last block.
+
+    Parameters:
+        gcodes (list): GCode objects
+        coordinates (dict): Axis coordinates before the first block in mm
+        plane (str): Selected plane before the first block
+
+    Returns:
+        coordinates (dict): Axis coordinates after the last block in mm
+        plane (str): Selected plane after the last block
+    """
+    for gcode in gcodes:
+        coordinates = _end_coordinates(gcode, coordinates)
+        plane = _plane(gcode, plane)
+    return coordinates, plane
+
+
+def _rapid_planner():
+    """Returns rapid positioning planner depending on rapid mode."""
+    if cfg.RAPID_MODE == "coordinated":
+        return _mp.plan_coordinated_move
+    return _mp.plan_move
+
+
+def _rapid_modes(key):
+    """Returns fine and coarse rapid stepper mode of axis."""
+    return {
+        "x": (cfg.STEPPER_MODE_X, cfg.STEPPER_RAPID_MODE_X),
+        "y": (cfg.STEPPER_MODE_Y, cfg.STEPPER_RAPID_MODE_Y),
+        "z": (cfg.STEPPER_MODE_Z, cfg.STEPPER_RAPID_MODE_Z),
+    }[key]
+
+
+def _coarsen_rapid(key, intervals, start, distance):
+    """Switches long rapid moves of an axis to its coarse stepper mode."""
+    mode, coarse_mode = _rapid_modes(key)
+    if not coarse_mode or coarse_mode >= mode or abs(distance) < cfg.STEPPER_RAPID_MODE_MIN_DISTANCE:
+        return intervals
+    return _switch_mode(intervals, _mm_to_steps_ax(key, start), mode, coarse_mode)
+
+
+def plan_block(gcode, coordinates, plane="XY"):
+    """Plans step intervals for GCode.
+
+    Parameters:
+        gcode (GCode): GCode object
+        coordinates (dict): Axis coordinates before the block in mm
+        plane (str): Selected plane before the block
+
+    Returns:
+        block (Block): Planned block
+    """
+    t = time.time()
+    block = Block(gcode, coordinates, _plane(gcode, plane))
+    block.plan_start = t
+    block.plan_pid = os.getpid()
+    block.end = _end_coordinates(gcode, coordinates)
+
+    # Get gcode command
+    g = gcode.get("G")
+
+    # Calculate axis deltas
+    dx = block.end["X"] - coordinates["X"]
+    dy = block.end["Y"] - coordinates["Y"]
+    dz = block.end["Z"] - coordinates["Z"]
+
+    # Do action depending on GCode
+    # Rapid positioning and homing
+    if g in ("00", "28"):
+        vx = cfg.AXIS_TRAVERSAL_MM_PER_MIN_X
+        vy = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Y
+        vz = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Z
+        ds = (("x", dx), ("y", dy), ("z", dz))
+        v = (("x", vx), ("y", vy), ("z", vz))
+        planner = _rapid_planner()
+        block.planner = planner.__name__
+        ix, iy, iz = planner(ds, v)
+        block.ix = _coarsen_rapid("x", ix, coordinates["X"], dx)
+        block.iy = _coarsen_rapid("y", iy, coordinates["Y"], dy)
+        block.iz = _coarsen_rapid("z", iz, coordinates["Z"], dz)
+
+    # Linear interpolation
+    elif g == "01":
+        f = gcode.get("F")
+        x = gcode.get("X")
+        y = gcode.get("Y")
+        z = gcode.get("Z")
+        feed_rate = float(f) if f else cfg.AXIS_FEED_MM_PER_MIN_X
+        block.planner = "plan_interpolated_line"
+
+        if x is not None and y is not None and z is None:
+            delta = (("x", dx), ("y", dy))
+            block.ix, block.iy = _mp.plan_interpolated_line(delta, feed_rate)
+        elif x is not None and y is None and z is not None:
+            delta = (("x", dx), ("z", dz))
+            block.ix, block.iz = _mp.plan_interpolated_line(delta, feed_rate)
+        elif x is None and y is not None and z is not None:
+            delta = (("y", dy), ("z", dz))
+            block.iy, block.iz = _mp.plan_interpolated_line(delta, feed_rate)
+        else:
+            print("Error in GCode! 3D linear interpolation not yet implemented")
+
+    # Circular interpolation
+    elif g in ("02", "03"):
+        f = gcode.get("F")
+        i = gcode.get("I")
+        j = gcode.get("J")
+        k = gcode.get("K")
+        r = gcode.get("R")
+
+        cw = True if g == "02" else False
+        feed_rate = float(f) if f else cfg.AXIS_FEED_MM_PER_MIN_X
+        # Start point relative to arc center
+        if plane == "XY":
+            axes = (("x", -i if i else 0, dx), ("y", -j if j else 0, dy))
+        elif plane == "XZ":
+            axes = (("x", -i if i else 0, dx), ("z", -k if k else 0, dz))
+        else:
+            axes = (("y", -j if j else 0, dy), ("z", -k if k else 0, dz))
+        (ka, sa, da), (kb, sb, db) = axes
+        if not r:
+            r = math.sqrt(sa*sa + sb*sb)
+        block.planner = "plan_interpolated_arc"
+        ia, ib, block.feed_limit = _mp.plan_interpolated_arc(
+            r, ((ka, sa), (kb, sb)), ((ka, da), (kb, db)), feed_rate, cw
+        )
+        for key, intervals in ((ka, ia), (kb, ib)):
+            setattr(block, "i" + key, intervals)
+
+    block.plan_time = time.time() - t
+    return block
+
+
+class _Planned(object):
+    """Block planned in-process, stands in for a pool result."""
+
+    def __init__(self, block):
+        self._block = block
+
+    def get(self):
+        return self._block
+
+
+class BlockPlanner(object):
+    """
+    Plans blocks of a GCode program, optionally in parallel on a process pool.
+
+    Start coordinates of all blocks are resolved up front, the blocks are
+    then planned independently. Planned blocks are returned in program
+    order with at most `window` blocks outstanding.
+
+    Planning of a range of blocks can be profiled with cProfile, these
+    blocks are planned in-process and the statistics are written once
+    the program has been planned.
+
+    Attributes:
+        processes (int): Number of planning processes, 1 plans in-process
+        window (int): Maximum number of blocks planned ahead
+        profile (tuple): Range (start, end) of block indexes to profile
+        profile_path (str): Path of pstats file
+    """
+
+    def __init__(self, processes=cfg.PLANNER_PROCESSES, window=cfg.PLANNER_WINDOW,
+                 profile=None, profile_path=None):
+        self.processes = processes or 1
+        self.window = max(window, self.processes)
+        self.profile = profile
+        self.profile_path = profile_path
+        self._profiler = None
+
+    def _profiled(self, index):
+        return self.profile is not None and self.profile[0] <= index < self.profile[1]
+
+    def _plan_profiled(self, args):
+        """Plans block in-process with profiler enabled."""
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+        self._profiler.enable()
+        try:
+            return plan_block(*args)
+        finally:
+            self._profiler.disable()
+
+    def _write_profile(self):
+        if self._profiler is not None and self.profile_path:
+            self._profiler.dump_stats(self.profile_path)
+        self._profiler = None
+
+    def plan(self, gcodes, coordinates, plane="XY"):
+        """Plans GCode program.
+
+        Parameters:
+            gcodes (list): GCode objects
+            coordinates (dict): Axis coordinates before the first block in mm
+            plane (str): Selected plane before the first block
+
+        Returns:
+            blocks (generator): Planned blocks in program order
+        """
+        blocks = resolve_blocks(gcodes, coordinates, plane)
+        if self.processes == 1:
+            try:
+                for index, args in enumerate(blocks):
+                    if self._profiled(index):
+                        yield self._plan_profiled(args)
+                    else:
+                        yield plan_block(*args)
+            finally:
+                self._write_profile()
+            return
+
+        pool = Pool(self.processes)
+        try:
+            pending = deque()
+            for index, args in enumerate(blocks):
+                if self._profiled(index):
+                    pending.append(_Planned(self._plan_profiled(args)))
+                else:
+                    pending.append(pool.apply_async(plan_block, args))
+                if len(pending) >= self.window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+            self._write_profile()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import glob
+import hashlib
+import json
+import logging
+from multiprocessing import Pool
+import os
+import time
+
+import numpy as np
+
+from block_planner import Block
+from block_planner import plan_block
+from block_planner import resolve_blocks
+import config as cfg
+from gcode import GCode
+from gcode_exceptions import GCodeError
+from gcode_parser import PARSER_VERSION
+import kinematics
+import optimizer
+from program import Program
+
+# File name suffix of compiled jobs
+ARTIFACT_SUFFIX = ".plan.npz"
+
+# Name of the summary written to the output directory
+SUMMARY_FILE = "summary.json"
+
+AXES = ("X", "Y", "Z")
+
+_logger = logging.getLogger("main")
+
+
+def config_fingerprint():
+    """Hash of the settings planned blocks depend on."""
+    settings = [cfg.RAPID_MODE, cfg.STEPPER_RAPID_MODE_MIN_DISTANCE, cfg.ARC_CENTRIPETAL_SHARE,
+                cfg.FEED_OVERRIDE_LIMITS[1]]
+    for a in kinematics.AXES.values():
+        settings.append((a.name, a.step_angle, a.mode, a.lead, a.traversal, a.feed,
+                         a.acceleration, a.jerk, a.ramp_type,
+                         a.limits, getattr(cfg, "STEPPER_RAPID_MODE_" + a.name, None)))
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def _duration(block):
+    """Planned duration of a block in s."""
+    return max(sum(dt for _, dt in intervals) for intervals in (block.ix, block.iy, block.iz))
+
+
+def write_artifact(path, blocks, source, coordinates, plane):
+    """Writes planned blocks of a job.
+
+    Parameters:
+        path (str): Artifact path
+        blocks (list): Planned blocks in program order
+        source (str): Path of the GCode file
+        coordinates (dict): Axis coordinates before the first block
+        plane (str): Selected plane before the first block
+    """
+    arrays = {}
+    for key in AXES:
+        intervals = [getattr(block, "i" + key.lower()) for block in blocks]
+        arrays["offsets_" + key] = np.cumsum([0] + [len(i) for i in intervals])
+        flat = [record for i in intervals for record in i]
+        arrays["intervals_" + key] = np.array(flat, dtype=float).reshape(-1, 2)
+    arrays["starts"] = np.array([[block.start[key] for key in AXES] for block in blocks]).reshape(-1, 3)
+    arrays["ends"] = np.array([[block.end[key] for key in AXES] for block in blocks]).reshape(-1, 3)
+    meta = {
+        "source": source,
+        "parser_version": PARSER_VERSION,
+        "config": config_fingerprint(),
+        "coordinates": coordinates,
+        "plane": plane,
+        "gcodes": [block.gcode._params for block in blocks],
+        "planes": [block.plane for block in blocks],
+        "planners": [block.planner for block in blocks],
+        "feed_limits": [block.feed_limit for block in blocks],
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+    tmp_path = "{}.{}.tmp.npz".format(path, os.getpid())
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_artifact(path, coordinates, plane="XY"):
+    """Loads planned blocks of a compiled job.
+    The block ends are checked against the current axis limits before any
+    block is returned. Blocks are re-planned where the machine state differs
+    from the state they were planned for, that is the leading blocks until
+    their start coordinates and plane match. If the planner settings changed
+    since compiling, all blocks are re-planned.
+
+    Parameters:
+        path (str): Artifact path
+        coordinates (dict): Axis coordinates before the first block in mm
+        plane (str): Selected plane before the first block
+
+    Returns:
+        blocks (generator): Planned blocks in program order
+
+    Raises:
+        GCodeOutOfBoundsError: Job moves an axis out of its limits
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        arrays = None
+        if meta["config"] == config_fingerprint():
+            arrays = {key: data[key] for key in data.files if key != "meta"}
+    if arrays is None:
+        _logger.warning("Planner settings changed since %s was compiled, planning all blocks", path)
+    gcodes = [GCode(params) for params in meta["gcodes"]]
+    Program.from_gcodes(gcodes).validate(coordinates)
+    return _artifact_blocks(path, meta, arrays, gcodes, coordinates, plane)
+
+
+def _artifact_blocks(path, meta, arrays, gcodes, coordinates, plane):
+    """Yields blocks of a loaded artifact, see load_artifact().
+    Arrays are None if all blocks are re-planned."""
+    if arrays is not None:
+        intervals = {key: arrays["intervals_" + key].tolist() for key in AXES}
+        offsets = {key: arrays["offsets_" + key] for key in AXES}
+        starts = arrays["starts"]
+        ends = arrays["ends"]
+    compiled_plane = meta["plane"]
+    replanned = 0
+    for n, (gcode, start, block_plane) in enumerate(resolve_blocks(gcodes, coordinates, plane)):
+        if arrays is not None and block_plane == compiled_plane and all(
+                start[key] == starts[n][m] for m, key in enumerate(AXES)):
+            block = Block(gcode, start, meta["planes"][n])
+            block.end = dict(zip(AXES, ends[n].tolist()))
+            block.planner = meta["planners"][n]
+            block.feed_limit = meta["feed_limits"][n]
+            for key in AXES:
+                setattr(block, "i" + key.lower(),
+                        [(int(sign), dt) for sign, dt in intervals[key][offsets[key][n]:offsets[key][n+1]]])
+        else:
+            block = plan_block(gcode, start, block_plane)
+            replanned += 1
+        compiled_plane = meta["planes"][n]
+        yield block
+    if replanned:
+        _logger.info("Re-planned %d blocks of %s", replanned, path)
+
+
+def compile_file(gcode_file, output_dir, coordinates, plane="XY", optimize=True, coalesce=True):
+    """Parses, validates, optimizes and plans a GCode file.
+
+    Parameters:
+        gcode_file (str): Path of GCode file
+        output_dir (str): Directory of the artifact
+        coordinates (dict): Axis coordinates before the job
+        plane (str): Selected plane before the job
+        optimize (bool): Reorder machining operations
+        coalesce (bool): Merge collinear linear moves
+
+    Returns:
+        result (dict): Artifact path, number of blocks, planned duration,
+            rapid travel before and after optimizing, eliminated blocks,
+            compile time and error
+    """
+    t = time.time()
+    result = {"file": gcode_file, "artifact": None, "blocks": 0, "duration": None,
+              "rapid_before": None, "rapid_after": None, "eliminated": 0, "error": None}
+    try:
+        program = Program.load(gcode_file, cfg.PROGRAM_CACHE)
+        program.validate(coordinates)
+        gcodes = program.gcodes()
+        if optimize:
+            gcodes, result["rapid_before"], result["rapid_after"] = optimizer.optimize(
+                gcodes, coordinates, plane)
+        if coalesce:
+            gcodes, result["eliminated"] = optimizer.coalesce(gcodes, coordinates, plane)
+        blocks = [plan_block(*args) for args in resolve_blocks(gcodes, coordinates, plane)]
+        path = os.path.join(output_dir, os.path.basename(gcode_file) + ARTIFACT_SUFFIX)
+        write_artifact(path, blocks, gcode_file, coordinates, plane)
+        result.update(artifact=path, blocks=len(blocks),
+                      duration=sum(_duration(block) for block in blocks))
+    except GCodeError as e:
+        result["error"] = "{}: {}".format(e.message, e.expression)
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["seconds"] = time.time() - t
+    return result
+
+
+def _compile(args):
+    return compile_file(*args)
+
+
+def compile_directory(directory, output_dir, coordinates, plane="XY", processes=None,
+                      optimize=True, coalesce=True):
+    """Compiles all GCode files of a directory across processes
+    and writes a summary of the results to the output directory.
+
+    Parameters:
+        directory (str): Directory of .nc files
+        output_dir (str): Directory of artifacts and summary
+        coordinates (dict): Axis coordinates before each job
+        plane (str): Selected plane before each job
+        processes (int): Number of processes, defaults to all cores
+
+    Returns:
+        results (list): Result of each file, see compile_file()
+    """
+    files = sorted(glob.glob(os.path.join(directory, "*.nc")))
+    os.makedirs(output_dir, exist_ok=True)
+    args = [(f, output_dir, coordinates, plane, optimize, coalesce) for f in files]
+    processes = min(processes or os.cpu_count() or 1, max(len(files), 1))
+    if processes == 1:
+        results = [_compile(a) for a in args]
+    else:
+        with Pool(processes) as pool:
+            # Largest files first, so the pool is not left with one big job at the end
+            order = sorted(range(len(args)), key=lambda n: -os.path.getsize(files[n]))
+            done = dict(zip(order, pool.map(_compile, [args[n] for n in order], chunksize=1)))
+            results = [done[n] for n in range(len(args))]
+    with open(os.path.join(output_dir, SUMMARY_FILE), "w") as file_obj:
+        json.dump({"config": config_fingerprint(), "coordinates": coordinates,
+                   "plane": plane, "files": results}, file_obj, indent=4, sort_keys=True)
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="Compiles a directory of GCode files to planned jobs")
+    parser.add_argument("-d", "--directory", dest="directory",
+                        help="Directory of .nc files", required=True)
+    parser.add_argument("-o", "--output", dest="output",
+                        help="Output directory, defaults to the input directory")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int,
+                        help="Number of processes, defaults to all cores")
+    parser.add_argument("-n", "--no-optimize", dest="no_optimize", action="store_true",
+                        help="Keep block order and do not coalesce moves")
+    args = parser.parse_args()
+
+    with open(cfg.coord_file) as file_obj:
+        coordinates = json.load(file_obj)
+    t = time.time()
+    results = compile_directory(args.directory, args.output or args.directory, coordinates,
+                                processes=args.jobs, optimize=not args.no_optimize,
+                                coalesce=not args.no_optimize)
+    for result in results:
+        if result["error"]:
+            print("{}: error {}".format(result["file"], result["error"]))
+        else:
+            print("{}: {} blocks, {:.1f}s".format(result["file"], result["blocks"], result["duration"]))
+    print("Compiled {} files in {:.1f}s".format(len(results), time.time() - t))
+
+
+if __name__ == "__main__":
+    main()
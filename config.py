@@ -8,6 +8,10 @@ logfile = os.path.join(module_dir, "logs", "main.log")
 
 
 # Constants
+# Axes of the machine, each axis needs the STEPPER_* and AXIS_* constants
+# below suffixed with its name (e.g. "A" for a rotary axis, lead in degrees)
+AXES = ("X", "Y", "Z")
+
 # Define step angle for each stepper
 STEPPER_STEP_ANGLE_X = 1.8
 STEPPER_STEP_ANGLE_Y = 1.8
@@ -18,6 +22,14 @@ STEPPER_MODE_X = 8
 STEPPER_MODE_Y = 8
 STEPPER_MODE_Z = 8
 
+# Coarser stepper modes used for long rapid moves (None: disabled)
+# and minimum axis distance in mm for switching. Switching requires
+# mode pins ("m0".."m2" gpios) or an SPI driver (DRV8711).
+STEPPER_RAPID_MODE_X = None
+STEPPER_RAPID_MODE_Y = None
+STEPPER_RAPID_MODE_Z = None
+STEPPER_RAPID_MODE_MIN_DISTANCE = 20.0
+
 AXIS_LEAD_X = 5
 AXIS_LEAD_Y = 5
 AXIS_LEAD_Z = 5
@@ -27,10 +39,93 @@ AXIS_TRAVERSAL_MM_PER_MIN_X = 2000.0
 AXIS_TRAVERSAL_MM_PER_MIN_Y = 2000.0
 AXIS_TRAVERSAL_MM_PER_MIN_Z = 2000.0
 
+# Rapid positioning mode
+# coordinated: axes move on a straight line and finish together
+# independent: each axis moves at its own max speed
+RAPID_MODE = "coordinated"
+
 AXIS_FEED_MM_PER_MIN_X = 1200.0
 AXIS_FEED_MM_PER_MIN_Y = 1200.0
 AXIS_FEED_MM_PER_MIN_Z = 1200.0
 
+# Binary cache of parsed programs next to the GCode file (<file>.cache)
+PROGRAM_CACHE = True
+
+# Maximum distance in mm of merged points from a coalesced linear move
+COALESCE_TOLERANCE = 0.01
+
+# Maximum time in s spent improving the order of each group of operations
+OPTIMIZER_TIME_BUDGET = 2.0
+
+# Number of processes planning blocks in parallel (1: plan in-process)
+# and maximum number of blocks planned ahead of execution
+PLANNER_PROCESSES = 1
+PLANNER_WINDOW = 8
+
+# Shared memory schedule buffers of the step executors: records per axis,
+# records between index updates, poll interval and start delay of a block in s
+SCHEDULE_BUFFER_RECORDS = 65536
+SCHEDULE_BUFFER_CHUNK = 256
+SCHEDULE_BUFFER_POLL = 0.0005
+SCHEDULE_START_DELAY = 0.01
+
+# Real-time mode of the step executors: cores per axis (should be isolated,
+# e.g. with isolcpus), SCHED_FIFO priority and memory locking.
+# SCHED_FIFO requires real-time throttling to be disabled
+# (sysctl kernel.sched_rt_runtime_us=-1)
+REALTIME_ENABLED = False
+REALTIME_CORES = {"X": [1], "Y": [2], "Z": [3]}
+REALTIME_PRIORITY = 80
+REALTIME_LOCK_MEMORY = True
+
+# Cruise segments: runs of at least CRUISE_PWM_MIN_STEPS identical steps
+# are emitted with PWM on the step pin, abort and feed override are checked
+# every CRUISE_PWM_CHECK s. Steps are counted by time, so the step pin
+# should be a hardware PWM channel. PWM stops CRUISE_PWM_TAIL s before the
+# end, busy waited from CRUISE_PWM_LATENCY s, the worst-case oversleep of
+# time.sleep(), and the tail is bit-banged to the exact step count. The tail
+# covers the same worst-case latency for a preempted busy wait, PWM keeps
+# stepping while it lasts
+CRUISE_PWM_ENABLED = False
+CRUISE_PWM_MIN_STEPS = 200
+CRUISE_PWM_CHECK = 0.002
+CRUISE_PWM_LATENCY = 0.02
+CRUISE_PWM_TAIL = 0.02
+
+# Fault monitor of DRV8711 drivers: STATUS polls per second
+# and STATUS bits stopping motion (all faults and stall)
+FAULT_MONITOR_RATE = 1000.0
+FAULT_MONITOR_MASK = 0xFF
+
+# Controller socket and number of blocks planned ahead for queued jobs
+CONTROLLER_SOCKET = "/tmp/raspi_cnc.sock"
+CONTROLLER_PREPLAN_BLOCKS = 16
+
+# Streaming interface: receive buffer size in characters, queued lines,
+# queued planned blocks, serial baud rate, TCP bind address and port.
+# Threads waiting on the stream or a queue check for a stop every
+# STREAM_POLL s
+STREAM_RX_BUFFER_SIZE = 128
+STREAM_QUEUE_SIZE = 16
+STREAM_PLANNED_BLOCKS = 4
+STREAM_BAUD = 115200
+STREAM_TCP_BIND = "127.0.0.1"
+STREAM_TCP_PORT = 2323
+STREAM_POLL = 0.1
+
+# Metrics export: local HTTP port (None: disabled)
+# and file written at job end (None: disabled)
+METRICS_PORT = None
+METRICS_FILE = None
+
+# Feed override applied to feed moves while running
+# (shared memory name, limits in percent, max change in percent per second).
+# Feed moves are planned for the upper limit, their ramps and arc feed
+# limits leave room for the velocity and acceleration it adds
+FEED_OVERRIDE_SHM = "raspi_cnc_feed_override"
+FEED_OVERRIDE_LIMITS = (10.0, 200.0)
+FEED_OVERRIDE_RAMP = 100.0
+
 # Define axis limits
 AXIS_LIMITS_X = (0.0, 800.0)
 AXIS_LIMITS_Y = (0.0, 600.0)
@@ -41,15 +136,25 @@ AXIS_POLARITY_X = False
 AXIS_POLARITY_Y = False
 AXIS_POLARITY_Z = True
 
-# Define axis acceleration in mm/s^2 and ramp type
+# Define axis acceleration in mm/s^2, jerk in mm/s^3 and ramp type
+# Available ramp types: trapezoidal, sigmoidal, scurve (jerk-limited)
 AXIS_ACCELERATION_X = 80.0
 AXIS_ACCELERATION_Y = 80.0
 AXIS_ACCELERATION_Z = 80.0
 
+AXIS_JERK_X = 2000.0
+AXIS_JERK_Y = 2000.0
+AXIS_JERK_Z = 2000.0
+
 AXIS_RAMP_TYPE_X = "sigmoidal"
 AXIS_RAMP_TYPE_Y = "sigmoidal"
 AXIS_RAMP_TYPE_Z = "sigmoidal"
 
+# Share of the axis acceleration available for centripetal acceleration
+# on arcs. Arc feeds are capped to keep v^2 / r within it, the remaining
+# acceleration ramps the feed in and out of the arc
+ARC_CENTRIPETAL_SHARE = 0.8
+
 
 steppers = {
     "default": {
@@ -103,6 +208,8 @@ drivers = {
             16: (1, 0, 0),
             32: (1, 1, 0)
         },
+        # Minimum STEP high time in s (1.9 us)
+        "pulse_width": 2e-6,
     },
     "TB67S249FTG": {
         # Microstepping modes of TB67S249FTG
@@ -117,6 +224,8 @@ drivers = {
             16: (0, 1, 1),
             32: (1, 1, 1)
         },
+        # Minimum STEP high time in s (0.3 us)
+        "pulse_width": 1e-6,
     },
     "DRV8711": {
         # Microstepping modes of DRV8711
@@ -132,6 +241,34 @@ drivers = {
             128: (0, 1, 1, 1),
             256: (1, 0, 0, 0),
         },
+        # Minimum STEP high time in s (1 us)
+        "pulse_width": 1e-6,
+        # SPI bus and clock, chip select is set per stepper ("cs")
+        "spi_bus": 0,
+        "spi_speed_hz": 1000000,
+        # Register fields applied at start-up, see FIELDS in DRV8711.py
+        "registers": {
+            "ENBL": 1,
+            "ISGAIN": 0,      # Gain 5
+            "DTIME": 3,       # 850 ns
+            "TORQUE": 0xBA,
+            "SMPLTH": 1,      # 100 us
+            "TOFF": 0x30,     # 24 us
+            "PWMMODE": 0,
+            "TBLANK": 0x80,   # 2.56 us
+            "ABT": 1,
+            "TDECAY": 0x10,   # 8 us
+            "DECMOD": 5,      # Auto mixed decay
+            "SDTHR": 0x40,
+            "SDCNT": 0,
+            "VDIV": 0,
+            "OCPTH": 1,       # 500 mV
+            "OCPDEG": 2,      # 4 us
+            "TDRIVEN": 1,
+            "TDRIVEP": 1,
+            "IDRIVEN": 2,
+            "IDRIVEP": 2,
+        },
     },
     "DM556T": {
         # Microstepping modes of DM556T
@@ -148,6 +285,8 @@ drivers = {
             32: (0, 1, 0, 1),
             64: (1, 0, 0, 1),
             128: (0, 0, 0, 1)
-        }
+        },
+        # Minimum PUL high time in s (2.5 us)
+        "pulse_width": 2.5e-6,
     }
 }
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+
+from block_planner import BlockPlanner
+from block_planner import resolve_end
+from feed_override import FeedOverride
+import log_queue
+from machine import Machine
+import metrics
+from program import Program
+from stepper import Stepper
+
+import config as cfg
+
+
+class Job(object):
+    """
+    A queued GCode job.
+
+    Attributes:
+        id (int): Job id
+        gcode_file (str): Path of GCode file
+        status (str): queued | ready | running | done | failed | cancelled
+        blocks_total (int): Number of blocks of the program
+        blocks_done (int): Number of executed blocks
+        error (str): Error message if job failed
+    """
+
+    def __init__(self, job_id, gcode_file):
+        self.id = job_id
+        self.gcode_file = gcode_file
+        self.status = "queued"
+        self.blocks_total = 0
+        self.blocks_done = 0
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+        self.program = None
+        self.gcodes = []
+        # Projected machine state before the job and blocks planned ahead
+        self.start = None
+        self.end = None
+        self.preplanned = []
+        self.cancelled = False
+
+    def to_dict(self):
+        """Gets job status as dictionary."""
+        return {
+            "id": self.id,
+            "file": self.gcode_file,
+            "status": self.status,
+            "blocks_total": self.blocks_total,
+            "blocks_done": self.blocks_done,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class Controller(object):
+    """
+    Long-running controller executing queued GCode jobs.
+
+    Steppers and machine state are kept between jobs. Jobs are submitted
+    over a Unix domain socket using newline-delimited JSON requests.
+    While a job runs, queued jobs are parsed and their first blocks are
+    planned from the coordinates the previous job will end at.
+
+    Requests:
+        {"cmd": "submit", "file": path}
+        {"cmd": "status"} or {"cmd": "status", "job": id}
+        {"cmd": "cancel", "job": id}
+        {"cmd": "override", "percent": value}
+        {"cmd": "clear_fault"}
+        {"cmd": "shutdown"}
+    """
+
+    def __init__(self, debug=False, socket_path=cfg.CONTROLLER_SOCKET,
+                 processes=cfg.PLANNER_PROCESSES):
+        self.logger = logging.getLogger("main")
+        self.debug = debug
+        self.socket_path = socket_path
+        self.processes = processes
+
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._prepare_queue = None
+        self._run_queue = None
+        self._stopped = None
+        self._executing = None
+        # Projected machine state after the last prepared job
+        self._projected = None
+
+        self._sx = Stepper("X", cfg.STEPPER_MODE_X, self.debug)
+        self._sy = Stepper("Y", cfg.STEPPER_MODE_Y, self.debug)
+        self._sz = Stepper("Z", cfg.STEPPER_MODE_Z, self.debug)
+        self._override = None
+        self._machine = None
+
+    def _prepare(self, job, start):
+        """Parses job, checks its axis limits and plans its first blocks
+        from projected state, so invalid jobs fail while queued."""
+        job.program = Program.load(job.gcode_file, cfg.PROGRAM_CACHE)
+        job.program.validate(start[0])
+        job.gcodes = job.program.gcodes()
+        job.blocks_total = len(job.gcodes)
+        job.start = start
+        job.end = resolve_end(job.gcodes, *start)
+        planner = BlockPlanner(1)
+        job.preplanned = list(planner.plan(
+            job.gcodes[:cfg.CONTROLLER_PREPLAN_BLOCKS], *start))
+
+    def _execute(self, job):
+        """Executes job, runs in a worker thread."""
+        machine = self._machine
+        state = (machine.get_coordinates(), machine.get_plane())
+        preplanned = job.preplanned if state == job.start else []
+        job.preplanned = []
+        if state != job.start:
+            # Limits were checked from the projected coordinates
+            job.program.validate(state[0])
+
+        def blocks():
+            for block in preplanned:
+                yield block
+            if len(preplanned) < len(job.gcodes):
+                start = (preplanned[-1].end, preplanned[-1].plane) if preplanned else state
+                planner = BlockPlanner(self.processes)
+                remaining = planner.plan(job.gcodes[len(preplanned):], *start)
+                try:
+                    for block in remaining:
+                        yield block
+                finally:
+                    remaining.close()
+
+        for block in blocks():
+            if job.cancelled:
+                break
+            machine.run_block(block)
+            job.blocks_done += 1
+
+    async def _prepare_jobs(self):
+        """Prepares submitted jobs in submission order."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._prepare_queue.get()
+            if not job.cancelled:
+                try:
+                    await loop.run_in_executor(None, self._prepare, job, self._projected)
+                    self._projected = job.end
+                    job.status = "ready"
+                except Exception as e:
+                    job.status = "failed"
+                    job.error = str(e)
+                    self.logger.error("Job %d failed: %s", job.id, e)
+            await self._run_queue.put(job)
+
+    async def _run_jobs(self):
+        """Executes prepared jobs one after another."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._run_queue.get()
+            if job.status != "ready" or job.cancelled:
+                continue
+            job.status = "running"
+            job.started = time.time()
+            self.logger.info("Running job %d: %s", job.id, job.gcode_file)
+            try:
+                self._executing = loop.run_in_executor(None, self._execute, job)
+                await asyncio.shield(self._executing)
+                job.status = "cancelled" if job.cancelled else "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.logger.error("Job %d failed: %s", job.id, e)
+            if job.status != "done":
+                # Queued jobs were prepared for a different end state and
+                # will be planned again when they are run
+                self._projected = (self._machine.get_coordinates(), self._machine.get_plane())
+            job.finished = time.time()
+            self.logger.info("Job %d %s after %.2fs", job.id, job.status,
+                             job.finished - job.started)
+
+    def _handle_request(self, request):
+        """Handles a single request and returns the response."""
+        cmd = request.get("cmd")
+        if cmd == "submit":
+            gcode_file = os.path.abspath(request["file"])
+            if not os.path.isfile(gcode_file):
+                return {"ok": False, "error": "File not found: {}".format(gcode_file)}
+            job = Job(next(self._ids), gcode_file)
+            self._jobs[job.id] = job
+            self._prepare_queue.put_nowait(job)
+            return {"ok": True, "job": job.id}
+        elif cmd == "status":
+            if "job" in request:
+                job = self._jobs.get(request["job"])
+                if job is None:
+                    return {"ok": False, "error": "Unknown job"}
+                return {"ok": True, "job": job.to_dict()}
+            return {
+                "ok": True,
+                "coordinates": self._machine.get_coordinates(),
+                "override": self._override.get(),
+                "jobs": [job.to_dict() for job in self._jobs.values()],
+            }
+        elif cmd == "cancel":
+            job = self._jobs.get(request.get("job"))
+            if job is None:
+                return {"ok": False, "error": "Unknown job"}
+            job.cancelled = True
+            if job.status in ("queued", "ready"):
+                job.status = "cancelled"
+            return {"ok": True}
+        elif cmd == "override":
+            self._override.set(float(request["percent"]))
+            return {"ok": True, "override": self._override.get()}
+        elif cmd == "clear_fault":
+            if self._executing is not None and not self._executing.done():
+                return {"ok": False, "error": "A job is running"}
+            fault = self._machine.clear_fault()
+            if fault is not None:
+                return {"ok": False, "error": fault.message}
+            # Coordinates are not known after an aborted block
+            self.logger.warning("Driver fault cleared, home the machine")
+            return {"ok": True}
+        elif cmd == "shutdown":
+            self._stopped.set()
+            return {"ok": True}
+        return {"ok": False, "error": "Unknown command: {}".format(cmd)}
+
+    async def _handle_client(self, reader, writer):
+        """Handles newline-delimited JSON requests of a client."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise TypeError("Request is not a JSON object")
+                    response = self._handle_request(request)
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+                if self._stopped.is_set():
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Serves requests until shutdown is requested."""
+        self._prepare_queue = asyncio.Queue()
+        self._run_queue = asyncio.Queue()
+        self._stopped = asyncio.Event()
+
+        self._override = FeedOverride(create=True)
+        self._machine = Machine(self._sx, self._sy, self._sz, self.debug, self._override)
+        self._projected = (self._machine.get_coordinates(), self._machine.get_plane())
+        self._sx.enable()
+        self._sy.enable()
+        self._sz.enable()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle_client, self.socket_path)
+        tasks = [
+            asyncio.ensure_future(self._prepare_jobs()),
+            asyncio.ensure_future(self._run_jobs()),
+        ]
+        self.logger.info("Controller listening on %s", self.socket_path)
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            for task in tasks:
+                task.cancel()
+            os.unlink(self.socket_path)
+            # Let a running block finish before disabling the drivers
+            for job in self._jobs.values():
+                job.cancelled = True
+            if self._executing is not None and not self._executing.done():
+                await self._executing
+            self._machine.close()
+            self._sx.disable()
+            self._sy.disable()
+            self._sz.disable()
+            self._override.close()
+
+
+def send(request, socket_path=cfg.CONTROLLER_SOCKET):
+    """Sends request to controller and returns the response."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b"\n")
+        response = b""
+        while not response.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            response += data
+    finally:
+        client.close()
+    return json.loads(response)
+
+
+def main():
+    parser = ArgumentParser(description="Runs controller or sends requests to it")
+    parser.add_argument("-s", "--socket", dest="socket",
+                        help="Controller socket path", default=cfg.CONTROLLER_SOCKET)
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    serve = subparsers.add_parser("serve", help="Run controller")
+    serve.add_argument("-d", "--debug", dest="debug",
+                       action="store_true", help="Set debug mode")
+    serve.add_argument("-j", "--jobs", dest="jobs", type=int,
+                       help="Number of processes planning blocks in parallel", default=cfg.PLANNER_PROCESSES)
+    serve.add_argument("-p", "--metrics-port", dest="metrics_port", type=int,
+                       help="Serve metrics in Prometheus format on local port", default=cfg.METRICS_PORT)
+    submit = subparsers.add_parser("submit", help="Queue GCode file")
+    submit.add_argument("file", help="input g-code file")
+    status = subparsers.add_parser("status", help="Show controller or job status")
+    status.add_argument("job", type=int, nargs="?", help="Job id")
+    cancel = subparsers.add_parser("cancel", help="Cancel job")
+    cancel.add_argument("job", type=int, help="Job id")
+    override = subparsers.add_parser("override", help="Set feed override")
+    override.add_argument("percent", type=float, help="Feed override in percent")
+    subparsers.add_parser("clear_fault", help="Clear driver fault after the cause has been removed")
+    subparsers.add_parser("shutdown", help="Stop controller")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        log_listener = log_queue.configure()
+        if args.metrics_port is not None:
+            metrics.REGISTRY.serve(args.metrics_port)
+        controller = Controller(args.debug, args.socket, args.jobs)
+        try:
+            asyncio.run(controller.serve())
+        finally:
+            metrics.REGISTRY.shutdown()
+            log_listener.stop()
+        if not args.debug:
+            import RPi.GPIO as GPIO
+            GPIO.cleanup()
+        return
+
+    request = {"cmd": args.cmd}
+    if args.cmd == "submit":
+        request["file"] = args.file
+    elif args.cmd in ("status", "cancel") and args.job is not None:
+        request["job"] = args.job
+    elif args.cmd == "override":
+        request["percent"] = args.percent
+    print(json.dumps(send(request, args.socket), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import logging
+import threading
+import time
+
+import config as cfg
+from DRV8711 import STATUS_FIELDS
+import metrics
+
+
+class DriverFault(Exception):
+    """Exception raised if a driver reports a fault or stall."""
+
+    def __init__(self, axis, status):
+        self.axis = axis
+        self.status = status
+        self.message = "Driver fault on axis {}: {}".format(
+            axis, ", ".join(field for field in STATUS_FIELDS if status.get(field)))
+        Exception.__init__(self, self.message)
+
+
+class FaultMonitor(object):
+    """
+    Background thread polling the STATUS register of DRV8711 drivers.
+
+    On a fault or stall the shared abort flag is set, the step executors
+    check it before every step and stop emitting pulses.
+
+    Attributes:
+        fault (DriverFault): First detected fault, None if no fault occurred
+        detected (float): Timestamp of fault detection
+    """
+
+    def __init__(self, devices, abort, rate=cfg.FAULT_MONITOR_RATE, mask=cfg.FAULT_MONITOR_MASK):
+        """
+        Parameters:
+            devices (dict): DRV8711 drivers by axis name
+            abort (RawValue): Shared flag set on fault
+            rate (float): Polls per second and driver
+            mask (int): STATUS bits treated as fault
+        """
+        self._devices = devices
+        self._abort = abort
+        self._period = 1.0 / rate
+        self._mask = mask
+        self._stop = threading.Event()
+        self._thread = None
+        self._logger = logging.getLogger("main")
+        self.fault = None
+        self.detected = None
+
+    def poll(self):
+        """Reads STATUS of all drivers and sets abort flag on fault.
+
+        Returns:
+            fault (DriverFault): Detected fault or None
+        """
+        for axis, device in self._devices.items():
+            t = time.perf_counter()
+            status = device.read_register("STATUS", refresh=True)
+            metrics.FAULT_POLL_SECONDS.observe(time.perf_counter() - t)
+            if status & self._mask:
+                self._abort.value = 1
+                self.detected = time.time()
+                self.fault = DriverFault(axis, device.get_status(refresh=False))
+                metrics.DRIVER_FAULTS.inc(axis=axis)
+                self._logger.error("%s", self.fault.message)
+                return self.fault
+        return None
+
+    def _run(self):
+        deadline = time.perf_counter()
+        while not self._stop.is_set():
+            if self.poll() is not None:
+                break
+            deadline += self._period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                deadline = time.perf_counter()
+
+    def start(self):
+        """Starts polling."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops polling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        """Clears latched driver flags and the abort flag, restarts polling
+        if STATUS read back after clearing reports no fault.
+
+        Returns:
+            fault (DriverFault): Fault still reported after clearing or None
+        """
+        self.stop()
+        for device in self._devices.values():
+            device.clear_status()
+        self.fault = None
+        self.detected = None
+        self._abort.value = 0
+        fault = self.poll()
+        if fault is None:
+            self.start()
+        return fault
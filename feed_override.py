@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import os
+import struct
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import config as cfg
+
+
+def _is_running(pid):
+    """Checks if a process with pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FeedOverride(object):
+    """
+    Live feed rate override held in named shared memory.
+
+    The override is stored as a transition from a start factor to a target
+    factor beginning at a point in time. The effective factor moves towards
+    the target at cfg.FEED_OVERRIDE_RAMP percent per second, so changes never
+    cause a velocity jump. As the factor is a function of wall clock time,
+    all step executors see the same factor at the same time and stay
+    synchronized.
+
+    Memory layout: sequence counter, start factor, target factor, change time,
+    process id of the creating process. Writers make the counter odd while
+    updating, readers retry until they read an even, unchanged counter.
+    """
+
+    _layout = struct.Struct("<Qddd")
+    _owner_pid = struct.Struct("<q")
+
+    def __init__(self, name=cfg.FEED_OVERRIDE_SHM, create=False, percent=100.0):
+        self._name = name
+        self._owner = create
+        self._rate = cfg.FEED_OVERRIDE_RAMP / 100.0
+        self._min = cfg.FEED_OVERRIDE_LIMITS[0] / 100.0
+        self._max = cfg.FEED_OVERRIDE_LIMITS[1] / 100.0
+
+        if create:
+            size = self._layout.size + self._owner_pid.size
+            try:
+                self._shm = SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                self._unlink_stale(name)
+                self._shm = SharedMemory(name, create=True, size=size)
+            self._owner_pid.pack_into(self._shm.buf, self._layout.size, os.getpid())
+            factor = self._clamp(percent / 100.0)
+            self._write(factor, factor, time.time())
+        else:
+            self._shm = SharedMemory(name)
+            # Only the creating process may unlink the segment
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+    def _unlink_stale(self, name):
+        """Removes segment of a run that did not exit cleanly.
+        Raises RuntimeError if the process that created it is still running."""
+        stale = SharedMemory(name)
+        try:
+            pid = 0
+            if stale.size >= self._layout.size + self._owner_pid.size:
+                pid = self._owner_pid.unpack_from(stale.buf, self._layout.size)[0]
+            if pid > 0 and _is_running(pid):
+                # Only the creating process may unlink the segment
+                resource_tracker.unregister(stale._name, "shared_memory")
+                raise RuntimeError("Feed override {} is in use by process {}".format(name, pid))
+            stale.unlink()
+        finally:
+            stale.close()
+
+    def _clamp(self, factor):
+        return min(max(factor, self._min), self._max)
+
+    def _write(self, start, target, t0):
+        buf = self._shm.buf
+        seq = struct.unpack_from("<Q", buf)[0]
+        struct.pack_into("<Q", buf, 0, seq + 1)
+        struct.pack_into("<ddd", buf, 8, start, target, t0)
+        struct.pack_into("<Q", buf, 0, seq + 2)
+
+    def _read(self):
+        buf = self._shm.buf
+        unpack_from = self._layout.unpack_from
+        while True:
+            seq, start, target, t0 = unpack_from(buf)
+            if not seq & 1 and unpack_from(buf)[0] == seq:
+                return start, target, t0
+
+    def factor(self, now=None):
+        """Gets effective override factor at time now."""
+        if now is None:
+            now = time.time()
+        start, target, t0 = self._read()
+        delta = self._rate * (now - t0)
+        if target > start:
+            return min(start + delta, target)
+        return max(start - delta, target)
+
+    def get(self):
+        """Gets target override in percent."""
+        return self._read()[1] * 100.0
+
+    def set(self, percent):
+        """Sets override in percent, the transition is ramp limited."""
+        now = time.time()
+        self._write(self.factor(now), self._clamp(percent / 100.0), now)
+
+    def close(self):
+        """Closes shared memory, the creating process also removes it."""
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def main():
+    parser = ArgumentParser(description="Sets feed override of running job")
+    parser.add_argument("percent", type=float, nargs="?",
+                        help="Feed override in percent, prints current value if omitted")
+    args = parser.parse_args()
+
+    try:
+        override = FeedOverride()
+    except FileNotFoundError:
+        print("Error: No running job found")
+        return
+
+    if args.percent is not None:
+        override.set(args.percent)
+    print("Feed override: {:.0f}%".format(override.get()))
+    override.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,10 @@ class GCode(object):
         else:
             return None
 
+    def keys(self):
+        """Gets names of parameters."""
+        return set(self._params)
+
     def __eq__(self, other):
         """Method to allow comparison to other gcode objects.
         Required for unit testing."""
@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 
-import config as cfg
+import time
+
+from kinematics import AXES
+import metrics
+from tracing import TRACER
 from gcode import GCode
 
-from gcode_exceptions import DuplicateGCodeError, GCodeNotFoundError, InvalidGCodeError, MissingGCodeError, UnsupportedGCodeError, GCodeOutOfBoundsError
+from gcode_exceptions import DuplicateGCodeError, GCodeError, GCodeNotFoundError, InvalidGCodeError, MissingGCodeError, UnsupportedGCodeError, GCodeOutOfBoundsError
+
+# Version of the parsing rules, invalidates cached programs when changed
+PARSER_VERSION = 1
 
 supported_gcodes = {
     "00": "Rapid positioning",
@@ -30,18 +37,33 @@ class GCodeParser(object):
     @ staticmethod
     def read_lines(gcode_file):
         """Parses gcode file and creates gcode list."""
+        t = time.time()
         gcode_list = []
         with open(gcode_file) as inf:
-            for line in inf:
-                params = GCodeParser.parse_line(line)
+            for number, line in enumerate(inf, 1):
+                with TRACER.span("parse", "parse", line=number):
+                    params = GCodeParser.parse_line(line)
                 if params:
                     gcode = GCode(params)
                     gcode_list.append(gcode)
+        metrics.PARSE_FILE_SECONDS.observe(time.time() - t)
         return gcode_list
 
     @ staticmethod
-    def parse_line(line):
-        """Parses one line from gcode file."""
+    def parse_line(line, check_limits=True):
+        """Parses one line from gcode file.
+        Programs validated as a whole (see program.py) skip the axis limit check.
+        """
+        try:
+            params = GCodeParser._parse_line(line, check_limits)
+        except GCodeError as e:
+            metrics.PARSE_ERRORS.inc(error=type(e).__name__)
+            raise
+        metrics.LINES_PARSED.inc()
+        return params
+
+    @ staticmethod
+    def _parse_line(line, check_limits=True):
         line = line.strip()
         params = {}
         if not line:
@@ -65,16 +87,9 @@ class GCodeParser(object):
             if not is_number(val):
                 raise InvalidGCodeError(line, "Invalid parameter value")
 
-            # Check if X, Y, Z parameters fall in axis range
-            if key in ("XYZ"):
-                limits = None
-                if key == "X":
-                    limits = cfg.AXIS_LIMITS_X
-                elif key == "Y":
-                    limits = cfg.AXIS_LIMITS_Y
-                elif key == "Z":
-                    limits = cfg.AXIS_LIMITS_Z
-                if not limits[0] <= float(val) <= limits[1]:
+            # Check if axis parameters fall in axis range
+            if check_limits and key in AXES:
+                if not AXES[key].in_limits(float(val)):
                     raise GCodeOutOfBoundsError(
                         line, "GCode out of bounds")
 
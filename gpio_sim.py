@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""Simulated GPIO backend implementing the subset of the RPi.GPIO
+interface used by the controller. Pin changes are recorded together
+with their timestamp, so step output can be inspected without hardware.
+"""
+
+import time
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+_mode = None
+_pins = {}
+events = []
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def getmode():
+    return _mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def setup(channels, direction, initial=LOW):
+    for channel in _as_list(channels):
+        _pins[channel] = initial
+
+
+def output(channels, values):
+    channels = _as_list(channels)
+    values = _as_list(values)
+    if len(values) == 1:
+        values = values * len(channels)
+    now = time.time()
+    for channel, value in zip(channels, values):
+        _pins[channel] = int(bool(value))
+        events.append((now, channel, int(bool(value))))
+
+
+def input(channel):
+    return _pins.get(channel, LOW)
+
+
+def cleanup(channels=None):
+    if channels is None:
+        _pins.clear()
+    else:
+        for channel in _as_list(channels):
+            _pins.pop(channel, None)
+
+
+class PWM(object):
+    """Simulated PWM output. Pulses are recorded as pin events when the
+    frequency changes or the output stops, one per started cycle.
+    """
+
+    def __init__(self, channel, frequency):
+        self._channel = channel
+        self._frequency = float(frequency)
+        self._duty = 0.0
+        self._started = None
+        # Cycles since start and number of recorded pulses
+        self._cycles = 0.0
+        self._pulses = 0
+
+    def _record(self, now):
+        t0 = self._started
+        c0 = self._cycles
+        self._cycles += (now - t0) * self._frequency
+        period = 1.0 / self._frequency
+        # Pulses rise at the start of each cycle
+        for n in range(self._pulses, int(self._cycles) + 1):
+            t = t0 + (n - c0) * period
+            events.append((t, self._channel, HIGH))
+            events.append((t + period * self._duty / 100.0, self._channel, LOW))
+        self._pulses = int(self._cycles) + 1
+        self._started = now
+
+    def start(self, duty):
+        self._duty = duty
+        self._started = time.time()
+        self._cycles = 0.0
+        self._pulses = 0
+
+    def ChangeFrequency(self, frequency):
+        if self._started is not None:
+            self._record(time.time())
+        self._frequency = float(frequency)
+
+    def ChangeDutyCycle(self, duty):
+        self._duty = duty
+
+    def stop(self):
+        if self._started is not None:
+            self._record(time.time())
+            self._started = None
+        _pins[self._channel] = LOW
+
+
+def reset():
+    """Clears recorded pin events."""
+    del events[:]
+
+
+def rising_edges(channel):
+    """Returns timestamps of rising edges recorded on channel."""
+    edges = []
+    level = LOW
+    for t, pin, value in events:
+        if pin != channel:
+            continue
+        if value and not level:
+            edges.append(t)
+        level = value
+    return edges
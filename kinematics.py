@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+
+try:
+    import numpy as np
+except ImportError:
+    # Conversions of sequences fall back to lists
+    np = None
+
+import config as cfg
+
+# Maximum number of cached ramps per axis
+RAMP_CACHE_SIZE = 256
+
+
+class Axis(object):
+    """
+    Kinematic parameters of an axis, built once from config.
+
+    Conversions accept numbers as well as sequences or arrays of numbers.
+
+    Attributes:
+        name (str): Axis name
+        step_angle (float): Stepper step angle in degrees
+        mode (int): Stepper microstepping mode
+        lead (float): Axis lead in mm (degrees for rotary axes) per revolution
+        steps_per_mm (float): Steps per mm
+        traversal (float): Max velocity in mm/min
+        feed (float): Default feed rate in mm/min
+        acceleration (float): Max acceleration in mm/s^2
+        jerk (float): Max jerk in mm/s^3
+        ramp_type (str): Ramp type, see ramp_generators in motion_planner.py
+        limits (tuple): Soft limits in mm
+        inverted (bool): Axis polarity is inverted
+        ramps (dict): Cached ramps by velocity, start velocity, acceleration and jerk
+    """
+
+    def __init__(self, name, step_angle, mode, lead, traversal, feed, acceleration,
+                 jerk, ramp_type, limits, inverted=False):
+        self.name = name
+        self.step_angle = step_angle
+        self.mode = mode
+        self.lead = lead
+        self.steps_per_mm = mode * 360.0 / step_angle / lead
+        self.traversal = traversal
+        self.feed = feed
+        self.acceleration = acceleration
+        self.jerk = jerk
+        self.ramp_type = ramp_type
+        self.limits = tuple(limits)
+        self.inverted = inverted
+        self.ramps = {}
+
+    @classmethod
+    def from_config(cls, name):
+        """Creates axis from the config constants suffixed with its name."""
+        def get(prefix):
+            return getattr(cfg, "{}_{}".format(prefix, name))
+        return cls(name, get("STEPPER_STEP_ANGLE"), get("STEPPER_MODE"), get("AXIS_LEAD"),
+                   get("AXIS_TRAVERSAL_MM_PER_MIN"), get("AXIS_FEED_MM_PER_MIN"),
+                   get("AXIS_ACCELERATION"), get("AXIS_JERK"), get("AXIS_RAMP_TYPE"),
+                   get("AXIS_LIMITS"), get("AXIS_POLARITY"))
+
+    @property
+    def max_pps(self):
+        """Max step rate in steps/s."""
+        return self.mm_per_min_to_pps(self.traversal)
+
+    def mm_to_steps(self, value):
+        """Converts distance in mm to steps."""
+        if isinstance(value, (int, float)):
+            return int(round(value * self.steps_per_mm))
+        if np is not None:
+            return np.rint(np.asarray(value, dtype=float) * self.steps_per_mm).astype(np.int64)
+        return [int(round(val * self.steps_per_mm)) for val in value]
+
+    def steps_to_mm(self, steps):
+        """Converts steps to distance in mm."""
+        if isinstance(steps, (int, float)):
+            return steps / self.steps_per_mm
+        if np is not None:
+            return np.asarray(steps, dtype=float) / self.steps_per_mm
+        return [val / self.steps_per_mm for val in steps]
+
+    def mm_per_min_to_pps(self, value):
+        """Converts velocity in mm/min to steps/s."""
+        if isinstance(value, (int, float)):
+            return value / 60.0 * self.steps_per_mm
+        if np is not None:
+            return np.asarray(value, dtype=float) / 60.0 * self.steps_per_mm
+        return [val / 60.0 * self.steps_per_mm for val in value]
+
+    def in_limits(self, value):
+        """Checks if positions in mm are within the soft limits."""
+        lo, hi = self.limits
+        if isinstance(value, (int, float)):
+            return lo <= value <= hi
+        if np is not None:
+            value = np.asarray(value, dtype=float)
+            return (value >= lo) & (value <= hi)
+        return [lo <= val <= hi for val in value]
+
+    def cache_ramp(self, key, ramp):
+        """Caches ramp, the cache is emptied once it is full."""
+        if len(self.ramps) >= RAMP_CACHE_SIZE:
+            self.ramps.clear()
+        self.ramps[key] = ramp
+
+
+# Axes of the machine by name
+AXES = {name: Axis.from_config(name) for name in cfg.AXES}
+
+
+def axis(key):
+    """Returns axis by name, case-insensitive."""
+    return AXES[key.upper()]
+
+
+def main():
+    parser = ArgumentParser(description="Prints kinematic parameters of the axes")
+    parser.parse_args()
+
+    for a in AXES.values():
+        print("{}: {:.1f} steps/mm, {:.0f} mm/min ({:.0f} steps/s), {:.0f} mm/s^2, "
+              "{} ramp, limits {}{}".format(
+                  a.name, a.steps_per_mm, a.traversal, a.max_pps, a.acceleration,
+                  a.ramp_type, a.limits, ", inverted" if a.inverted else ""))
+
+
+if __name__ == "__main__":
+    main()
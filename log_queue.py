@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import copy
+import json
+import logging
+import logging.config
+import logging.handlers
+from multiprocessing import Process
+from multiprocessing import Queue
+import signal
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler deferring message formatting to the listener.
+
+    Records are sent with message and arguments unformatted, arguments
+    which might not be picklable are converted to strings.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            record.args = tuple(arg if isinstance(arg, _PLAIN_TYPES) else str(arg)
+                                for arg in record.args)
+        elif record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _listen(queue, config):
+    """Handles records from queue with handlers configured in listener process."""
+    # Keep draining the queue until the sentinel on interrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.config.dictConfig(config)
+    while True:
+        record = queue.get()
+        if record is None:
+            break
+        logging.getLogger(record.name).handle(record)
+
+
+class LogListener(object):
+    """
+    Background process writing log records.
+
+    Attributes:
+        loggers (list): Names of loggers routed to the listener
+    """
+
+    def __init__(self, config):
+        self._queue = Queue()
+        self._process = Process(target=_listen, args=(self._queue, config),
+                                daemon=True)
+        self._process.start()
+        self._handler = _QueueHandler(self._queue)
+        self.loggers = list(config.get("loggers", {}))
+        for name, logger_cfg in config.get("loggers", {}).items():
+            self._route(logging.getLogger(name), logger_cfg)
+        if "root" in config:
+            self.loggers.append("")
+            self._route(logging.getLogger(), config["root"])
+
+    def _route(self, logger, logger_cfg):
+        logger.setLevel(logger_cfg.get("level", logging.NOTSET))
+        logger.propagate = logger_cfg.get("propagate", True)
+        logger.handlers = [self._handler]
+        logger.disabled = False
+
+    def stop(self):
+        """Writes pending records and stops the listener process."""
+        for name in self.loggers:
+            logger = logging.getLogger(name)
+            if self._handler in logger.handlers:
+                logger.removeHandler(self._handler)
+        self._queue.put(None)
+        self._process.join()
+        self._queue.close()
+        self._queue.join_thread()
+
+
+def configure(path="logging.json"):
+    """Routes logging through a queue to a listener process.
+
+    Handlers, formatters and levels are configured from the logging
+    configuration file; the handlers run in the listener process so
+    log calls never block on I/O.
+
+    Parameters:
+        path (str): Path of logging configuration in dictConfig format
+
+    Returns:
+        LogListener: Listener to stop at shutdown
+    """
+    with open(path) as log_cfg:
+        config = json.load(log_cfg)
+    return LogListener(config)
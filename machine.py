@@ -2,27 +2,198 @@
 
 import json
 from multiprocessing import Process
+from multiprocessing import RawValue
+import time
 
 import config as cfg
-from stepper import Stepper
-from motion_planner import MotionPlanner
+import metrics
+from tracing import TRACER
+from block_planner import plan_block
+from fault_monitor import FaultMonitor
+from motion_planner import _cruise_segments
+from motion_planner import CRUISE
+import realtime
+import schedule_buffer
+from schedule_buffer import ScheduleBuffer
+
+
+def _count_steps(records, planned):
+    """Passes records through and counts the steps they plan.
+
+    Parameters:
+        records (iterable): Interval records of a block
+        planned (list): Single element list the step count is added to
+    """
+    cruise = False
+    for record in records:
+        i, dt = record
+        if i == CRUISE:
+            planned[0] += int(dt)
+            cruise = True
+        elif cruise:
+            cruise = False
+        elif i in (-1, 1):
+            planned[0] += 1
+        yield record
+
+
+def _execute(stepper, schedule, override, cores=None, abort=None, miscount=None):
+    """Steps motor through the blocks written to its schedule buffer.
+
+    Parameters:
+        stepper (Stepper): Stepper motor of the axis
+        schedule (ScheduleBuffer): Schedule buffer of the axis
+        override (FeedOverride): Live feed override applied to feed moves
+        cores (list): Cores to pin executor to in real-time mode
+        abort (RawValue): Shared flag stopping the movement on driver faults
+        miscount (RawValue): Shared flag set with abort if a block emitted
+            a different number of steps than planned
+    """
+    if cfg.REALTIME_ENABLED:
+        realtime.enter(cores)
+        schedule.pretouch()
+    while True:
+        start = schedule.read_start()
+        if start is None:
+            break
+        marker, t0 = start
+        time.sleep(max(t0 - time.time(), 0.0))
+        feed_override = override if marker == schedule_buffer.FEED_START else None
+        planned = [0]
+        records = _count_steps(schedule.read_block(), planned)
+        steps = stepper.step(records, feed_override, abort)
+        # Skip the rest of an aborted block
+        for _ in records:
+            pass
+        if abort is not None and not abort.value and steps != planned[0]:
+            if miscount is not None:
+                miscount.value = 1
+            abort.value = 1
 
 
 class Machine(object):
     """Machine class for GCode interpretation."""
 
-    def __init__(self, sx, sy, sz, debug):
+    def __init__(self, sx, sy, sz, debug, override=None):
         self._sx = sx
         self._sy = sy
         self._sz = sz
         self._plane = "XY"
 
         self._debug = debug
+        self._override = override
 
-        self.mp = MotionPlanner()
+        # End of previous block and start of first block for idle gaps
+        self._last_block_end = None
+        self._first_block_start = None
+        self._blocks = 0
 
         self._coordinates = self._load_coordinates()
 
+        self._schedules = []
+        self._executors = []
+
+        # Set by the fault monitor, stops the executors
+        self._abort = RawValue("b", 0)
+        # Set with abort by an executor that lost count of its steps
+        self._miscount = RawValue("b", 0)
+        self._monitor = None
+
+    def _start_executors(self):
+        """Starts a persistent step executor process for each motor
+        and the fault monitor of drivers with SPI interface."""
+        for axis, stepper in (("X", self._sx), ("Y", self._sy), ("Z", self._sz)):
+            schedule = ScheduleBuffer()
+            if cfg.REALTIME_ENABLED:
+                schedule.pretouch(write=True)
+            cores = cfg.REALTIME_CORES.get(axis)
+            executor = Process(target=_execute,
+                               args=(stepper, schedule, self._override, cores,
+                                     self._abort, self._miscount))
+            executor.daemon = True
+            executor.start()
+            self._schedules.append(schedule)
+            self._executors.append(executor)
+
+        devices = {}
+        for axis, stepper in (("X", self._sx), ("Y", self._sy), ("Z", self._sz)):
+            if stepper.get_device() is not None:
+                devices[axis] = stepper.get_device()
+        if devices:
+            self._monitor = FaultMonitor(devices, self._abort)
+            self._monitor.start()
+
+    def _check_fault(self):
+        """Raises DriverFault if the fault monitor stopped the motion,
+        RuntimeError if an executor emitted a different number of steps
+        than planned."""
+        if self._miscount.value:
+            raise RuntimeError("Step count differs from the planned block, "
+                               "coordinates are unknown")
+        if self._abort.value:
+            raise self._monitor.fault
+
+    def clear_fault(self):
+        """Clears driver fault after the cause has been removed.
+        Coordinates are not known after an aborted block, home the machine.
+
+        Returns:
+            fault (DriverFault): Fault still reported by a driver or None
+        """
+        self._miscount.value = 0
+        if self._monitor is not None:
+            return self._monitor.clear()
+        self._abort.value = 0
+        return None
+
+    def _write_schedules(self, block):
+        """Writes block to the schedule buffers, chunks are interleaved
+        so no executor runs out of intervals while others are written."""
+        marker = schedule_buffer.FEED_START if block.is_feed_move() else schedule_buffer.BLOCK_START
+        t0 = time.time() + cfg.SCHEDULE_START_DELAY
+        for schedule in self._schedules:
+            schedule.write_marker(marker, t0)
+        intervals = (block.ix, block.iy, block.iz)
+        if cfg.CRUISE_PWM_ENABLED:
+            intervals = [_cruise_segments(i, cfg.CRUISE_PWM_MIN_STEPS) for i in intervals]
+        offsets = [0, 0, 0]
+        while any(offset < len(i) for offset, i in zip(offsets, intervals)):
+            written = 0
+            for idx, schedule in enumerate(self._schedules):
+                n = schedule.write(intervals[idx], offsets[idx], cfg.SCHEDULE_BUFFER_CHUNK)
+                offsets[idx] += n
+                written += n
+            if not written:
+                self._check_executors()
+                time.sleep(cfg.SCHEDULE_BUFFER_POLL)
+        for schedule in self._schedules:
+            schedule.write_marker(schedule_buffer.BLOCK_END)
+
+    def _wait_schedules(self):
+        """Waits until the executors have read the whole block."""
+        while any(schedule.pending() for schedule in self._schedules):
+            self._check_executors()
+            time.sleep(cfg.SCHEDULE_BUFFER_POLL)
+
+    def _check_executors(self):
+        for executor in self._executors:
+            if not executor.is_alive():
+                raise RuntimeError("Step executor exited with code {}".format(executor.exitcode))
+
+    def close(self):
+        """Stops the step executors and removes their schedule buffers."""
+        if self._monitor is not None:
+            self._monitor.stop()
+            self._monitor = None
+        for schedule in self._schedules:
+            schedule.write_marker(schedule_buffer.STOP)
+        for executor in self._executors:
+            executor.join()
+        for schedule in self._schedules:
+            schedule.close()
+        self._schedules = []
+        self._executors = []
+
     def _load_coordinates(self):
         """Loads coordinates from JSON file."""
         with open(cfg.coord_file) as file_obj:
@@ -30,8 +201,11 @@ class Machine(object):
 
     def _save_coordinates(self):
         """Saves coordinates to JSON file."""
-        with open(cfg.coord_file, "w") as file_obj:
-            json.dump(self._coordinates, file_obj, indent=4, sort_keys=True)
+        t = time.time()
+        with TRACER.span("persist", "persist"):
+            with open(cfg.coord_file, "w") as file_obj:
+                json.dump(self._coordinates, file_obj, indent=4, sort_keys=True)
+        metrics.SAVE_SECONDS.observe(time.time() - t)
 
     def execute(self, gcode):
         """Executes GCode.
@@ -39,145 +213,57 @@ class Machine(object):
         Parameters:
             gcode (GCode): GCode object
         """
+        self.run_block(plan_block(gcode, self._coordinates, self._plane))
 
-        # Get gcode command
-        g = gcode.get("G")
-
-        # Init step intervals for X, Y and Z
-        ix = []
-        iy = []
-        iz = []
-
-        # Do action depending on GCode
-        # Rapid positioning
-        if g == "00":
-            x = gcode.get("X")
-            y = gcode.get("Y")
-            z = gcode.get("Z")
-            # Calculate axis deltas
-            dx = x - self._coordinates["X"] if x is not None else 0
-            dy = y - self._coordinates["Y"] if y is not None else 0
-            dz = z - self._coordinates["Z"] if z is not None else 0
-            vx = cfg.AXIS_TRAVERSAL_MM_PER_MIN_X
-            vy = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Y
-            vz = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Z
-            ds = (("x", dx), ("y", dy), ("z", dz))
-            v = (("x", vx), ("y", vy), ("z", vz))
-            ix, iy, iz = self.mp.plan_move(ds, v)
-
-        # Linear interpolation
-        elif g == "01":
-            f = gcode.get("F")
-            x = gcode.get("X")
-            y = gcode.get("Y")
-            z = gcode.get("Z")
-            # Calculate axis deltas
-            dx = x - self._coordinates["X"] if x is not None else 0
-            dy = y - self._coordinates["Y"] if y is not None else 0
-            dz = z - self._coordinates["Z"] if z is not None else 0
-            feed_rate = float(f) if f else cfg.AXIS_FEED_MM_PER_MIN_X
-
-            if x and y and not z:
-                delta = (("x", dx), ("y", dy))
-                ix, iy = self.mp.plan_interpolated_line(delta, feed_rate)
-            elif x and not y and z:
-                delta = (("x", dx), ("z", dz))
-                ix, iz = self.mp.plan_interpolated_line(delta, feed_rate)
-            elif not x and y and z:
-                delta = (("y", dy), ("z", dz))
-                iy, iz = self.mp.plan_interpolated_line(delta, feed_rate)
-            else:
-                print("Error in GCode! 3D linear interpolation not yet implemented")
-
-        # Circular interpolation
-        elif g in ("02", "03"):
-            f = gcode.get("F")
-            i = gcode.get("I")
-            j = gcode.get("J")
-            k = gcode.get("K")
-            r = gcode.get("R")
-            x = gcode.get("X")
-            y = gcode.get("Y")
-            z = gcode.get("Z")
-            # Calculate axis deltas
-            dx = x - self._coordinates["X"] if x is not None else 0
-            dy = y - self._coordinates["Y"] if y is not None else 0
-            dz = z - self._coordinates["Z"] if z is not None else 0
-
-            cw = True if g == "02" else False
-            feed_rate = float(f) if f else cfg.AXIS_FEED_MM_PER_MIN_X
-            if self._plane == "XY":
-                xs = -i if i else 0
-                ys = -j if j else 0
-                if not r:
-                    r = math.sqrt(xs*xs + ys*ys)
-                ds = (("x", xs), ("y", ys))
-                de = (("x", dx), ("y", dy))
-                ix, iy = self.mp.plan_interpolated_arc(
-                    r, ds, de, feed_rate, cw
-                )
-            elif self._plane == "XZ":
-                if i and k and not r:
-                    r = math.sqrt(i*i + k*k)
-                    x_start = -i
-                    z_start = -k
-                ix, iz = self.mp.plan_interpolated_arc(
-                    r, x_start, z_start, dx, dz, feed_rate, cw
-                )
-            elif self._plane == "YZ":
-                if j and k and not r:
-                    r = math.sqrt(j*j + k*k)
-                    y_start = -j
-                    z_start = -k
-                iy, iz = self.mp.plan_interpolated_arc(
-                    r, y_start, z_start, dy, dz, feed_rate, cw
-                )
-            else:
-                print("Error in GCode! 3D circular interpolation not yet implemented")
-
-        # XY plane selection
-        elif g == "17":
-            self._plane = "XY"
-
-        # XZ plane selection
-        elif g == "18":
-            self._plane = "XZ"
-
-        # YZ plane selection
-        elif g == "19":
-            self._plane = "YZ"
-
-        # Homing
-        elif g == "28":
-            # Calculate new deltas based on axis limits
-            dx = cfg.AXIS_LIMITS_X[0] - self._coordinates["X"]
-            dy = cfg.AXIS_LIMITS_Y[0] - self._coordinates["Y"]
-            dz = cfg.AXIS_LIMITS_Z[0] - self._coordinates["Z"]
-            vx = cfg.AXIS_TRAVERSAL_MM_PER_MIN_X
-            vy = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Y
-            vz = cfg.AXIS_TRAVERSAL_MM_PER_MIN_Z
-            ds = (("x", dx), ("y", dy), ("z", dz))
-            v = (("x", vx), ("y", vy), ("z", vz))
-            ix, iy, iz = self.mp.plan_move(ds, v)
+    def get_coordinates(self):
+        """Gets current axis coordinates in mm."""
+        return dict(self._coordinates)
+
+    def get_plane(self):
+        """Gets selected plane."""
+        return self._plane
+
+    def run_block(self, block):
+        """Runs planned block.
+
+        Parameters:
+            block (Block): Planned block
+        """
+        t = time.time()
+        g = block.gcode.get("G")
+        if self._last_block_end is not None:
+            metrics.IDLE_SECONDS.observe(t - self._last_block_end)
+        else:
+            self._first_block_start = t
+        metrics.PLAN_SECONDS.observe(block.plan_time, gcode=g)
+        TRACER.add("plan:{}".format(block.planner), block.plan_start, block.plan_time,
+                   "plan", pid=block.plan_pid, block=str(block.gcode))
+        for axis, intervals in (("X", block.ix), ("Y", block.iy), ("Z", block.iz)):
+            metrics.PLANNED_STEPS.inc(len(intervals), axis=axis)
 
         if not self._debug:
-            # Creating a process for each motor handling step intervals
-            p1 = Process(target=self._sx.step, args=(ix,))
-            p2 = Process(target=self._sy.step, args=(iy,))
-            p3 = Process(target=self._sz.step, args=(iz,))
+            if not self._executors:
+                self._start_executors()
+            self._check_fault()
 
-            # Starting the processes
-            p1.start()
-            p2.start()
-            p3.start()
+            # Executors start stepping while the block is still being written
+            with TRACER.span("schedule write", "execute", block=str(block.gcode)):
+                self._write_schedules(block)
 
-            # Joining the processes
-            p1.join()
-            p2.join()
-            p3.join()
+            with TRACER.span("execute", "execute", block=str(block.gcode)):
+                self._wait_schedules()
+            # Coordinates are not updated, the axes stopped somewhere on the move
+            self._check_fault()
 
         # Update the coordinates
-        self._coordinates["X"] += dx
-        self._coordinates["Y"] += dy
-        self._coordinates["Z"] += dz
+        self._plane = block.plane
+        self._coordinates = dict(block.end)
         self._save_coordinates()
+
+        self._last_block_end = time.time()
+        self._blocks += 1
+        metrics.BLOCKS.inc(gcode=g)
+        metrics.EXECUTE_SECONDS.observe(self._last_block_end - t, gcode=g)
+        elapsed = self._last_block_end - self._first_block_start
+        if elapsed:
+            metrics.BLOCKS_PER_SECOND.set(self._blocks / elapsed)
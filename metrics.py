@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing.sharedctypes import RawArray
+import threading
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, val) for key, val in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    Base class of metrics with optional labels.
+
+    Attributes:
+        name (str): Metric name
+        documentation (str): Help text
+        labelnames (tuple): Names of labels
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        if registry is None:
+            registry = REGISTRY
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[key]) for key in self.labelnames)
+
+    def _labels(self, key):
+        return tuple(zip(self.labelnames, key))
+
+    def get(self, **labels):
+        """Gets value of labelled metric."""
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        """Returns (name, labels, value) tuples of metric."""
+        return [(self.name, self._labels(key), val)
+                for key, val in sorted(self._values.items())]
+
+    def reset(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)):
+        Metric.__init__(self, name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        data = self._values.get(key)
+        if data is None:
+            data = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = data[0]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        data[1] += value
+        data[2] += 1
+
+    def get(self, **labels):
+        """Gets number of observations of labelled metric."""
+        data = self._values.get(self._key(labels))
+        return data[2] if data else 0
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, val in zip(self.buckets, counts):
+                cumulative += val
+                samples.append((self.name + "_bucket",
+                                labels + (("le", _format_value(bound)),), cumulative))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class SharedCounter(Counter):
+    """Counter with a fixed set of label values kept in shared memory,
+    so increments made in forked processes are visible to the parent.
+    Each label value has its own slot, processes updating different
+    label values do not need a lock."""
+
+    def __init__(self, name, documentation, labelname, values, registry=None):
+        Counter.__init__(self, name, documentation, (labelname,), registry)
+        self._index = dict((str(val), idx) for idx, val in enumerate(values))
+        self._shared = RawArray("d", len(values))
+
+    def inc(self, amount=1, **labels):
+        idx = self._index.get(str(labels[self.labelnames[0]]))
+        if idx is not None:
+            self._shared[idx] += amount
+
+    def get(self, **labels):
+        idx = self._index.get(str(labels[self.labelnames[0]]))
+        return self._shared[idx] if idx is not None else 0.0
+
+    def samples(self):
+        return [(self.name, ((self.labelnames[0], val),), self._shared[idx])
+                for val, idx in sorted(self._index.items())]
+
+    def reset(self):
+        for idx in range(len(self._shared)):
+            self._shared[idx] = 0
+
+
+class Registry(object):
+    """Collection of metrics exported in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._server = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """Renders all metrics in Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Writes all metrics to file."""
+        with open(path, "w") as outf:
+            outf.write(self.render())
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+    def serve(self, port, address="127.0.0.1"):
+        """Serves metrics over HTTP from a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer((address, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+REGISTRY = Registry()
+
+# Parser
+LINES_PARSED = Counter(
+    "gcode_lines_parsed_total", "Number of parsed GCode lines")
+PARSE_ERRORS = Counter(
+    "gcode_parse_errors_total", "Number of rejected GCode lines", ("error",))
+PARSE_FILE_SECONDS = Histogram(
+    "gcode_file_parse_seconds", "Time spent parsing GCode files")
+
+# Planner
+PLAN_SECONDS = Histogram(
+    "planner_block_seconds", "Planning latency per block type", ("gcode",))
+PLANNED_STEPS = Counter(
+    "planner_steps_total", "Number of planned steps per axis", ("axis",))
+
+# Executor
+BLOCKS = Counter(
+    "machine_blocks_total", "Number of executed blocks per block type", ("gcode",))
+EXECUTE_SECONDS = Histogram(
+    "machine_block_seconds", "Execution time per block type", ("gcode",))
+IDLE_SECONDS = Histogram(
+    "machine_idle_seconds", "Idle gap between consecutive blocks")
+SAVE_SECONDS = Histogram(
+    "machine_save_coordinates_seconds", "Time spent saving coordinates")
+BLOCKS_PER_SECOND = Gauge(
+    "machine_blocks_per_second", "Executed blocks per second of current job")
+
+# Fault monitor
+FAULT_POLL_SECONDS = Histogram(
+    "fault_monitor_poll_seconds", "Time spent reading driver STATUS over SPI",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005))
+DRIVER_FAULTS = Counter(
+    "driver_faults_total", "Number of detected driver faults and stalls", ("axis",))
+
+# Steppers
+STEPS = SharedCounter(
+    "stepper_steps_total", "Number of emitted steps per axis", "axis", ("X", "Y", "Z"))
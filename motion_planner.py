@@ -1,10 +1,20 @@
 #!/usr/bin/env python
 
 from argparse import ArgumentParser
+from itertools import groupby
 import logging
 import math
 
 import config as cfg
+import kinematics
+
+# Direction value of step interval records switching the microstepping
+# mode of the motor, the interval holds the new mode
+MODE_SWITCH = 2
+
+# Direction value of step interval records starting a cruise segment,
+# the interval holds the number of repetitions of the following record
+CRUISE = 3
 
 
 def _mm_to_steps(value, step_angle, mode, lead):
@@ -15,12 +25,7 @@ def _mm_to_steps(value, step_angle, mode, lead):
 
 
 def _mm_to_steps_ax(key, value):
-    if key == "x":
-        return _mm_to_steps(value, cfg.STEPPER_STEP_ANGLE_X, cfg.STEPPER_MODE_X, cfg.AXIS_LEAD_X)
-    elif key == "y":
-        return _mm_to_steps(value, cfg.STEPPER_STEP_ANGLE_Y, cfg.STEPPER_MODE_Y, cfg.AXIS_LEAD_Y)
-    elif key == "z":
-        return _mm_to_steps(value, cfg.STEPPER_STEP_ANGLE_Z, cfg.STEPPER_MODE_Z, cfg.AXIS_LEAD_Z)
+    return kinematics.axis(key).mm_to_steps(value)
 
 
 def _mm_per_min_to_pps(value, step_angle, mode, lead):
@@ -30,15 +35,10 @@ def _mm_per_min_to_pps(value, step_angle, mode, lead):
 
 
 def _mm_per_min_to_pps_ax(key, value):
-    if key == "x":
-        return _mm_per_min_to_pps(value, cfg.STEPPER_STEP_ANGLE_X, cfg.STEPPER_MODE_X, cfg.AXIS_LEAD_X)
-    elif key == "y":
-        return _mm_per_min_to_pps(value, cfg.STEPPER_STEP_ANGLE_Y, cfg.STEPPER_MODE_Y, cfg.AXIS_LEAD_Y)
-    elif key == "z":
-        return _mm_per_min_to_pps(value, cfg.STEPPER_STEP_ANGLE_Z, cfg.STEPPER_MODE_Z, cfg.AXIS_LEAD_Z)
+    return kinematics.axis(key).mm_per_min_to_pps(value)
 
 
-def _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel):
+def _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel, v0=0.0, jerk=None):
     """Generates pulses for trapezoidal ramp curve based on constant acceleration.
 
     Parameters:
@@ -47,6 +47,8 @@ def _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel):
         step_angle (float): Stepper step angle
         lead (int): Axis lead
         accel (float): Acceleration in mm/s^2
+        v0 (float): Start velocity of acceleration phase
+        jerk (float): Unused, accepted for a uniform generator signature
 
     Returns:
         c (list): Step timing intervals for each step during acceleration
@@ -64,20 +66,26 @@ def _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel):
     angle = 2 * pi / spr
     # Convert target velocity from mm/min to rad/s
     w = vm / 60.0 * steps_per_mm * angle
+    w0 = v0 / 60.0 * steps_per_mm * angle
+    if w0 >= w:
+        return [angle / w]
     # Convert acceleration from mm/s^2 to rad/s^2
     a = accel * steps_per_mm * angle
+    # Number of steps it would have taken to accelerate from rest to w0
+    # [k = w0^2 / (2 * rotation_angle * a)]
+    k = w0**2 / (2 * angle * a)
     # Calculation of number of steps needed to accelerate/decelerate
     # vf = final velocity (rad/s)
     # a = acceleration (rad/s^2)
     # [n_steps = vf^2 / (2 * rotation_angle * a)]
-    num_steps = int(round(w**2 / (2 * angle * a)))
+    num_steps = int(round(w**2 / (2 * angle * a) - k))
     # Calculation of initial step duration during acceleration/deceleration ph\ase
     # [c0 = (f=1) * sqrt(2 * rotation_angle / a)]
     c0 = sqrt(2 * angle / a)
     # Add time intervals for steps to achieve linear acceleration
-    c = [round(c0, 6)]
+    c = [round(c0 * (sqrt(k+1) - sqrt(k)), 6)]
     for i in range(1, num_steps):
-        cn = c0 * (sqrt(i+1) - sqrt(i))
+        cn = c0 * (sqrt(i+k+1) - sqrt(i+k))
         c.append(round(cn, 6))
     # Get the total duration of all acceleration steps
     # should be [t_a = cf/a]
@@ -86,7 +94,7 @@ def _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel):
     return c
 
 
-def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel):
+def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel, v0=0.0, jerk=None):
     """Generates pulses for sigmoidal ramp curve based on constant acceleration.
 
     Parameters:
@@ -95,6 +103,8 @@ def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel):
         step_angle (float): Stepper step angle
         lead (int): Axis lead
         accel (float): Acceleration in mm/s^2
+        v0 (float): Start velocity of acceleration phase
+        jerk (float): Unused, accepted for a uniform generator signature
 
     Returns:
         c (list): Step timing intervals for each step during acceleration
@@ -115,6 +125,9 @@ def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel):
     angle = 2 * pi / spr
     # Convert target velocity from mm/min to rad/s
     w = vm / 60.0 * steps_per_mm * angle
+    w0 = v0 / 60.0 * steps_per_mm * angle
+    if w0 >= w:
+        return [angle / w]
     # Convert acceleration from mm/s^2 to rad/s^2
     a = accel * steps_per_mm * angle
     ti = 0.4
@@ -125,16 +138,28 @@ def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel):
     e_n = e**(a_4_w*angle/w)
     t_mod = ti - w_4_a * log(0.005)
 
+    # Number of steps already covered on the sigmoid when w0 is reached
+    # [t0 = ti - w/(4a) * ln(w/w0 - 1)]
+    # The sigmoid starts at [w / (e^(4a/w * ti) + 1)], lower start
+    # velocities start the ramp from there
+    k = 0
+    if w0 > w / (e_ti + 1):
+        t0 = ti - w_4_a * log(w / w0 - 1)
+        k = max(w**2 * (log(e**(a_4_w*t0) + e_ti) - log(e_ti + 1)) / (4*a*angle), 0.0)
+
     num_steps = int(round(
-        w**2 * (log(e**(a_4_w*t_mod) + e_ti) - log(e_ti + 1)) / (4*a*angle)))
+        w**2 * (log(e**(a_4_w*t_mod) + e_ti) - log(e_ti + 1)) / (4*a*angle) - k))
 
     c = []
-    for i in range(1, num_steps):
+    for i in range(0 if k else 1, num_steps):
         cn = w_4_a * \
-            log(((e_ti + 1) * e_n**(i+1) - e_ti) /
-                ((e_ti + 1) * e_n**i - e_ti))
+            log(((e_ti + 1) * e_n**(i+k+1) - e_ti) /
+                ((e_ti + 1) * e_n**(i+k) - e_ti))
 
         c.append(cn)
+    # Start velocities within a step of the target velocity need no ramp
+    if not c:
+        return [angle / w]
     # Get the total duration of all acceleration steps
     # should be [t_a = cf/a]
     # c_total = sum(c)
@@ -142,8 +167,15 @@ def _configure_ramp_sigmoidal(vm, mode, step_angle, lead, accel):
     return c
 
 
-def _configure_ramp_polynomial(vm, mode, step_angle, lead, accel):
-    """Generates pulses for polynomial ramp curve based on constant acceleration.
+def _configure_ramp_scurve(vm, mode, step_angle, lead, accel, v0=0.0, jerk=None):
+    """Generates pulses for jerk-limited S-curve ramp.
+
+    The acceleration phase consists of a jerk-up section (acceleration
+    rises linearly), a constant acceleration section and a jerk-down section
+    (acceleration falls back to zero at the target velocity). Together with
+    the cruise section and the mirrored deceleration ramp applied by
+    _overlay_ramp this forms the 7-phase S-curve profile.
+    Without a jerk limit the profile degrades to a trapezoidal ramp.
 
     Parameters:
         vm (float): Target velocity after acceleration phase
@@ -151,95 +183,169 @@ def _configure_ramp_polynomial(vm, mode, step_angle, lead, accel):
         step_angle (float): Stepper step angle
         lead (int): Axis lead
         accel (float): Acceleration in mm/s^2
+        v0 (float): Start velocity of acceleration phase
+        jerk (float): Jerk in mm/s^3
 
     Returns:
         c (list): Step timing intervals for each step during acceleration
     """
+    if not jerk:
+        return _configure_ramp_trapezoidal(vm, mode, step_angle, lead, accel, v0)
 
-    pi = math.pi
     sqrt = math.sqrt
     # steps per revolution: microstepping mode as factor
     spr = 360.0 / step_angle * mode
     # Number of steps it takes to move axis 1mm
     steps_per_mm = spr / lead
-    # linear movement along the axes per step
-    # angle of rotation (phi) per step in rad: 2 * PI = 360 degrees
-    # [rotation_angle = 2 * PI / SPR]
-    step_angle_in_rad = 2 * pi / spr
-    # Convert target velocity from mm/min to rad/s
-    v3 = vm / 60 * steps_per_mm * step_angle_in_rad
-    # Convert acceleration from mm/s^2 to rad/s^2
-    accel_in_rad = accel * steps_per_mm * step_angle_in_rad
-    # Calculation of number of steps needed to accelerate/decelerate
-    # Concave segment
-
-    v1 = v3 / 4
-    v2 = v3 * 3 / 4
-    print("a(T/2) = {}".format(accel_in_rad))
-    print("v(0) = 0")
-    print("v(P1) = {}".format(v1))
-    print("v(P2) = {}".format(v2))
-    print("v(T) = {}".format(v3))
-    n1 = int(round(v1**2 / (step_angle_in_rad * accel_in_rad)))
-    n2 = int(round(v2**2 / (2 * accel_in_rad * step_angle_in_rad))) + n1
-    n3 = int(round(2 * v3**3 / (step_angle_in_rad * accel_in_rad**2))) + n2
-    print(n1, n2, n3)
-    ntotal = n3
-    # Add time intervals for steps to achieve linear acceleration
-
-    cn = 0
-    an = 0
-    period = "none"
+    # Convert velocities, acceleration and jerk to steps
+    w = vm / 60.0 * steps_per_mm
+    w0 = v0 / 60.0 * steps_per_mm
+    if w0 >= w:
+        return [1.0 / w]
+    a = accel * steps_per_mm
+    j = jerk * steps_per_mm
+
+    # Duration of jerk sections (t1) and constant acceleration section (t2).
+    # If the velocity difference is too small to reach full acceleration,
+    # the constant acceleration section vanishes and the peak is lowered.
+    dv = w - w0
+    if dv >= a * a / j:
+        t1 = a / j
+        t2 = dv / a - t1
+    else:
+        a = sqrt(dv * j)
+        t1 = a / j
+        t2 = 0.0
+    # Velocity and position at the end of each section
+    v1 = w0 + j * t1**2 / 2
+    s1 = w0 * t1 + j * t1**3 / 6
+    v2 = v1 + a * t2
+    s2 = s1 + v1 * t2 + a * t2**2 / 2
+    s3 = s2 + v2 * t1 + a * t1**2 / 2 - j * t1**3 / 6
+    t_end = 2 * t1 + t2
+
+    def position(t):
+        if t <= t1:
+            return w0 * t + j * t**3 / 6
+        elif t <= t1 + t2:
+            tau = t - t1
+            return s1 + v1 * tau + a * tau**2 / 2
+        elif t <= t_end:
+            tau = t - t1 - t2
+            return s2 + v2 * tau + a * tau**2 / 2 - j * tau**3 / 6
+        return s3 + w * (t - t_end)
+
+    def velocity(t):
+        if t <= t1:
+            return w0 + j * t**2 / 2
+        elif t <= t1 + t2:
+            return v1 + a * (t - t1)
+        elif t <= t_end:
+            tau = t - t1 - t2
+            return v2 + a * tau - j * tau**2 / 2
+        return w
+
+    num_steps = int(round(s3))
+
+    # Solve position(t) = n for each step n by safeguarded Newton iteration,
+    # the position is strictly increasing so the root is bracketed by the
+    # previous step and the end of the ramp plus one cruise step.
     c = []
-    for i in range(n3):
-        # Concave period of the acceleration curve
-        if i <= n1:
-            period = "concave"
-            an = (i+1) / float(n1+1) * accel_in_rad
-            c0 = (2 * step_angle_in_rad / an)**(1./3)
-            cn_i_plus_1 = (i + 1)**(1./3)
-            cn_i = (i)**(1./3)
-            cn = c0 * (cn_i_plus_1 - cn_i)
-            c.append(cn)
-        # Linear period of the acceleration curve
-        elif n1 < i <= n2:
-            period = "linear"
-            an = accel_in_rad
-            c0 = sqrt(2 * step_angle_in_rad / an)
-            cn_i_plus_1 = sqrt(i + 1)
-            cn_i = sqrt(i)
-            # TODO: the linear period underlies some y axis section
-            # parameter C has to be found => 2/step_angle?
-            ct = c0 * (cn_i_plus_1 - cn_i)
-            vt = 1 / ct * step_angle_in_rad - accel_in_rad / (v2 * 2)
-            cn = 1 / vt * step_angle_in_rad
-            c.append(cn)
-        # Convex period of the acceleration curve
-        # TODO: not perfectly fitting, needs to be investigated further
-        # maybe there is also some y axis section in the opposite direction
-        elif n2 < i < n3:
-            period = "convex"
-            an = ((n3) - (i-n2)) / float(n3) * accel_in_rad
-            c0 = (2 * step_angle_in_rad / an)**(1./3)
-            cn_i_plus_1 = (i + 1)**(1./3)
-            cn_i = (i)**(1./3)
-            ct = c0 * (cn_i_plus_1 - cn_i)
-            vt = 1 / ct * step_angle_in_rad + accel_in_rad / (v3 * 2)
-            cn = 1 / vt * step_angle_in_rad
-            c.append(cn)
-        print(i, period, an, 1/cn, 1/cn*step_angle_in_rad)
+    t_prev = 0.0
+    for n in range(1, num_steps + 1):
+        lo = t_prev
+        hi = t_end + 1.0 / w
+        v = velocity(t_prev)
+        t = t_prev + 1.0 / v if v > 0 else (lo + hi) / 2
+        for _ in range(50):
+            t = min(max(t, lo), hi)
+            f = position(t) - n
+            if abs(f) < 1e-9:
+                break
+            if f > 0:
+                hi = t
+            else:
+                lo = t
+            v = velocity(t)
+            t_next = t - f / v if v > 0 else lo
+            if not lo < t_next < hi:
+                t_next = (lo + hi) / 2
+            t = t_next
+        c.append(t - t_prev)
+        t_prev = t
+    if not c:
+        c.append(1.0 / w)
     return c
 
 
-def _overlay_ramp(steps, ramp, sign):
+ramp_generators = {
+    "trapezoidal": _configure_ramp_trapezoidal,
+    "sigmoidal": _configure_ramp_sigmoidal,
+    "scurve": _configure_ramp_scurve,
+}
+
+
+def _configure_ramp(ramp_type, vm, mode, step_angle, lead, accel, v0=0.0, jerk=None):
+    """Generates ramp using the generator registered for ramp type."""
+    if ramp_type not in ramp_generators:
+        raise ValueError("Ramp type not available: {}".format(ramp_type))
+    return ramp_generators[ramp_type](vm, mode, step_angle, lead, accel, v0, jerk)
+
+
+def _ramp_params_ax(key):
+    """Returns ramp type, mode, step angle, lead, acceleration and jerk of axis."""
+    a = kinematics.axis(key)
+    return (a.ramp_type, a.mode, a.step_angle, a.lead, a.acceleration, a.jerk)
+
+
+def _configure_ramp_ax(key, vm, v0=0.0, accel=None, jerk=None):
+    """Generates ramp for axis, acceleration and jerk default to axis limits.
+    Ramps are cached per axis and shared between moves, they must not be modified.
+    """
+    a = kinematics.axis(key)
+    if accel is None:
+        accel = a.acceleration
+    if jerk is None:
+        jerk = a.jerk
+    ramp_key = (vm, v0, accel, jerk)
+    ramp = a.ramps.get(ramp_key)
+    if ramp is None:
+        ramp = _configure_ramp(a.ramp_type, vm, a.mode, a.step_angle, a.lead, accel, v0, jerk)
+        a.cache_ramp(ramp_key, ramp)
+    return ramp
+
+
+def _overlay_ramp(steps, ramp, sign, ramp_down=None):
+    """Overlays acceleration and deceleration ramp on a move.
+
+    Parameters:
+        steps (int): Number of steps of the move
+        ramp (list): Step timing intervals of acceleration phase
+        sign (int): Direction of the move (1 | -1)
+        ramp_down (list): Step timing intervals of deceleration phase,
+            ordered from end velocity to cruise (defaults to ramp)
+
+    Returns:
+        intervals (list): Step timing intervals for the move
+    """
+    if ramp_down is None:
+        ramp_down = ramp
+    if steps and not (ramp and ramp_down):
+        raise ValueError("Ramp holds no step intervals")
     intervals = []
-    steps_2 = steps / 2
     ramp_size = len(ramp)
+    ramp_down_size = len(ramp_down)
+    # Acceleration and deceleration meet where both ramps reach the same
+    # velocity, which for equal ramps is the middle of the move
+    if ramp_size == ramp_down_size:
+        steps_2 = steps / 2
+    else:
+        steps_2 = steps * ramp_size / float(ramp_size + ramp_down_size)
     for i in range(steps):
         if i < ramp_size and i < steps_2:
             intervals.append((sign, ramp[i]))
-        elif i >= steps_2 and i >= steps - ramp_size:
-            intervals.append((sign, ramp[steps-i-1]))
+        elif i >= steps_2 and i >= steps - ramp_down_size:
+            intervals.append((sign, ramp_down[steps-i-1]))
         else:
             intervals.append((sign, ramp[-1]))
 
@@ -255,9 +361,9 @@ def _plan_move(x, y, z, vx, vy, vz):
         x (int): X axis end point in steps
         y (int): Y axis end point in steps
         z (int): Z axis end point in steps
-        vx (float): X axis velocity in [1/s]
-        vy (float): Y axis velocity in [1/s]
-        vz (float): Z axis velocity in [1/s]
+        vx (float): X axis velocity in mm/min
+        vy (float): Y axis velocity in mm/min
+        vz (float): Z axis velocity in mm/min
 
     Returns:
         ix (list): Step timing intervals for X axis movement
@@ -265,9 +371,9 @@ def _plan_move(x, y, z, vx, vy, vz):
         iz (list): Step timing intervals for Z axis movement
     """
 
-    ramp_x = _configure_ramp_sigmoidal(vx, cfg.STEPPER_MODE_X, cfg.STEPPER_STEP_ANGLE_X, cfg.AXIS_LEAD_X, cfg.AXIS_ACCELERATION_X)
-    ramp_y = _configure_ramp_sigmoidal(vy, cfg.STEPPER_MODE_Y, cfg.STEPPER_STEP_ANGLE_Y, cfg.AXIS_LEAD_Y, cfg.AXIS_ACCELERATION_Y)
-    ramp_z = _configure_ramp_sigmoidal(vz, cfg.STEPPER_MODE_Z, cfg.STEPPER_STEP_ANGLE_Z, cfg.AXIS_LEAD_Z, cfg.AXIS_ACCELERATION_Z)
+    ramp_x = _configure_ramp_ax("x", vx)
+    ramp_y = _configure_ramp_ax("y", vy)
+    ramp_z = _configure_ramp_ax("z", vz)
     
     # Get signs of distance vector
     sign_x = 1 if x >= 0 else -1
@@ -287,6 +393,124 @@ def _plan_move(x, y, z, vx, vy, vz):
     return ix, iy, iz
 
 
+def _switch_mode(intervals, position, mode, coarse_mode):
+    """Runs the full steps of a move in a coarser microstepping mode.
+    The mode is switched only at full step positions: the steps up to the
+    first full step and after the last full step stay in fine mode, every
+    group of fine steps in between becomes one coarse step taking as long
+    as the group.
+
+    Parameters:
+        intervals (list): Step timing intervals of the move in fine mode
+        position (int): Axis position in fine steps before the move
+        mode (int): Fine microstepping mode
+        coarse_mode (int): Coarse microstepping mode
+
+    Returns:
+        intervals (list): Step timing intervals with mode switch records
+    """
+    if mode % coarse_mode:
+        raise ValueError("Mode {} is no multiple of mode {}".format(mode, coarse_mode))
+    if not intervals:
+        return intervals
+    sign = intervals[0][0]
+    # Fine steps until the axis is at a full step position
+    head = (-position * sign) % mode
+    full = (len(intervals) - head) // mode * mode
+    if full <= 0:
+        return intervals
+
+    k = mode // coarse_mode
+    i = intervals[:head]
+    i.append((MODE_SWITCH, float(coarse_mode)))
+    for j in range(head, head + full, k):
+        i.append((sign, sum(dt for _, dt in intervals[j:j+k])))
+    i.append((MODE_SWITCH, float(mode)))
+    i.extend(intervals[head+full:])
+    return i
+
+
+def _cruise_segments(intervals, min_steps):
+    """Replaces runs of identical steps by cruise segments, which the
+    stepper emits with PWM instead of toggling the step pin per step.
+
+    Parameters:
+        intervals (list): Step timing intervals
+        min_steps (int): Minimum number of steps of a cruise segment
+
+    Returns:
+        intervals (list): Step timing intervals with cruise segment records
+    """
+    i = []
+    for record, run in groupby(intervals):
+        n = sum(1 for _ in run)
+        if n >= min_steps and record[0] in (1, -1):
+            i.append((CRUISE, float(n)))
+            i.append(record)
+        else:
+            i.extend([record] * n)
+    return i
+
+
+def _synchronize(steps, intervals):
+    """Distributes the steps of an axis along the timeline of a leading axis.
+    The n-th of m steps is issued when the leading axis has covered
+    n/m of its steps, so that all axes stay on the straight path
+    and finish at the same time.
+
+    Parameters:
+        steps (int): Axis distance in steps
+        intervals (list): Step timing intervals of leading axis
+
+    Returns:
+        i (list): Step timing intervals for axis movement
+    """
+    sign = 1 if steps >= 0 else -1
+    m = abs(steps)
+    n = len(intervals)
+    if m == n:
+        return [(sign, dt) for _, dt in intervals]
+
+    # Timestamps of leading axis steps
+    times = [0.0]
+    t = 0.0
+    for _, dt in intervals:
+        t += dt
+        times.append(t)
+
+    i = []
+    t_prev = 0.0
+    for j in range(1, m + 1):
+        k, rest = divmod(j * n, m)
+        t = times[k]
+        if rest:
+            t += (times[k+1] - t) * rest / float(m)
+        i.append((sign, t - t_prev))
+        t_prev = t
+
+    return i
+
+
+def _plan_coordinated_move(steps, ramp):
+    """Generates pulses for coordinated movement of several axes.
+    The axis with the most steps leads using the given ramp,
+    all other axes are synchronized to it.
+
+    Parameters:
+        steps (list): Axis distances in steps
+        ramp (list): Step timing intervals of leading axis acceleration
+
+    Returns:
+        intervals (list): Step timing intervals for each axis movement
+    """
+    n = max(abs(val) for val in steps)
+    if not n:
+        return [[] for _ in steps]
+    lead = _overlay_ramp(n, ramp, 1)
+
+    return [_synchronize(val, lead) for val in steps]
+
+
 def _plan_interpolated_line(x, y, vx, vy):
     """Generates pulses for linear interpolation movement.
     Returns tuples vector with pulse direction(1 | -1) and
@@ -459,6 +683,77 @@ def _plan_interpolated_arc(r, x_start, y_start, x_end, y_end, vx, vy, is_cw=True
     return ix, iy
 
 
+def _override_headroom():
+    """Returns the max feed override factor. Feed moves are planned for it,
+    as the override scales their velocity by the factor and their
+    acceleration by its square."""
+    return max(cfg.FEED_OVERRIDE_LIMITS[1] / 100.0, 1.0)
+
+
+def _arc_limits(keys, r):
+    """Calculates feed and path acceleration limits of an arc.
+    The centripetal acceleration v^2 / r is kept within ARC_CENTRIPETAL_SHARE
+    of the acceleration of the most constrained planar axis, the rest of it
+    is left for ramping the feed along the path. Both limits leave headroom
+    for the max feed override, see _override_headroom().
+
+    Parameters:
+        keys (tuple): Planar axis names
+        r (float): Radius of the arc in mm
+
+    Returns:
+        feed (float): Max feed rate in mm/min
+        accel (float): Path acceleration of the ramps in mm/s^2
+    """
+    accel = min(kinematics.axis(key).acceleration for key in keys)
+    share = cfg.ARC_CENTRIPETAL_SHARE
+    headroom = _override_headroom()
+    feed = math.sqrt(share * accel * abs(r)) * 60.0 / headroom
+    return feed, accel * math.sqrt(1.0 - share * share) / headroom**2
+
+
+def _ramp_path(intervals, v, accel):
+    """Ramps path velocity of axis intervals planned at constant velocity.
+    Step times are remapped from the constant velocity to a trapezoidal
+    profile starting and ending at rest. Paths too short to reach the
+    velocity ramp to their midpoint and back.
+
+    Parameters:
+        intervals (list): Step timing intervals of each axis
+        v (float): Path velocity of the intervals in mm/s
+        accel (float): Path acceleration in mm/s^2
+
+    Returns:
+        intervals (list): Ramped step timing intervals of each axis
+    """
+    length = v * max([sum(dt for _, dt in i) for i in intervals] + [0.0])
+    if not length or not accel:
+        return intervals
+    vp = min(v, math.sqrt(accel * length))
+    s_ramp = vp * vp / (2 * accel)
+    t_ramp = vp / accel
+    t_end = 2 * t_ramp + (length - 2 * s_ramp) / vp
+
+    def ramped_time(s):
+        if s < s_ramp:
+            return math.sqrt(2 * s / accel)
+        if s > length - s_ramp:
+            return t_end - math.sqrt(2 * max(length - s, 0.0) / accel)
+        return t_ramp + (s - s_ramp) / vp
+
+    ramped = []
+    for axis_intervals in intervals:
+        i = []
+        t = t_prev = 0.0
+        for sign, dt in axis_intervals:
+            t += dt
+            t_ramped = ramped_time(v * t)
+            i.append((sign, t_ramped - t_prev))
+            t_prev = t_ramped
+        ramped.append(i)
+    return ramped
+
+
 class MotionPlanner(object):
     """
     A class containing all methods for CNC motion planning.
@@ -474,7 +769,7 @@ class MotionPlanner(object):
 
     def plan_move(self, ds, v):
         """Plans rapid positioning move.
-        In this mode the axes move at max speed
+        In this mode the axes move independently at max speed
         to the desired position. Shorter vectors finish first.
 
         Parameters:
@@ -488,18 +783,83 @@ class MotionPlanner(object):
         """
 
         steps = []
-        pps = []
         for key, val in ds:
             steps.append(_mm_to_steps_ax(key, val))
-        for key, val in v:
-            pps.append(_mm_per_min_to_pps_ax(key, val))
+        vx, vy, vz = [val for _, val in v]
+
+        return _plan_move(steps[0], steps[1], steps[2], vx, vy, vz)
+
+    def _plan_path(self, ds, v=None, vp=None, headroom=1.0):
+        """Plans synchronized movement of all axes along a straight path.
+        Path acceleration and jerk are limited by the most constrained axis,
+        the ramp of the leading axis is scaled accordingly.
+
+        Parameters:
+            ds (tuple list): axis deltas in mm
+            v (tuple list): axis velocity limits in mm/min
+            vp (float): path velocity in mm/min
+            headroom (float): Factor the move may be sped up by, acceleration
+                and jerk are reduced by its square and cube
 
-        return _plan_move(steps[0], steps[1], steps[2], pps[0], pps[1], pps[2])
+        Returns:
+            intervals (list): Step timing intervals for each axis movement
+        """
+        steps = [_mm_to_steps_ax(key, val) for key, val in ds]
+        n = max(abs(val) for val in steps)
+        if not n:
+            return [[] for _ in steps]
+
+        s = math.sqrt(sum(val*val for _, val in ds))
+        if vp is None:
+            vp = float("inf")
+        accel = jerk = float("inf")
+        lead = 0
+        for idx, (key, val) in enumerate(ds):
+            u = abs(val) / s
+            if not u:
+                continue
+            _, _, _, _, max_accel, max_jerk = _ramp_params_ax(key)
+            if v is not None:
+                vp = min(vp, v[idx][1] / u)
+            accel = min(accel, max_accel / u)
+            jerk = min(jerk, max_jerk / u) if max_jerk else jerk
+            if abs(steps[idx]) == n:
+                lead = idx
+
+        accel /= headroom**2
+        if jerk != float("inf"):
+            jerk /= headroom**3
+
+        # Scale path limits to leading axis
+        key, val = ds[lead]
+        u = abs(val) / s
+        jerk = jerk * u if jerk != float("inf") else None
+        ramp = _configure_ramp_ax(key, vp * u, accel=accel * u, jerk=jerk)
+
+        return _plan_coordinated_move(steps, ramp)
+
+    def plan_coordinated_move(self, ds, v):
+        """Plans coordinated rapid positioning move.
+        All axes move on a straight line to the desired position,
+        starting and stopping together. Path velocity, acceleration
+        and jerk are limited by the most constrained axis.
+
+        Parameters:
+            ds (tuple list): axis deltas in mm
+            v (tuple list): axis velocities in mm/min
+
+        Returns:
+            intervals (list): Step timing intervals for each axis movement
+        """
+        return self._plan_path(ds, v=v)
 
     def plan_interpolated_line(self, ds, v):
         """Plans linear interpolation movement on specified plane.
         The axis movements will be synchronized using the defined
         feed rate. All vectors finish at the same time.
+        Acceleration and deceleration are ramped along the path vector,
+        so the axes stay on the commanded line during the ramps, with
+        headroom for the max feed override, see _override_headroom().
 
         Parameters:
             ds (tuple list): axis deltas in mm
@@ -509,23 +869,15 @@ class MotionPlanner(object):
             ia (list): Step timing intervals for first planar axis movement
             ib (list): Step timing intervals for second planar axis movement
         """
-
-        s = math.sqrt(ds[0][1]*ds[0][1] + ds[1][1]*ds[1][1])
-        ti = s / v
-
-        steps = []
-        pps = []
-        for key, val in ds:
-            steps.append(_mm_to_steps_ax(key, val))
-            pps.append(_mm_per_min_to_pps_ax(key, abs(val) / ti))
-
-        return _plan_interpolated_line(steps[0], steps[1], pps[0], pps[1])
+        return self._plan_path(ds, vp=v, headroom=_override_headroom())
 
     def plan_interpolated_arc(self, r, ds, de, v, is_cw):
         """Plans circular interpolation movement on specified plane.
         The movement will be synchronized on selected plane till
         either a defined end point or the start of the
         circular movement is reached.
+        The feed rate is capped by the centripetal acceleration limit
+        of the arc, see _arc_limits(), and ramped in and out.
 
         Parameters:
             r (float): the radius of the arc
@@ -537,7 +889,16 @@ class MotionPlanner(object):
         Returns:
             ia (list): Step timing intervals for first planar axis movement
             ib (list): Step timing intervals for second planar axis movement
+            feed_limit (float): Feed rate in mm/min the arc was limited to,
+                None if it runs at the given feed rate
         """
+        keys = [key for key, _ in ds]
+        max_feed, accel = _arc_limits(keys, r)
+        feed_limit = None
+        if v > max_feed:
+            self.logger.debug("Arc feed limited by centripetal acceleration: R%s F%.1f -> F%.1f",
+                              r, v, max_feed)
+            v = feed_limit = max_feed
         steps = []
         pps = []
         for key, val in ds:
@@ -549,4 +910,6 @@ class MotionPlanner(object):
             steps_r = math.sqrt(steps[0]*steps[0]+steps[1]*steps[1])
         else:
             steps_r = _mm_to_steps_ax(ds[0][0], r)
-        return _plan_interpolated_arc(steps_r, steps[0], steps[1], steps[2], steps[3], pps[0], pps[1], is_cw)
+        ia, ib = _plan_interpolated_arc(steps_r, steps[0], steps[1], steps[2], steps[3], pps[0], pps[1], is_cw)
+        ia, ib = _ramp_path([ia, ib], v / 60.0, accel)
+        return ia, ib, feed_limit
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+
+import math
+import time
+
+import numpy as np
+
+from block_planner import _end_coordinates
+from block_planner import resolve_blocks
+from gcode import GCode
+from motion_planner import _configure_ramp_ax
+from motion_planner import _mm_to_steps_ax
+
+import config as cfg
+
+_BARRIER_GCODES = ("17", "18", "19", "28")
+
+
+class _AxisTravel(object):
+    """
+    Rapid travel time of an axis.
+
+    The step intervals of a rapid move are the ramp of the axis limits
+    in mm/min overlaid on the move, so its duration follows from the
+    prefix sums of the ramp without generating the intervals.
+    """
+
+    def __init__(self, key, v):
+        self._key = key
+        self._ramp = _configure_ramp_ax(key, v)
+        self._prefix = [0.0]
+        for dt in self._ramp:
+            self._prefix.append(self._prefix[-1] + dt)
+
+    def steps(self, distance):
+        """Returns number of steps of a move over distance in mm."""
+        return abs(_mm_to_steps_ax(self._key, distance))
+
+    def time(self, distance):
+        """Returns duration of a rapid move over distance in mm."""
+        n = self.steps(distance)
+        size = len(self._ramp)
+        up = min(size, (n + 1) // 2)
+        down = min(size, n // 2)
+        return self._prefix[up] + self._prefix[down] + (n - up - down) * self._ramp[-1]
+
+    def times(self, distances):
+        """Returns durations of rapid moves over an array of distances in mm."""
+        n = np.abs(_mm_to_steps_ax(self._key, distances))
+        size = len(self._ramp)
+        up = np.minimum(size, (n + 1) // 2)
+        down = np.minimum(size, n // 2)
+        prefix = np.array(self._prefix)
+        return prefix[up] + prefix[down] + (n - up - down) * self._ramp[-1]
+
+
+class RapidTravel(object):
+    """
+    Rapid travel time between XY positions at clearance height.
+
+    Follows RAPID_MODE like the block planner: coordinated moves take as
+    long as the axis with most steps, which leads at its own limits while
+    the other axis is not more constrained on its share of the path.
+    Independent moves take as long as the slowest axis.
+    """
+
+    def __init__(self):
+        self._x = _AxisTravel("x", cfg.AXIS_TRAVERSAL_MM_PER_MIN_X)
+        self._y = _AxisTravel("y", cfg.AXIS_TRAVERSAL_MM_PER_MIN_Y)
+        self._coordinated = cfg.RAPID_MODE == "coordinated"
+
+    def time(self, start, end):
+        """Returns duration of rapid move from start to end position (x, y) in seconds."""
+        dx = end[0] - start[0]
+        dy = end[1] - start[1]
+        if self._coordinated:
+            if self._x.steps(dx) >= self._y.steps(dy):
+                return self._x.time(dx)
+            return self._y.time(dy)
+        return max(self._x.time(dx), self._y.time(dy))
+
+    def table(self, points):
+        """Returns durations of rapid moves between all pairs of points
+        by (start, end) position, computed in a vectorized pass."""
+        points = list(points)
+        xy = np.array(points, dtype=float).reshape(-1, 2)
+        dx = xy[None, :, 0] - xy[:, None, 0]
+        dy = xy[None, :, 1] - xy[:, None, 1]
+        tx = self._x.times(dx)
+        ty = self._y.times(dy)
+        if self._coordinated:
+            lead = np.abs(_mm_to_steps_ax("x", dx)) >= np.abs(_mm_to_steps_ax("y", dy))
+            t = np.where(lead, tx, ty).tolist()
+        else:
+            t = np.maximum(tx, ty).tolist()
+        return {(a, b): t[m][n] for m, a in enumerate(points) for n, b in enumerate(points)}
+
+
+class Operation(object):
+    """
+    Machining operation from plunge to retract.
+
+    Attributes:
+        gcodes (list): GCode objects of the operation
+        entry (tuple): XY position of the plunge
+        exit (tuple): XY position of the retract
+    """
+
+    def __init__(self, gcodes, entry, exit):
+        self.gcodes = gcodes
+        self.entry = entry
+        self.exit = exit
+
+
+def _xy(coordinates):
+    return (coordinates["X"], coordinates["Y"])
+
+
+def _is_positioning(gcode):
+    """Checks if GCode is a rapid XY move without Z."""
+    return (gcode.get("G") == "00" and gcode.get("Z") is None
+            and (gcode.get("X") is not None or gcode.get("Y") is not None))
+
+
+def _is_z_move(gcode):
+    """Checks if GCode is a linear move of the Z axis only."""
+    return (gcode.get("G") in ("00", "01") and gcode.get("Z") is not None
+            and gcode.get("X") is None and gcode.get("Y") is None)
+
+
+def _operation_end(blocks, i):
+    """Returns index after the operation starting at blocks[i] or None.
+    An operation starts with a plunge and ends with the first Z move
+    back to the height the plunge started from.
+    """
+    gcode, start, end = blocks[i]
+    if not _is_z_move(gcode) or end["Z"] >= start["Z"]:
+        return None
+    clearance = start["Z"]
+    for j in range(i + 1, len(blocks)):
+        gcode_j, _, end_j = blocks[j]
+        if gcode_j.get("G") in _BARRIER_GCODES:
+            return None
+        if _is_z_move(gcode_j) and end_j["Z"] >= clearance:
+            return j + 1 if end_j["Z"] == clearance else None
+    return None
+
+
+def _positioning(position):
+    """Creates explicit rapid XY move."""
+    return GCode({"G": "00", "X": repr(float(position[0])), "Y": repr(float(position[1]))})
+
+
+def _path_time(times, start, order, operations, end):
+    t = 0.0
+    position = start
+    for idx in order:
+        t += times[position, operations[idx].entry]
+        position = operations[idx].exit
+    return t + times[position, end]
+
+
+def _links(times, order, operations):
+    """Prefix sums of the travel times between consecutive operations,
+    forward and with the two operations visited in reverse order."""
+    forward = [0.0]
+    backward = [0.0]
+    for a, b in zip(order, order[1:]):
+        forward.append(forward[-1] + times[operations[a].exit, operations[b].entry])
+        backward.append(backward[-1] + times[operations[b].exit, operations[a].entry])
+    return forward, backward
+
+
+def _reversal_delta(times, order, operations, links, i, j, prev, after):
+    """Change of the path time when reversing order[i:j+1], prev is the
+    position before order[i] and after the position after order[j]."""
+    forward, backward = links
+    first = operations[order[i]]
+    last = operations[order[j]]
+    old = times[prev, first.entry] + forward[j] - forward[i] + times[last.exit, after]
+    new = times[prev, last.entry] + backward[j] - backward[i] + times[first.exit, after]
+    return new - old
+
+
+def order_operations(operations, start, end, travel):
+    """Orders operations to minimize rapid travel time.
+    Nearest neighbor construction followed by 2-opt improvement
+    of the open path from start to end, for at most OPTIMIZER_TIME_BUDGET s.
+
+    Parameters:
+        operations (list): Operation objects
+        start (tuple): XY position before the first operation
+        end (tuple): XY position after the last operation
+        travel (RapidTravel): Travel time model
+
+    Returns:
+        order (list): Indexes of operations
+    """
+    points = set([start, end])
+    for op in operations:
+        points.add(op.entry)
+        points.add(op.exit)
+    times = travel.table(points)
+
+    # Nearest neighbor, unless the given order is already shorter
+    order = []
+    remaining = set(range(len(operations)))
+    position = start
+    while remaining:
+        idx = min(remaining, key=lambda k: (times[position, operations[k].entry], k))
+        remaining.remove(idx)
+        order.append(idx)
+        position = operations[idx].exit
+    best = _path_time(times, start, order, operations, end)
+    given = list(range(len(operations)))
+    t = _path_time(times, start, given, operations, end)
+    if t <= best:
+        order, best = given, t
+
+    # 2-opt, reversing the visiting order of a run of operations
+    deadline = time.time() + cfg.OPTIMIZER_TIME_BUDGET
+    improved = True
+    while improved and time.time() < deadline:
+        improved = False
+        links = _links(times, order, operations)
+        for i in range(len(order) - 1):
+            prev = operations[order[i-1]].exit if i else start
+            for j in range(i + 1, len(order)):
+                after = operations[order[j+1]].entry if j + 1 < len(order) else end
+                delta = _reversal_delta(times, order, operations, links, i, j, prev, after)
+                if delta < -1e-9:
+                    order = order[:i] + order[i:j+1][::-1] + order[j+1:]
+                    links = _links(times, order, operations)
+                    improved = True
+            if time.time() >= deadline:
+                break
+    return order
+
+
+def optimize(gcodes, coordinates, plane="XY"):
+    """Reorders machining operations to minimize rapid travel.
+
+    Operations are sequences from a plunge to a retract back to clearance
+    height. Runs of operations at the same clearance height, separated
+    only by rapid XY positioning, are independent and reordered; the
+    positioning moves are replaced with explicit XY moves to each entry.
+    The group ends at the original position, so the following GCode
+    executes unchanged.
+
+    Parameters:
+        gcodes (list): GCode objects
+        coordinates (dict): Axis coordinates before the first block in mm
+        plane (str): Selected plane before the first block
+
+    Returns:
+        gcodes (list): Optimized GCode objects
+        before (float): Rapid travel time of replaced positioning moves in seconds
+        after (float): Rapid travel time of new positioning moves in seconds
+    """
+    blocks = []
+    for gcode, start, _ in resolve_blocks(gcodes, coordinates, plane):
+        blocks.append((gcode, start, _end_coordinates(gcode, start)))
+    travel = RapidTravel()
+    result = []
+    state = {"before": 0.0, "after": 0.0}
+
+    operations = []
+    pending = []
+    group_start = None
+    clearance = None
+
+    def flush(end):
+        if operations:
+            order = order_operations(operations, group_start, end, travel)
+            position = group_start
+            for idx in order:
+                op = operations[idx]
+                if op.entry != position:
+                    result.append(_positioning(op.entry))
+                    state["after"] += travel.time(position, op.entry)
+                result.extend(op.gcodes)
+                position = op.exit
+            if end != position:
+                result.append(_positioning(end))
+                state["after"] += travel.time(position, end)
+            for gcode, start, stop in pending:
+                state["before"] += travel.time(_xy(start), _xy(stop))
+        else:
+            result.extend(gcode for gcode, _, _ in pending)
+        del operations[:]
+        del pending[:]
+
+    i = 0
+    while i < len(blocks):
+        gcode, start, end = blocks[i]
+        if _is_positioning(gcode) and (clearance is None or start["Z"] == clearance):
+            if not operations and not pending:
+                group_start = _xy(start)
+            pending.append(blocks[i])
+            i += 1
+            continue
+
+        stop = _operation_end(blocks, i)
+        if stop is not None and clearance is not None and start["Z"] != clearance:
+            flush(_xy(start))
+            clearance = None
+        if stop is not None:
+            if not operations:
+                if not pending:
+                    group_start = _xy(start)
+                clearance = start["Z"]
+            for _, p_start, p_end in pending:
+                state["before"] += travel.time(_xy(p_start), _xy(p_end))
+            del pending[:]
+            operations.append(Operation([b[0] for b in blocks[i:stop]],
+                                        _xy(start), _xy(blocks[stop-1][2])))
+            i = stop
+            continue
+
+        flush(_xy(start))
+        clearance = None
+        result.append(gcode)
+        i += 1
+
+    if blocks:
+        flush(_xy(blocks[-1][2]))
+    return result, state["before"], state["after"]
+
+
+def _is_zero_move(gcode, start, end):
+    """Checks if linear move produces no steps on any axis."""
+    if gcode.get("G") not in ("00", "01"):
+        return False
+    return not any(_mm_to_steps_ax(key.lower(), end[key] - start[key])
+                   for key in ("X", "Y", "Z"))
+
+
+def _is_collinear(points, tolerance):
+    """Checks if points lie in order on the line from first to last point
+    within tolerance."""
+    a, c = points[0], points[-1]
+    d = [c[k] - a[k] for k in ("X", "Y", "Z")]
+    length = math.sqrt(sum(val*val for val in d))
+    if not length:
+        return False
+    u = [val / length for val in d]
+    t_prev = 0.0
+    for p in points[1:-1]:
+        v = [p[k] - a[k] for k in ("X", "Y", "Z")]
+        t = sum(vi*ui for vi, ui in zip(v, u))
+        if t < t_prev or t > length:
+            return False
+        deviation = math.sqrt(max(sum(vi*vi for vi in v) - t*t, 0.0))
+        if deviation > tolerance:
+            return False
+        t_prev = t
+    return True
+
+
+def _is_mergeable(previous, gcode):
+    """Checks if linear moves have the same words and feed rate."""
+    return (previous.get("G") == "01" and gcode.get("G") == "01"
+            and previous.keys() - {"N"} == gcode.keys() - {"N"}
+            and previous.get("F") == gcode.get("F"))
+
+
+def coalesce(gcodes, coordinates, plane="XY", tolerance=cfg.COALESCE_TOLERANCE):
+    """Merges collinear linear moves and drops moves without steps.
+
+    Consecutive G01 moves with the same axis words and feed rate are
+    merged into the last one as long as all intermediate points lie on
+    its line within tolerance. Rapid and linear moves shorter than a
+    step on every axis are dropped.
+
+    Parameters:
+        gcodes (list): GCode objects
+        coordinates (dict): Axis coordinates before the first block in mm
+        plane (str): Selected plane before the first block
+        tolerance (float): Maximum distance of merged points from the line in mm
+
+    Returns:
+        gcodes (list): Coalesced GCode objects
+        eliminated (int): Number of eliminated blocks
+    """
+    result = []
+    points = []
+    for gcode, start, _ in resolve_blocks(gcodes, coordinates, plane):
+        end = _end_coordinates(gcode, start)
+        if _is_zero_move(gcode, start, end):
+            continue
+        if (points and _is_mergeable(result[-1], gcode)
+                and _is_collinear(points + [end], tolerance)):
+            result[-1] = gcode
+            points.append(end)
+            continue
+        result.append(gcode)
+        points = [start, end] if gcode.get("G") == "01" else []
+    return result, len(gcodes) - len(result)
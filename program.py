@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+import config as cfg
+from gcode import GCode
+from gcode_exceptions import GCodeOutOfBoundsError
+from gcode_parser import GCodeParser
+from gcode_parser import PARSER_VERSION
+from kinematics import axis
+import metrics
+
+# Numeric parameter columns, other parameters are not kept
+WORDS = ("X", "Y", "Z", "I", "J", "K", "R", "F")
+
+# Presence flag of each parameter column
+FLAGS = {key: 1 << n for n, key in enumerate(WORDS)}
+
+# Row of a program: source line, N, G and M (-1 if absent), presence
+# flags and parameter values (NaN if absent)
+DTYPE = np.dtype([("line", "<i4"), ("n", "<i4"), ("g", "<i2"), ("m", "<i2"),
+                  ("present", "<u2")] + [(key, "<f8") for key in WORDS])
+
+# G codes setting axis positions and returning home
+MOTION = (0, 1, 2, 3)
+HOME = 28
+
+# Maximum number of violations listed in the error message
+MAX_REPORTED = 10
+
+# Header of binary program caches: magic, cache format, parser version,
+# SHA-256 of the source and number of rows, followed by the rows
+CACHE_MAGIC = b"RCNC"
+CACHE_FORMAT = 1
+CACHE_HEADER = struct.Struct("<4sHH32sQ")
+
+_logger = logging.getLogger("main")
+
+
+def _row(number, params):
+    present = 0
+    values = []
+    for key in WORDS:
+        val = params.get(key)
+        if val is None:
+            values.append(np.nan)
+        else:
+            present |= FLAGS[key]
+            values.append(float(val))
+    return (number, int(float(params["N"])) if "N" in params else -1,
+            int(params["G"]) if "G" in params else -1,
+            int(params["M"]) if "M" in params else -1,
+            present) + tuple(values)
+
+
+class Program(object):
+    """
+    Parsed GCode program stored column-wise in a numpy structured array,
+    so positions, deltas, step counts and soft limits of the whole program
+    are computed in a few vectorized passes before motion starts.
+
+    Attributes:
+        rows (ndarray): Program rows of type DTYPE
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_gcodes(cls, gcodes, lines=None):
+        """Creates program from GCode list.
+
+        Parameters:
+            gcodes (list): GCode objects
+            lines (list): Source line numbers, defaults to the list index + 1
+        """
+        if lines is None:
+            lines = range(1, len(gcodes) + 1)
+        return cls(np.array([_row(number, gcode._params) for number, gcode in zip(lines, gcodes)],
+                            dtype=DTYPE))
+
+    @classmethod
+    def parse(cls, lines):
+        """Parses GCode lines, axis limits are checked by validate()."""
+        t = time.time()
+        rows = []
+        for number, line in enumerate(lines, 1):
+            params = GCodeParser.parse_line(line, check_limits=False)
+            if params:
+                rows.append(_row(number, params))
+        metrics.PARSE_FILE_SECONDS.observe(time.time() - t)
+        return cls(np.array(rows, dtype=DTYPE))
+
+    @classmethod
+    def read(cls, gcode_file):
+        """Parses GCode file, axis limits are checked by validate()."""
+        with open(gcode_file) as inf:
+            return cls.parse(inf)
+
+    @classmethod
+    def load(cls, gcode_file, cache=True):
+        """Loads GCode file from its binary cache <gcode file>.cache.
+        The cache is memory-mapped if it matches the hash of the source
+        and the parser version, otherwise the source is parsed and the
+        cache rewritten.
+
+        Parameters:
+            gcode_file (str): Path of GCode file
+            cache (bool): Use and write the cache
+
+        Returns:
+            program (Program): Parsed program, read-only if loaded from cache
+        """
+        with open(gcode_file, "rb") as inf:
+            source = inf.read()
+        if not cache:
+            return cls.parse(source.decode().splitlines())
+        digest = hashlib.sha256(source).digest()
+        cache_file = gcode_file + ".cache"
+        program = cls._map_cache(cache_file, digest)
+        if program is None:
+            program = cls.parse(source.decode().splitlines())
+            program._write_cache(cache_file, digest)
+        return program
+
+    @classmethod
+    def _map_cache(cls, cache_file, digest):
+        """Maps cache file, None if it is missing or invalid."""
+        try:
+            with open(cache_file, "rb") as inf:
+                # The mapping stays open as long as the rows reference it
+                buf = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(buf) < CACHE_HEADER.size:
+            return None
+        magic, fmt, version, cached_digest, count = CACHE_HEADER.unpack_from(buf)
+        if (magic, fmt, version, cached_digest) != (CACHE_MAGIC, CACHE_FORMAT, PARSER_VERSION, digest):
+            _logger.debug("Cache %s outdated", cache_file)
+            return None
+        if len(buf) != CACHE_HEADER.size + count * DTYPE.itemsize:
+            _logger.warning("Cache %s truncated", cache_file)
+            return None
+        return cls(np.frombuffer(buf, dtype=DTYPE, count=count, offset=CACHE_HEADER.size))
+
+    def _write_cache(self, cache_file, digest):
+        """Writes cache file, replaced atomically so readers never see partial caches."""
+        tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+        try:
+            with open(tmp_file, "wb") as outf:
+                outf.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, PARSER_VERSION,
+                                             digest, len(self.rows)))
+                outf.write(np.ascontiguousarray(self.rows).tobytes())
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            _logger.warning("Could not write cache %s: %s", cache_file, e)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def gcodes(self):
+        """Creates GCode list of the program."""
+        names = ("line", "n", "g", "m", "present") + WORDS
+        gcodes = []
+        for row in self.rows.tolist():
+            _, n, g, m, present = row[:5]
+            params = {}
+            if n >= 0:
+                params["N"] = "{:02d}".format(n)
+            if g >= 0:
+                params["G"] = "{:02d}".format(g)
+            if m >= 0:
+                params["M"] = "{:02d}".format(m)
+            for key, val in zip(names[5:], row[5:]):
+                if present & FLAGS[key]:
+                    params[key] = repr(val)
+            gcodes.append(GCode(params))
+        return gcodes
+
+    def _assigned(self, key):
+        """Rows setting the axis position and the position they set."""
+        g = self.rows["g"]
+        home = g == HOME
+        assigned = (np.isin(g, MOTION) & (self.rows["present"] & FLAGS[key] != 0)) | home
+        values = np.where(home, axis(key).limits[0], self.rows[key])
+        return assigned, values
+
+    def positions(self, start):
+        """Calculates axis positions after each row.
+
+        Parameters:
+            start (dict): Axis coordinates before the program
+
+        Returns:
+            positions (dict): Position arrays in mm by axis
+        """
+        positions = {}
+        index = np.arange(len(self.rows))
+        for key in ("X", "Y", "Z"):
+            assigned, values = self._assigned(key)
+            # Forward fill: index of the last row setting the axis
+            last = np.maximum.accumulate(np.where(assigned, index, -1)) if len(index) else index
+            positions[key] = np.where(last >= 0, values[last], start[key])
+        return positions
+
+    def deltas(self, start):
+        """Calculates axis deltas of each row in mm."""
+        return {key: np.diff(pos, prepend=start[key])
+                for key, pos in self.positions(start).items()}
+
+    def steps(self, start):
+        """Calculates axis deltas of each row in steps, rounded as planned."""
+        return {key: axis(key).mm_to_steps(delta)
+                for key, delta in self.deltas(start).items()}
+
+    def violations(self, start):
+        """Finds rows moving an axis out of its limits.
+
+        Returns:
+            violations (list): Tuples of source line, axis and position
+        """
+        found = []
+        for key, pos in self.positions(start).items():
+            assigned, _ = self._assigned(key)
+            for idx in np.flatnonzero(assigned & ~axis(key).in_limits(pos)):
+                found.append((int(self.rows["line"][idx]), key, float(pos[idx])))
+        found.sort()
+        return found
+
+    def validate(self, start):
+        """Checks axis limits of the whole program.
+
+        Raises:
+            GCodeOutOfBoundsError: Program moves an axis out of its limits
+        """
+        found = self.violations(start)
+        if found:
+            listed = ", ".join("line {} {}{}".format(*v) for v in found[:MAX_REPORTED])
+            if len(found) > MAX_REPORTED:
+                listed += ", ..."
+            raise GCodeOutOfBoundsError(
+                listed, "GCode out of bounds in {} blocks".format(len(found)))
+
+
+def main():
+    parser = ArgumentParser(description="Validates GCode file against the axis limits")
+    parser.add_argument("-i", "--gcode", dest="gcode",
+                        help="input g-code file", required=True)
+    parser.add_argument("-n", "--no-cache", dest="no_cache", action="store_true",
+                        help="Parse without binary cache")
+    args = parser.parse_args()
+
+    t = time.time()
+    program = Program.load(args.gcode, cache=not args.no_cache)
+    t_parse = time.time() - t
+    with open(cfg.coord_file) as file_obj:
+        start = json.load(file_obj)
+    t = time.time()
+    found = program.violations(start)
+    steps = program.steps(start)
+    t_validate = time.time() - t
+    print("{} blocks, parsed in {:.3f}s, validated in {:.3f}s".format(
+        len(program), t_parse, t_validate))
+    print("Steps: " + ", ".join("{} {}".format(key, int(np.abs(s).sum())) for key, s in steps.items()))
+    for line, key, val in found:
+        print("Line {}: {} {} out of bounds".format(line, key, val))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import ctypes
+import ctypes.util
+import gc
+import logging
+import mmap
+from multiprocessing import Process
+from multiprocessing import Queue
+import os
+import time
+
+import config as cfg
+
+# mlockall flags from <sys/mman.h>
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+_logger = logging.getLogger("main")
+
+
+def pin(cores):
+    """Pins calling process to cores.
+
+    Returns:
+        success (bool): Process is pinned
+    """
+    available = os.sched_getaffinity(0)
+    if not cores or not set(cores) <= available:
+        _logger.warning("Cores %s not available (%s), not pinning", cores, sorted(available))
+        return False
+    try:
+        os.sched_setaffinity(0, cores)
+    except OSError as e:
+        _logger.warning("Could not pin to cores %s: %s", cores, e)
+        return False
+    return True
+
+
+def _rt_throttled():
+    """Checks if the kernel limits the runtime of real-time tasks."""
+    try:
+        with open("/proc/sys/kernel/sched_rt_runtime_us") as inf:
+            return int(inf.read()) != -1
+    except (OSError, ValueError):
+        return False
+
+
+def set_fifo(priority):
+    """Requests SCHED_FIFO scheduling for calling process.
+    With real-time throttling enabled a busy waiting task is suspended
+    once it used up its runtime share, which is worse than normal
+    scheduling, so SCHED_FIFO is not requested then.
+
+    Returns:
+        success (bool): Scheduling policy is set
+    """
+    if _rt_throttled():
+        _logger.warning("Real-time throttling enabled (kernel.sched_rt_runtime_us), "
+                        "not setting SCHED_FIFO")
+        return False
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (OSError, AttributeError) as e:
+        _logger.warning("Could not set SCHED_FIFO priority %d: %s", priority, e)
+        return False
+    return True
+
+
+def lock_memory():
+    """Locks current and future pages of calling process in memory.
+
+    Returns:
+        success (bool): Memory is locked
+    """
+    libc_name = ctypes.util.find_library("c")
+    if libc_name is None:
+        _logger.warning("Could not lock memory: libc not found")
+        return False
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        _logger.warning("Could not lock memory: %s", os.strerror(ctypes.get_errno()))
+        return False
+    return True
+
+
+def freeze_gc():
+    """Moves existing objects out of garbage collection and disables it."""
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+
+def enter(cores=None, priority=cfg.REALTIME_PRIORITY, lock=cfg.REALTIME_LOCK_MEMORY):
+    """Enters real-time mode, steps that are not permitted are skipped.
+    SCHED_FIFO is only requested when pinned to dedicated cores, a busy
+    waiting process would otherwise starve the processes sharing its core.
+
+    Parameters:
+        cores (list): Cores to pin the process to
+        priority (int): SCHED_FIFO priority
+        lock (bool): Lock memory
+
+    Returns:
+        applied (dict): Success of each step
+    """
+    applied = {"pin": pin(cores), "fifo": False, "mlock": False, "gc": True}
+    if applied["pin"]:
+        applied["fifo"] = set_fifo(priority)
+    if lock:
+        applied["mlock"] = lock_memory()
+    freeze_gc()
+    return applied
+
+
+def pretouch(buf, write=False, page_size=mmap.PAGESIZE):
+    """Touches every page of a buffer so it is mapped before use.
+
+    Parameters:
+        buf (memoryview): Buffer to touch
+        write (bool): Write pages, only safe while no other process writes the buffer
+        page_size (int): Page size in bytes
+    """
+    for offset in range(0, len(buf), page_size):
+        if write:
+            buf[offset] = buf[offset]
+        else:
+            buf[offset]
+
+
+def measure_jitter(period=0.0005, samples=2000):
+    """Measures lateness of busy waited deadlines as done by the step executors.
+
+    Parameters:
+        period (float): Deadline period in s
+        samples (int): Number of deadlines
+
+    Returns:
+        jitter (tuple): Mean, 99th percentile and max lateness in s
+    """
+    lateness = []
+    deadline = time.perf_counter()
+    for _ in range(samples):
+        deadline += period
+        while time.perf_counter() < deadline:
+            pass
+        lateness.append(time.perf_counter() - deadline)
+    lateness.sort()
+    return (sum(lateness) / samples, lateness[int(samples * 0.99)], lateness[-1])
+
+
+def _measure(realtime, cores, result):
+    applied = enter(cores) if realtime else {}
+    result.put((applied, measure_jitter()))
+
+
+def _load():
+    """Allocates cyclic garbage to load CPU and garbage collector."""
+    while True:
+        garbage = []
+        for _ in range(1000):
+            node = {}
+            node["self"] = node
+            garbage.append(node)
+
+
+def main():
+    parser = ArgumentParser(description="Measures step timing jitter with and without real-time mode")
+    parser.add_argument("-c", "--cores", dest="cores", type=int, nargs="+",
+                        help="Cores to pin to", default=cfg.REALTIME_CORES["X"])
+    parser.add_argument("-l", "--load", dest="load", action="store_true",
+                        help="Run background load while measuring")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load = None
+    if args.load:
+        load = Process(target=_load, daemon=True)
+        load.start()
+    for realtime in (False, True):
+        result = Queue()
+        p = Process(target=_measure, args=(realtime, args.cores, result))
+        p.start()
+        applied, (mean, p99, peak) = result.get()
+        p.join()
+        print("Real-time {} {}: mean {:.1f} usec, p99 {:.1f} usec, max {:.1f} usec".format(
+            "on" if realtime else "off", applied, mean * 1e6, p99 * 1e6, peak * 1e6))
+    if load is not None:
+        load.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,55 @@
 #!/usr/bin/env python
 
 from argparse import ArgumentParser
-import json
 import logging
-import logging.config
+import os
 
 from stepper import Stepper
 from machine import Machine
-from gcode_parser import GCodeParser
+from program import Program
+import compiler
+from block_planner import BlockPlanner
+from feed_override import FeedOverride
+import metrics
+from tracing import TRACER
+import log_queue
+import optimizer
 
 import config as cfg
 
 
 class Router(object):
     def __init__(self, debug=False):
-        with open("logging.json") as log_cfg:
-            log_dict = json.load(log_cfg)
-        logging.config.dictConfig(log_dict)
+        self._log_listener = log_queue.configure()
         self.logger = logging.getLogger("main")
 
         self.debug = debug
 
-    def run(self, gcode_file):
-        """Runs GCode from GCode file."""
+    def close(self):
+        """Writes pending log records."""
+        self._log_listener.stop()
+
+    def run(self, gcode_file, feed_override=100.0, processes=cfg.PLANNER_PROCESSES,
+            metrics_port=cfg.METRICS_PORT, metrics_file=cfg.METRICS_FILE,
+            trace_file=None, profile=None, optimize=False, coalesce=False):
+        """Runs GCode from GCode file.
+
+        Parameters:
+            gcode_file (str): Path of GCode file or compiled job (see compiler.py)
+            feed_override (float): Initial feed override in percent
+            processes (int): Number of processes planning blocks in parallel
+            metrics_port (int): Serve metrics on local port
+            metrics_file (str): Write metrics to file at job end
+            trace_file (str): Write Chrome trace of the job to file
+            profile (tuple): Range (start, end) of blocks to profile planning,
+                statistics are written to <gcode file name>.pstats
+            optimize (bool): Reorder machining operations to minimize rapid travel
+            coalesce (bool): Merge collinear linear moves and drop moves without steps
+        """
+        if trace_file is not None:
+            TRACER.start()
+        if metrics_port is not None:
+            metrics.REGISTRY.serve(metrics_port)
         sx = Stepper("X", cfg.STEPPER_MODE_X, self.debug)
         sy = Stepper("Y", cfg.STEPPER_MODE_Y, self.debug)
         sz = Stepper("Z", cfg.STEPPER_MODE_Z, self.debug)
@@ -30,11 +57,43 @@ class Router(object):
         sy.enable()
         sz.enable()
 
-        gcodes = GCodeParser.read_lines(gcode_file)
-        machine = Machine(sx, sy, sz, self.debug)
-        for gcode in gcodes:
-            self.logger.info("Executing '{}'".format(gcode))
-            machine.execute(gcode)
+        compiled = gcode_file.endswith(compiler.ARTIFACT_SUFFIX)
+        if not compiled:
+            program = Program.load(gcode_file, cache=cfg.PROGRAM_CACHE)
+        override = FeedOverride(create=True, percent=feed_override)
+        machine = Machine(sx, sy, sz, self.debug, override)
+        # Check axis limits of the whole job before any motion,
+        # compiled jobs are checked against the current limits on loading
+        try:
+            if compiled:
+                blocks = compiler.load_artifact(
+                    gcode_file, machine.get_coordinates(), machine.get_plane())
+            else:
+                program.validate(machine.get_coordinates())
+        except Exception:
+            machine.close()
+            override.close()
+            raise
+        if not compiled:
+            blocks = self._plan(program.gcodes(), machine, processes, profile, optimize,
+                                coalesce, os.path.basename(gcode_file))
+        try:
+            for block in blocks:
+                self.logger.info("Executing '%s'", block.gcode)
+                if block.feed_limit is not None:
+                    self.logger.warning("Feed of '%s' limited to F%.1f by centripetal acceleration",
+                                        block.gcode, block.feed_limit)
+                machine.run_block(block)
+        finally:
+            blocks.close()
+            machine.close()
+            override.close()
+            if metrics_file is not None:
+                metrics.REGISTRY.dump(metrics_file)
+            metrics.REGISTRY.shutdown()
+            if trace_file is not None:
+                TRACER.stop()
+                TRACER.write(trace_file)
 
         sx.disable()
         sy.disable()
@@ -43,18 +102,61 @@ class Router(object):
             import RPi.GPIO as GPIO
             GPIO.cleanup()
 
+    def _plan(self, gcodes, machine, processes, profile, optimize, coalesce, name):
+        """Optimizes and plans GCode of a job.
+
+        Returns:
+            blocks (generator): Planned blocks in program order
+        """
+        if optimize:
+            gcodes, before, after = optimizer.optimize(
+                gcodes, machine.get_coordinates(), machine.get_plane())
+            self.logger.info("Rapid travel time %.2fs, optimized %.2fs", before, after)
+        if coalesce:
+            gcodes, eliminated = optimizer.coalesce(
+                gcodes, machine.get_coordinates(), machine.get_plane())
+            self.logger.info("Coalescing eliminated %d blocks", eliminated)
+        profile_path = name + ".pstats" if profile else None
+        planner = BlockPlanner(processes, profile=profile, profile_path=profile_path)
+        return planner.plan(gcodes, machine.get_coordinates(), machine.get_plane())
+
 
 def main():
     parser = ArgumentParser(description="Process materials")
     parser.add_argument("-i", "--gcode", dest="gcode",
-                        help="input g-code file", required=True)
+                        help="input g-code file or compiled job (*{})".format(compiler.ARTIFACT_SUFFIX), required=True)
     parser.add_argument("-d", "--debug", dest="debug",
                         action="store_true", help="Set debug mode")
+    parser.add_argument("-f", "--feed-override", dest="feed_override", type=float,
+                        help="Initial feed override in percent, adjust while running with feed_override.py", default=100.0)
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int,
+                        help="Number of processes planning blocks in parallel", default=cfg.PLANNER_PROCESSES)
+    parser.add_argument("-p", "--metrics-port", dest="metrics_port", type=int,
+                        help="Serve metrics in Prometheus format on local port", default=cfg.METRICS_PORT)
+    parser.add_argument("-m", "--metrics-file", dest="metrics_file",
+                        help="Write metrics in Prometheus format to file at job end", default=cfg.METRICS_FILE)
+    parser.add_argument("-t", "--trace", dest="trace",
+                        help="Write Chrome trace of the job to file")
+    parser.add_argument("-P", "--profile", dest="profile",
+                        help="Profile planning of blocks START:END, writes <gcode>.pstats")
+    parser.add_argument("-o", "--optimize", dest="optimize", action="store_true",
+                        help="Reorder machining operations to minimize rapid travel")
+    parser.add_argument("-c", "--coalesce", dest="coalesce", action="store_true",
+                        help="Merge collinear linear moves and drop moves without steps")
     args = parser.parse_args()
 
-    router = Router(args.debug)
+    profile = None
+    if args.profile:
+        start, end = args.profile.split(":")
+        profile = (int(start or 0), int(end) if end else float("inf"))
 
-    router.run(args.gcode)
+    router = Router(args.debug)
+    try:
+        router.run(args.gcode, args.feed_override, args.jobs,
+                   args.metrics_port, args.metrics_file, args.trace, profile,
+                   args.optimize, args.coalesce)
+    finally:
+        router.close()
 
 
 if __name__ == "__main__":
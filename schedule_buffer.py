@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import struct
+import time
+
+import config as cfg
+import realtime
+
+# Record layout: direction (int8), padding, interval in seconds (float64)
+RECORD = struct.Struct("<b7xd")
+# Header layout: write index, read index (records since creation)
+HEADER = struct.Struct("<QQ")
+
+# Markers stored in the direction field
+BLOCK_START = 125
+FEED_START = 126
+BLOCK_END = 127
+STOP = -128
+
+
+class ScheduleBuffer(object):
+    """
+    Single producer, single consumer ring buffer of step intervals
+    held in shared memory.
+
+    The producer owns the write index and the consumer the read index,
+    each is only published after the records in front of it have been
+    written or read. Records are packed and unpacked in place, so the
+    schedule is never copied into the executor process. Blocks are
+    framed by start and end markers, the start marker holds the time
+    at which the executors begin stepping.
+
+    Attributes:
+        name (str): Name of the shared memory segment
+        capacity (int): Number of records
+    """
+
+    def __init__(self, name=None, create=True, capacity=cfg.SCHEDULE_BUFFER_RECORDS,
+                 chunk=cfg.SCHEDULE_BUFFER_CHUNK):
+        self._owner = create
+        self.capacity = capacity
+        self._chunk = chunk
+        if create:
+            self._shm = SharedMemory(name, create=True,
+                                     size=HEADER.size + capacity * RECORD.size)
+            HEADER.pack_into(self._shm.buf, 0, 0, 0)
+        else:
+            self._shm = SharedMemory(name)
+            # Only the creating process may unlink the segment
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        self._write_index, self._read_index = HEADER.unpack_from(self._buf)
+
+    def _published(self):
+        return HEADER.unpack_from(self._buf)
+
+    def _publish_write(self):
+        struct.pack_into("<Q", self._buf, 0, self._write_index)
+
+    def _publish_read(self):
+        struct.pack_into("<Q", self._buf, 8, self._read_index)
+
+    def pending(self):
+        """Gets number of records not yet read."""
+        write_index, read_index = self._published()
+        return write_index - read_index
+
+    def write(self, records, offset=0, limit=None):
+        """Writes records as far as space allows without blocking.
+
+        Parameters:
+            records (list): Step timing intervals (direction, interval)
+            offset (int): Index of first record to write
+            limit (int): Maximum number of records to write
+
+        Returns:
+            n (int): Number of records written
+        """
+        read_index = self._published()[1]
+        n = min(len(records) - offset, self.capacity - (self._write_index - read_index))
+        if limit is not None:
+            n = min(n, limit)
+        if n <= 0:
+            return 0
+        pack_into = RECORD.pack_into
+        buf = self._buf
+        capacity = self.capacity
+        w = self._write_index
+        for i, dt in records[offset:offset+n]:
+            pack_into(buf, HEADER.size + (w % capacity) * RECORD.size, i, dt)
+            w += 1
+        self._write_index = w
+        self._publish_write()
+        return n
+
+    def write_marker(self, marker, value=0.0):
+        """Writes marker record, waits for a free record if the buffer is full."""
+        while not self.write(((marker, value),)):
+            time.sleep(cfg.SCHEDULE_BUFFER_POLL)
+
+    def read_start(self):
+        """Waits for the next block start marker.
+
+        Returns:
+            start (tuple): Marker and start time of the block,
+                None if the consumer is asked to stop
+        """
+        records = self._read()
+        try:
+            for marker, value in records:
+                if marker == STOP:
+                    return None
+                if marker in (BLOCK_START, FEED_START):
+                    return marker, value
+        finally:
+            records.close()
+
+    def read_block(self):
+        """Reads step intervals in place until the block end marker.
+
+        Returns:
+            records (generator): Step timing intervals (direction, interval)
+        """
+        records = self._read()
+        try:
+            for marker, value in records:
+                if marker == BLOCK_END:
+                    return
+                yield marker, value
+        finally:
+            records.close()
+
+    def _read(self):
+        unpack_from = RECORD.unpack_from
+        buf = self._buf
+        capacity = self.capacity
+        chunk = self._chunk
+        r = self._read_index
+        try:
+            while True:
+                write_index = self._published()[0]
+                if r == write_index:
+                    self._read_index = r
+                    self._publish_read()
+                    time.sleep(cfg.SCHEDULE_BUFFER_POLL)
+                    continue
+                while r < write_index:
+                    record = unpack_from(buf, HEADER.size + (r % capacity) * RECORD.size)
+                    r += 1
+                    if not r % chunk:
+                        self._read_index = r
+                        self._publish_read()
+                    yield record
+        finally:
+            self._read_index = r
+            self._publish_read()
+
+    def pretouch(self, write=False):
+        """Maps all pages of the buffer, see realtime.pretouch."""
+        realtime.pretouch(self._buf, write)
+
+    def close(self):
+        """Closes shared memory, the creating process also removes it."""
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+import json
+import math
+import time
+
+import numpy as np
+
+from block_planner import BlockPlanner
+import config as cfg
+from gcode_exceptions import GCodeError
+from kinematics import axis
+from motion_planner import MODE_SWITCH
+from program import Program
+
+AXES = ("X", "Y", "Z")
+
+
+class AxisTrace(object):
+    """
+    Position of an axis over time, one sample per step.
+
+    Attributes:
+        times (ndarray): Step times in s from block start, starting at 0
+        positions (ndarray): Axis positions in mm after each step
+        end (float): Time in s the axis finishes its intervals
+    """
+
+    def __init__(self, times, positions, end=None):
+        self.times = times
+        self.positions = positions
+        self.end = float(times[-1]) if end is None else end
+
+    def velocities(self):
+        """Velocities in mm/s between steps and their times."""
+        dt = np.diff(self.times)
+        moving = dt > 0
+        t = (self.times[1:] + self.times[:-1])[moving] / 2
+        return t, np.diff(self.positions)[moving] / dt[moving]
+
+    def peaks(self):
+        """Peak velocity in mm/s and acceleration in mm/s^2."""
+        t, v = self.velocities()
+        if not len(v):
+            return 0.0, 0.0
+        dt = np.diff(t)
+        moving = dt > 0
+        a = np.diff(v)[moving] / dt[moving]
+        return float(np.abs(v).max()), float(np.abs(a).max()) if len(a) else 0.0
+
+
+def trace_axis(key, intervals, start):
+    """Turns step intervals into a position-time trace.
+    Each interval is the period of its step, the step is taken at its
+    start as done by Stepper.step(). Mode switch records change the
+    distance of the following steps.
+
+    Parameters:
+        key (str): Axis name
+        intervals (list): Step timing intervals
+        start (float): Axis position before the block in mm
+
+    Returns:
+        trace (AxisTrace): Trace including the start position at time 0
+    """
+    a = axis(key)
+    if not intervals:
+        return AxisTrace(np.zeros(1), np.array([float(start)]))
+    records = np.array(intervals, dtype=float).reshape(-1, 2)
+    signs = records[:, 0]
+    switch = signs == MODE_SWITCH
+    # Mode of each record: forward fill of the mode switches
+    index = np.maximum.accumulate(np.where(switch, np.arange(len(records)), -1))
+    mode = np.where(index >= 0, records[np.maximum(index, 0), 1], a.mode)
+    # Start of each record: sum of the preceding intervals
+    dt = np.where(switch, 0.0, records[:, 1])
+    ends = np.cumsum(dt)
+    times = ends - dt
+    steps = np.where(switch, 0.0, signs * a.mode / mode)
+    positions = start + np.cumsum(steps) / a.steps_per_mm
+    step = steps != 0
+    return AxisTrace(np.concatenate(([0.0], times[step])),
+                     np.concatenate(([float(start)], positions[step])), float(ends[-1]))
+
+
+def _sample(traces, times):
+    """Positions of all axes at the given times."""
+    return np.column_stack([
+        trace.positions[np.searchsorted(trace.times, times, side="right") - 1]
+        for trace in traces])
+
+
+def _arc_center(block):
+    """Center of an arc block in its plane, from I/J/K or R.
+    Full circles given by R only have no defined center, None then.
+    """
+    keys = {"XY": ("X", "Y"), "XZ": ("X", "Z"), "YZ": ("Y", "Z")}[block.plane]
+    offsets = {"X": "I", "Y": "J", "Z": "K"}
+    start = np.array([block.start[key] for key in keys])
+    end = np.array([block.end[key] for key in keys])
+    ij = [block.gcode.get(offsets[key]) for key in keys]
+    if any(val is not None for val in ij):
+        center = start + np.array([val or 0.0 for val in ij])
+        return keys, center, float(np.hypot(*(start - center)))
+
+    r = block.gcode.get("R")
+    chord = end - start
+    length = float(np.hypot(*chord))
+    if not length:
+        return None
+    h = math.sqrt(max(r * r - length * length / 4, 0.0))
+    # Clockwise arcs with positive R have their center right of the chord
+    right = np.array([chord[1], -chord[0]]) / length
+    side = 1 if (block.gcode.get("G") == "02") == (r > 0) else -1
+    return keys, (start + end) / 2 + side * h * right, abs(r)
+
+
+def _deviation(block, points, keys):
+    """Max distance in mm of the sampled points from the programmed path,
+    None if the path is not defined."""
+    g = block.gcode.get("G")
+    if g in ("02", "03"):
+        arc = _arc_center(block)
+        if arc is None:
+            return None
+        plane_keys, center, r = arc
+        p = points[:, [keys.index(key) for key in plane_keys]]
+        return float(np.abs(np.hypot(*(p - center).T) - r).max())
+
+    start = np.array([block.start[key] for key in keys])
+    end = np.array([block.end[key] for key in keys])
+    d = end - start
+    length = np.sqrt(d.dot(d))
+    if not length:
+        return 0.0
+    p = points - start
+    # Distance from the line through start and end
+    along = p.dot(d) / length
+    return float(np.sqrt(np.maximum((p * p).sum(axis=1) - along * along, 0.0)).max())
+
+
+class BlockReport(object):
+    """
+    Simulated kinematics of a block.
+
+    Attributes:
+        gcode (GCode): GCode of the block
+        duration (float): Duration in s
+        velocity (dict): Peak velocity in mm/s by axis
+        acceleration (dict): Peak acceleration in mm/s^2 by axis
+        deviation (float): Max distance from the programmed path in mm,
+            None for independent rapid moves and undefined paths
+        desync (float): Spread of the last step times of the moving axes in s
+        feed_limit (float): Feed rate in mm/min an arc was limited to, None if not limited
+    """
+
+    def __init__(self, block, traces):
+        self.gcode = block.gcode
+        self.feed_limit = block.feed_limit
+        self.velocity = {}
+        self.acceleration = {}
+        for key, trace in traces.items():
+            self.velocity[key], self.acceleration[key] = trace.peaks()
+        moving = [key for key, trace in traces.items() if len(trace.times) > 1]
+        last = [traces[key].times[-1] for key in moving]
+        self.duration = max(trace.end for trace in traces.values())
+        self.desync = float(max(last) - min(last)) if last else 0.0
+        self.deviation = None
+        if moving and block.planner != "plan_move":
+            times = np.unique(np.concatenate([traces[key].times for key in moving]))
+            points = _sample([traces[key] for key in AXES], times)
+            self.deviation = _deviation(block, points, list(AXES))
+
+
+class Simulation(object):
+    """
+    Offline simulation of planned blocks.
+
+    Attributes:
+        reports (list): BlockReport of each block
+        duration (float): Total duration in s
+    """
+
+    def __init__(self, keep_traces=True):
+        """
+        Parameters:
+            keep_traces (bool): Keep traces of all blocks for export
+        """
+        self.reports = []
+        self.duration = 0.0
+        self._keep = keep_traces
+        self._traces = {key: [] for key in AXES}
+
+    def add(self, block):
+        """Simulates block after the previous blocks.
+
+        Returns:
+            report (BlockReport): Simulated kinematics of the block
+        """
+        traces = {key: trace_axis(key.lower(), getattr(block, "i" + key.lower()), block.start[key])
+                  for key in AXES}
+        report = BlockReport(block, traces)
+        if self._keep:
+            for key, trace in traces.items():
+                self._traces[key].append(AxisTrace(trace.times + self.duration, trace.positions))
+        self.reports.append(report)
+        self.duration += report.duration
+        return report
+
+    def summary(self):
+        """Summarizes the simulation.
+
+        Returns:
+            summary (dict): Duration, max deviation and desync with their
+                block, peak velocity and acceleration by axis and blocks
+                with limited feed
+        """
+        summary = {"blocks": len(self.reports), "duration": self.duration,
+                   "feed_limited": [str(r.gcode) for r in self.reports if r.feed_limit is not None],
+                   "deviation": 0.0, "deviation_block": None,
+                   "desync": 0.0, "desync_block": None,
+                   "velocity": {key: 0.0 for key in AXES},
+                   "acceleration": {key: 0.0 for key in AXES}}
+        for report in self.reports:
+            if report.deviation is not None and report.deviation > summary["deviation"]:
+                summary["deviation"] = report.deviation
+                summary["deviation_block"] = str(report.gcode)
+            if report.desync > summary["desync"]:
+                summary["desync"] = report.desync
+                summary["desync_block"] = str(report.gcode)
+            for key in AXES:
+                summary["velocity"][key] = max(summary["velocity"][key], report.velocity[key])
+                summary["acceleration"][key] = max(summary["acceleration"][key], report.acceleration[key])
+        return summary
+
+    def traces(self):
+        """Merged traces of the simulated blocks.
+
+        Returns:
+            times (ndarray): Times of all steps in s
+            positions (ndarray): Positions of X, Y and Z at these times in mm
+        """
+        if not self._keep:
+            raise ValueError("Traces not kept")
+        merged = [AxisTrace(np.concatenate([t.times for t in self._traces[key]] or [np.zeros(1)]),
+                            np.concatenate([t.positions for t in self._traces[key]] or [np.zeros(1)]))
+                  for key in AXES]
+        times = np.unique(np.concatenate([trace.times for trace in merged]))
+        return times, _sample(merged, times)
+
+    def export(self, path):
+        """Writes traces to path, as numpy archive (.npz) or CSV."""
+        times, positions = self.traces()
+        if path.endswith(".npz"):
+            np.savez_compressed(path, t=times, **{key: positions[:, n] for n, key in enumerate(AXES)})
+        else:
+            np.savetxt(path, np.column_stack((times, positions)), fmt="%.6f",
+                       delimiter=",", header="t," + ",".join(AXES), comments="")
+
+
+def simulate(blocks, keep_traces=True):
+    """Simulates planned blocks.
+
+    Parameters:
+        blocks (iterable): Planned blocks in program order
+        keep_traces (bool): Keep traces for export
+
+    Returns:
+        simulation (Simulation): Simulation of all blocks
+    """
+    simulation = Simulation(keep_traces)
+    for block in blocks:
+        simulation.add(block)
+    return simulation
+
+
+def main():
+    parser = ArgumentParser(description="Simulates axis kinematics of a GCode file offline")
+    parser.add_argument("-i", "--gcode", dest="gcode",
+                        help="input g-code file", required=True)
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int,
+                        help="Number of processes planning blocks in parallel", default=cfg.PLANNER_PROCESSES)
+    parser.add_argument("-e", "--export", dest="export",
+                        help="Write traces to file (.npz or CSV)")
+    args = parser.parse_args()
+
+    t = time.time()
+    with open(cfg.coord_file) as file_obj:
+        start = json.load(file_obj)
+    try:
+        program = Program.load(args.gcode, cfg.PROGRAM_CACHE)
+    except GCodeError as e:
+        print("Could not parse {}: {} '{}'".format(args.gcode, e.message, e.expression))
+        return
+    for line, key, val in program.violations(start):
+        print("Line {}: {} {} out of bounds".format(line, key, val))
+    blocks = BlockPlanner(args.jobs).plan(program.gcodes(), start)
+    simulation = simulate(blocks, keep_traces=args.export is not None)
+    summary = simulation.summary()
+    print("{} blocks, job duration {:.2f}s, simulated in {:.2f}s".format(
+        summary["blocks"], summary["duration"], time.time() - t))
+    print("Max path deviation {:.4f} mm ({})".format(summary["deviation"], summary["deviation_block"]))
+    print("Max axis desync {:.6f} s ({})".format(summary["desync"], summary["desync_block"]))
+    for report in simulation.reports:
+        if report.feed_limit is not None:
+            print("Feed limited to F{:.1f} by centripetal acceleration ({})".format(
+                report.feed_limit, report.gcode))
+    for key in AXES:
+        a = axis(key)
+        print("{}: peak velocity {:.1f} mm/s (max {:.1f}), peak acceleration {:.1f} mm/s^2 (max {:.1f})".format(
+            key, summary["velocity"][key], a.traversal / 60.0,
+            summary["acceleration"][key], a.acceleration))
+    if args.export:
+        simulation.export(args.export)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Simulated spidev backend emulating a DRV8711 on every chip select.
+Frames are 16 bit: bit 15 selects a read, bits 14-12 hold the register
+address and bits 11-0 the data. Transfers are counted and faults can
+be injected into the STATUS register, so drivers can be tested without
+hardware.
+"""
+
+import threading
+
+# Register values after reset of DRV8711
+RESET = (0xC10, 0x1FF, 0x030, 0x080, 0x110, 0x040, 0xA59, 0x000)
+
+STATUS = 0x07
+
+
+class SpiDev(object):
+
+    def __init__(self):
+        self.mode = 0
+        self.cshigh = False
+        self.max_speed_hz = 0
+        self.bits_per_word = 8
+        self.registers = list(RESET)
+        self.transfers = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def open(self, bus, device):
+        self._opened = (bus, device)
+
+    def close(self):
+        self._opened = None
+
+    def inject(self, bits):
+        """Sets fault bits in STATUS as the device would on a fault."""
+        with self._lock:
+            self.registers[STATUS] |= bits
+
+    def xfer2(self, data):
+        if self._opened is None:
+            raise IOError("SPI device not open")
+        if len(data) != 2:
+            raise ValueError("DRV8711 frames are 16 bit")
+        frame = data[0] << 8 | data[1]
+        address = (frame >> 12) & 0x07
+        with self._lock:
+            self.transfers += 1
+            if frame & 0x8000:
+                value = self.registers[address]
+                return [value >> 8, value & 0xFF]
+            value = frame & 0xFFF
+            if address == STATUS:
+                # Fault bits are cleared by writing 0
+                self.registers[address] &= value
+            else:
+                self.registers[address] = value
+            return [0, 0]
+
+    xfer = xfer2
@@ -7,10 +7,17 @@ import sys
 import threading
 import time
 
-# Uncomment for testing
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    # Simulated GPIO backend for testing without Raspberry Pi
+    import gpio_sim as GPIO
 
 import config as cfg
+from DRV8711 import DRV8711
+import metrics
+from motion_planner import CRUISE
+from motion_planner import MODE_SWITCH
 
 
 def _busy_wait(dt):
@@ -20,6 +27,12 @@ def _busy_wait(dt):
         pass
 
 
+def _wait_until(deadline):
+    """Busy waits until deadline, an absolute time as of time.time()."""
+    while time.time() < deadline:
+        pass
+
+
 class Stepper(object):
     """
     A class for stepper motor methods.
@@ -35,9 +48,12 @@ class Stepper(object):
 
         self._logger = logging.getLogger(self._name)
         self._debug = debug
+        # SPI driver of motors with SPI configuration
+        self._device = None
 
         if self._driver in cfg.drivers:
             self._modes = cfg.drivers[self._driver]["modes"]
+            self._pulse_width = cfg.drivers[self._driver]["pulse_width"]
         else:
             print("Error: Could not load config for {}".format(self._driver))
             sys.exit(1)
@@ -58,6 +74,17 @@ class Stepper(object):
         GPIO.output(list(self._gpios.values()), False)
 #        self.set_mode(self._mode, initial=True)
         self.set_direction(self._direction, initial=True)
+        if self._driver == "DRV8711":
+            self._configure_drv8711()
+
+    def _configure_drv8711(self):
+        """Applies register configuration and mode to DRV8711 in one batch."""
+        driver_cfg = cfg.drivers["DRV8711"]
+        self._device = DRV8711(driver_cfg["spi_bus"], cfg.steppers[self._name]["cs"],
+                               driver_cfg["spi_speed_hz"])
+        settings = dict(driver_cfg["registers"])
+        settings["MODE"] = self._mode.bit_length() - 1
+        self._device.configure(settings)
 
     def enable(self):
         """Activate sleep mode"""
@@ -84,14 +111,18 @@ class Stepper(object):
             raise ValueError("Mode not available: {}".format(mode))
         bits = self._modes[mode]
         self._logger.debug(
-            "{} - Setting Microstepping Mode: 1/{} {}".format(self._name, mode, bits))
-
-        if not self._debug:
-            GPIO.output((self._gpios["m2"], self._gpios["m1"],
-                         self._gpios["m0"]), (bits[0], bits[1], bits[2]))
+            "%s - Setting Microstepping Mode: 1/%s %s", self._name, mode, bits)
+
+        if self._device is not None:
+            self._device.set_mode(mode)
+        elif not self._debug:
+            pins = ("m2", "m1", "m0")
+            if not all(pin in self._gpios for pin in pins):
+                raise ValueError("{} has no mode pins configured".format(self._name))
+            GPIO.output([self._gpios[pin] for pin in pins], bits[-3:])
             time.sleep(0.001)
 
-        self.mode = mode
+        self._mode = mode
 
     def get_direction(self):
         """Get direction of stepper motor"""
@@ -102,26 +133,146 @@ class Stepper(object):
         # Do not change direction if input direction equals current direction
         if self._direction == direction and not initial:
             return
-        self._logger.debug(
-            "{} - Setting direction: {}".format(self._name, direction))
+        self._logger.debug("%s - Setting direction: %s", self._name, direction)
         if not self._debug:
             GPIO.output(self._gpios["dir"], self._dirs[direction])
             time.sleep(0.001)
         self._direction = direction
 
-    def step(self, interval):
-        """Performs motor movement based on interval."""
-        gpio_step = self._gpios["step"]
+    def get_device(self):
+        """Gets SPI driver, None if the driver has no SPI interface."""
+        return self._device
+
+    def _cruise(self, count, sign, dt, override=None, abort=None):
+        """Emits steps of constant interval with PWM on the step pin.
+        PWM is stopped in the low phase of a pulse CRUISE_PWM_TAIL s before
+        the end of the segment, the emitted pulses are counted from
+        the elapsed cycles and the rest is bit-banged against the deadlines
+        of the following periods, so the segment emits exactly count steps.
+        The CPU sleeps between checks of abort and feed override while more
+        than the worst-case sleep latency CRUISE_PWM_LATENCY remains, and
+        busy waits for the stop after that.
+
+        Returns:
+            steps (int): Number of emitted steps
+        """
+        if sign == -1:
+            self.set_direction("CCW")
+        else:
+            self.set_direction("CW")
+        factor = override.factor() if override is not None else 1.0
+        # The interval is the step period, see step(), a pulse rises at the
+        # start of each cycle
+        frequency = factor / dt
+        pulses = max(count - int(math.ceil(cfg.CRUISE_PWM_TAIL * frequency)), 1)
+        pwm = None
+        if not self._debug:
+            pwm = GPIO.PWM(self._gpios["step"], frequency)
+            pwm.start(50)
+        cycles = 0.0
+        t = time.time()
+        end = t + (pulses - 0.25) / frequency
+        while True:
+            if abort is not None and abort.value:
+                break
+            if end - time.time() <= cfg.CRUISE_PWM_CHECK + cfg.CRUISE_PWM_LATENCY:
+                _wait_until(end)
+                break
+            time.sleep(cfg.CRUISE_PWM_CHECK)
+            if override is not None and override.factor() != factor:
+                now = time.time()
+                cycles += (now - t) * frequency
+                t = now
+                factor = override.factor()
+                frequency = factor / dt
+                if pwm is not None:
+                    pwm.ChangeFrequency(frequency)
+                end = t + (pulses - 0.25 - cycles) / frequency
+        stopped = time.time()
+        if pwm is not None:
+            pwm.stop()
+        cycles += (stopped - t) * frequency
+        emitted = int(cycles) + 1
 
-        for i, dt in interval:
+        gpio_step = self._gpios["step"]
+        deadline = stopped + (emitted - cycles) / frequency
+        while emitted < count:
+            _wait_until(deadline)
+            if abort is not None and abort.value:
+                break
+            emitted += 1
+            GPIO.output(gpio_step, True)
+            _busy_wait(self._pulse_width)
+            GPIO.output(gpio_step, False)
+            if override is not None:
+                factor = override.factor()
+            deadline += dt / factor
+        _wait_until(deadline)
+
+        if emitted != count and not (abort is not None and abort.value):
+            self._logger.warning("%s - Cruise segment emitted %d of %d steps",
+                                 self._name, emitted, count)
+        return emitted
+
+    def step(self, interval, override=None, abort=None):
+        """Performs motor movement based on interval.
+        Each interval is the full period of its step. The step pin is held
+        high for the pulse width of the driver at the start of the period,
+        periods are timed against deadlines so GPIO and loop overhead does
+        not add up.
+
+        Parameters:
+            interval (list): Step timing intervals
+            override (FeedOverride): Live feed override scaling the intervals
+            abort (RawValue): Shared flag stopping the movement when set
+
+        Returns:
+            steps (int): Number of emitted steps
+        """
+        gpio_step = self._gpios["step"]
+        steps = 0
+        mode = self._mode
+
+        deadline = time.time()
+        records = iter(interval)
+        for i, dt in records:
+            if abort is not None and abort.value:
+                break
+            if i == MODE_SWITCH:
+                self.set_mode(int(dt))
+                continue
+            if i == CRUISE:
+                sign, step_dt = next(records)
+                steps += self._cruise(int(dt), sign, step_dt, override, abort)
+                continue
             if i == -1:
                 self.set_direction("CCW")
             else:
                 self.set_direction("CW")
-            for ele in (True, False):
-                if i:
-                    GPIO.output(gpio_step, ele)
-                _busy_wait(dt)
+            # Feed moves are planned so the max override keeps ramps
+            # within the axis acceleration, see _override_headroom()
+            if override is not None:
+                dt /= override.factor()
+            # Periods running late by more than a period, e.g. after a mode
+            # switch, restart instead of bursting steps to catch up
+            now = time.time()
+            if now - deadline > dt:
+                deadline = now
+            deadline += dt
+            if i:
+                steps += 1
+                GPIO.output(gpio_step, True)
+                _busy_wait(self._pulse_width)
+                GPIO.output(gpio_step, False)
+            _wait_until(deadline)
+
+        # Blocks switching mode switch back before they end, an aborted
+        # block skips that and would leave the following blocks scaled
+        if abort is not None and abort.value and self._mode != mode:
+            self.set_mode(mode)
+
+        metrics.STEPS.inc(steps, axis=self._name)
+        return steps
 
 
 def main():
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+from collections import deque
+import logging
+import os
+import queue
+import select
+import socket
+import termios
+import threading
+import time
+import tty
+
+from block_planner import plan_block
+from gcode import GCode
+from gcode_exceptions import GCodeError
+from gcode_parser import GCodeParser
+import log_queue
+
+import config as cfg
+
+
+class StreamServer(object):
+    """
+    Receives GCode line by line from a stream and executes it.
+
+    Every received line is answered with "ok" once it left the receive
+    buffer, or with "error:<message>" if it could not be parsed. Hosts may
+    either wait for each answer or use character counting: send lines as
+    long as the unacknowledged characters fit into the receive buffer.
+    Parsed lines pass a bounded queue to a planning thread, planned blocks
+    pass a second bounded queue to the machine. A full queue stops reading
+    from the stream, so the host is throttled by the missing answers.
+    An error in any stage stops the other stages and is raised by run().
+
+    Attributes:
+        lines (int): Number of received lines
+        errors (int): Number of rejected lines
+    """
+
+    def __init__(self, fd, machine, rx_buffer_size=cfg.STREAM_RX_BUFFER_SIZE,
+                 queue_size=cfg.STREAM_QUEUE_SIZE):
+        self.logger = logging.getLogger("main")
+        self._fd = fd
+        self._machine = machine
+        self._rx_buffer_size = rx_buffer_size
+        self._gcodes = queue.Queue(queue_size)
+        self._blocks = queue.Queue(cfg.STREAM_PLANNED_BLOCKS)
+
+        self.lines = 0
+        self.errors = 0
+        self._started = None
+        self._finished = None
+
+        # Set when a stage fails or execution ends, stops all stages
+        self._stop = threading.Event()
+        self._error = None
+
+    def _reply(self, message):
+        os.write(self._fd, (message + "\n").encode())
+
+    def _put(self, q, item):
+        """Puts item on queue, False if stopped while the queue is full."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=cfg.STREAM_POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        """Gets item from queue, None if stopped while the queue is empty."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=cfg.STREAM_POLL)
+            except queue.Empty:
+                pass
+        return None
+
+    def _fail(self, error):
+        """Keeps the first error of a stage for run()."""
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _handle_line(self, raw):
+        """Parses line and queues it for planning."""
+        if self._started is None:
+            self._started = time.time()
+        line = raw.decode("ascii", "replace")
+        try:
+            params = GCodeParser.parse_line(line)
+        except GCodeError as e:
+            self.errors += 1
+            self._reply("error:{}".format(e.message))
+            return
+        # Blocks while the planner queue is full
+        if params and not self._put(self._gcodes, GCode(params)):
+            return
+        self.lines += 1
+        self._finished = time.time()
+        self._reply("ok")
+
+    def _receive(self):
+        """Reads lines from stream until it is closed or stopped."""
+        buf = b""
+        try:
+            while not self._stop.is_set():
+                if not select.select([self._fd], [], [], cfg.STREAM_POLL)[0]:
+                    continue
+                try:
+                    data = os.read(self._fd, self._rx_buffer_size)
+                except OSError:
+                    # Closed pseudo terminal
+                    data = b""
+                if not data:
+                    if buf.strip():
+                        self._handle_line(buf)
+                    break
+                buf += data
+                lines = buf.split(b"\n")
+                buf = lines.pop()
+                for line in lines:
+                    self._handle_line(line)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._gcodes, None)
+
+    def _plan(self):
+        """Plans queued GCode from the machine state after previous blocks."""
+        try:
+            coordinates = self._machine.get_coordinates()
+            plane = self._machine.get_plane()
+            while True:
+                gcode = self._get(self._gcodes)
+                if gcode is None:
+                    break
+                block = plan_block(gcode, coordinates, plane)
+                coordinates, plane = block.end, block.plane
+                if not self._put(self._blocks, block):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._blocks, None)
+
+    def run(self):
+        """Executes streamed GCode until the stream is closed.
+
+        Raises:
+            Exception: Error of the receiving, planning or executing stage
+        """
+        receiver = threading.Thread(target=self._receive)
+        planner = threading.Thread(target=self._plan)
+        receiver.start()
+        planner.start()
+        try:
+            while True:
+                block = self._get(self._blocks)
+                if block is None:
+                    break
+                self._machine.run_block(block)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            receiver.join()
+            planner.join()
+        if self._error is not None:
+            raise self._error
+        self.logger.info("Received %d lines (%d errors), %.1f lines per second",
+                         self.lines, self.errors, self.lines_per_second())
+
+    def lines_per_second(self):
+        """Gets sustained rate of received lines."""
+        if not self._started or self._finished == self._started:
+            return 0.0
+        return self.lines / (self._finished - self._started)
+
+
+class _Responses(object):
+    """Reads answer lines from stream."""
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._buf = b""
+
+    def readline(self):
+        while b"\n" not in self._buf:
+            data = os.read(self._fd, 1024)
+            if not data:
+                raise EOFError("Stream closed")
+            self._buf += data
+        line, self._buf = self._buf.split(b"\n", 1)
+        return line.decode()
+
+
+def stream(fd, lines, mode="count", rx_buffer_size=cfg.STREAM_RX_BUFFER_SIZE):
+    """Streams GCode lines to a StreamServer.
+
+    Parameters:
+        fd (int): File descriptor of stream
+        lines (list): GCode lines
+        mode (str): count (character counting) | ok (wait for each answer)
+        rx_buffer_size (int): Receive buffer size of server
+
+    Returns:
+        responses (list): Answers for each line
+        lines_per_second (float): Sustained rate of acknowledged lines
+    """
+    reader = _Responses(fd)
+    responses = []
+    pending = deque()
+    t = time.time()
+    for line in lines:
+        data = (line.strip() + "\n").encode()
+        if len(data) > rx_buffer_size:
+            raise ValueError("Line exceeds receive buffer: {}".format(line))
+        limit = rx_buffer_size - len(data) if mode == "count" else 0
+        while pending and sum(pending) > limit:
+            responses.append(reader.readline())
+            pending.popleft()
+        os.write(fd, data)
+        pending.append(len(data))
+    while pending:
+        responses.append(reader.readline())
+        pending.popleft()
+    elapsed = time.time() - t
+    return responses, len(lines) / elapsed if elapsed else 0.0
+
+
+def open_serial(device, baud=cfg.STREAM_BAUD):
+    """Opens serial device in raw mode."""
+    fd = os.open(device, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    speed = getattr(termios, "B{}".format(baud))
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    return fd
+
+
+def main():
+    parser = ArgumentParser(description="Executes GCode streamed over serial device or TCP")
+    parser.add_argument("-s", "--serial", dest="serial", help="Serial device")
+    parser.add_argument("-b", "--baud", dest="baud", type=int,
+                        help="Serial baud rate", default=cfg.STREAM_BAUD)
+    parser.add_argument("-t", "--tcp", dest="port", type=int,
+                        help="Listen on TCP port", default=cfg.STREAM_TCP_PORT)
+    parser.add_argument("--bind", dest="bind",
+                        help="TCP bind address, 0.0.0.0 for all interfaces",
+                        default=cfg.STREAM_TCP_BIND)
+    parser.add_argument("-d", "--debug", dest="debug",
+                        action="store_true", help="Set debug mode")
+    args = parser.parse_args()
+
+    from machine import Machine
+    from stepper import Stepper
+
+    log_listener = log_queue.configure()
+    try:
+        sx = Stepper("X", cfg.STEPPER_MODE_X, args.debug)
+        sy = Stepper("Y", cfg.STEPPER_MODE_Y, args.debug)
+        sz = Stepper("Z", cfg.STEPPER_MODE_Z, args.debug)
+        machine = Machine(sx, sy, sz, args.debug)
+        sx.enable()
+        sy.enable()
+        sz.enable()
+        try:
+            if args.serial:
+                fd = open_serial(args.serial, args.baud)
+                try:
+                    StreamServer(fd, machine).run()
+                finally:
+                    os.close(fd)
+            else:
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                try:
+                    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    server.bind((args.bind, args.port))
+                    server.listen(1)
+                    conn, _ = server.accept()
+                    try:
+                        StreamServer(conn.fileno(), machine).run()
+                    finally:
+                        conn.close()
+                finally:
+                    server.close()
+        finally:
+            # Runs on errors and Ctrl-C as well, drivers must not stay enabled
+            machine.close()
+            sx.disable()
+            sy.disable()
+            sz.disable()
+    finally:
+        log_listener.stop()
+        if not args.debug:
+            import RPi.GPIO as GPIO
+            GPIO.cleanup()
+
+
+if __name__ == "__main__":
+    main()
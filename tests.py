@@ -1,10 +1,41 @@
 #!/usr/bin/env python
 
+import asyncio
+import gc
+import json
+import logging
+import math
+import multiprocessing
 import os
+import pty
+import socket
+import struct
+import tempfile
+import threading
+import time
+import tty
 import unittest
+from unittest import mock
+import urllib.request
+from multiprocessing import Process
+from multiprocessing.shared_memory import SharedMemory
+
+import config as cfg
+
+from block_planner import BlockPlanner
+from block_planner import plan_block
+from block_planner import resolve_blocks
+from block_planner import resolve_end
+from block_planner import _rapid_planner
+
+from controller import Controller
+
+from feed_override import FeedOverride
 
 from gcode import GCode
 
+import metrics
+
 from gcode_exceptions import DuplicateGCodeError
 from gcode_exceptions import GCodeNotFoundError
 from gcode_exceptions import GCodeOutOfBoundsError
@@ -14,15 +45,64 @@ from gcode_exceptions import UnsupportedGCodeError
 
 from gcode_parser import GCodeParser
 
+from tracing import Tracer
+
+from log_queue import LogListener
+
+import optimizer
+
+import schedule_buffer
+from schedule_buffer import ScheduleBuffer
+
+from machine import Machine
+from machine import _execute
+from block_planner import Block
+
+import realtime
 
+import DRV8711
+
+from fault_monitor import DriverFault
+from fault_monitor import FaultMonitor
+
+import kinematics
+
+import numpy as np
+from program import Program
+import program
+
+import simulator
+
+import compiler
+
+import gpio_sim
+from motion_planner import CRUISE
+from motion_planner import _cruise_segments
+
+from stream_server import StreamServer
+from stream_server import stream
+
+
+from motion_planner import _configure_ramp
 from motion_planner import _configure_ramp_trapezoidal
+from motion_planner import _configure_ramp_scurve
 from motion_planner import _configure_ramp_sigmoidal
+from motion_planner import _configure_ramp_ax
+from motion_planner import _arc_limits
+from motion_planner import _ramp_path
 from motion_planner import _mm_to_steps
 from motion_planner import _mm_per_min_to_pps
 from motion_planner import _overlay_ramp
 from motion_planner import _plan_interpolated_arc
 from motion_planner import _plan_interpolated_line
+from motion_planner import _plan_coordinated_move
 from motion_planner import _plan_move
+from motion_planner import _switch_mode
+from motion_planner import _synchronize
+from motion_planner import MODE_SWITCH
+from motion_planner import MotionPlanner
+
+from stepper import Stepper
 
 
 class TestGCode(unittest.TestCase):
@@ -160,6 +240,500 @@ class TestStepper(unittest.TestCase):
         self.assertEqual([round(x, 6) for x in _configure_ramp_sigmoidal(
             200.0, 2, 1.8, 5, 50.0)], c)
 
+    def test_configure_ramp_start_velocity(self):
+        c = [0.000617, 0.000603, 0.000589]
+        self.assertEqual(_configure_ramp_trapezoidal(
+            600.0, 8, 1.8, 5, 200.0, 300.0)[:3], c)
+        # [n_steps = (v^2 - v0^2) / (2 * a) * steps_per_mm]
+        self.assertEqual(len(_configure_ramp_trapezoidal(
+            600.0, 8, 1.8, 5, 200.0, 300.0)), 60)
+
+        # Ramp starting at target velocity only holds cruise interval
+        self.assertEqual(_configure_ramp_sigmoidal(
+            600.0, 8, 1.8, 5, 200.0, 600.0), [1 / 3200.0])
+        self.assertLess(len(_configure_ramp_sigmoidal(
+            600.0, 8, 1.8, 5, 200.0, 300.0)), len(_configure_ramp_sigmoidal(
+                600.0, 8, 1.8, 5, 200.0)))
+
+        # Sigmoidal ramps start at the start velocity, lower start
+        # velocities start at the start of the sigmoid like ramps from rest
+        ramp = _configure_ramp_sigmoidal(2000.0, 8, 1.8, 5, 80.0)
+        self.assertEqual(_configure_ramp_sigmoidal(2000.0, 8, 1.8, 5, 80.0, 1.0), ramp)
+        self.assertEqual(_configure_ramp_sigmoidal(2000.0, 8, 1.8, 5, 80.0, -50.0), ramp)
+        self.assertAlmostEqual(_configure_ramp_sigmoidal(
+            2000.0, 8, 1.8, 5, 80.0, 1000.0)[0], 60.0 / 1000.0 / 320.0, places=6)
+        # Start velocities within a step of the target hold the cruise interval
+        ramp = _configure_ramp_sigmoidal(2000.0, 8, 1.8, 5, 80.0, 1999.0)
+        self.assertEqual(len(ramp), 1)
+        self.assertAlmostEqual(ramp[0], 60.0 / 2000.0 / 320.0)
+        self.assertEqual(_overlay_ramp(10, ramp, 1), [(1, ramp[0])] * 10)
+        with self.assertRaises(ValueError):
+            _overlay_ramp(10, [], 1)
+
+    def test_configure_ramp_scurve(self):
+        c = _configure_ramp_scurve(2000.0, 8, 1.8, 5, 80.0, 0.0, 2000.0)
+        # Total duration of jerk, constant acceleration and jerk phases
+        # [t = 2 * a / j + (v - a^2 / j) / a]
+        self.assertAlmostEqual(sum(c), 0.456708, places=5)
+        self.assertEqual(len(c), 2436)
+        self.assertAlmostEqual(c[-1], 60.0 / 2000.0 / 320.0, places=9)
+        self.assertTrue(all(c[i] >= c[i+1] for i in range(len(c) - 1)))
+
+        c = _configure_ramp_scurve(2000.0, 8, 1.8, 5, 80.0, 600.0, 2000.0)
+        self.assertAlmostEqual(c[0], 60.0 / 600.0 / 320.0, places=6)
+        self.assertEqual(len(c), 2300)
+
+        # Without jerk limit the profile is trapezoidal
+        self.assertEqual(_configure_ramp_scurve(200.0, 2, 1.8, 5, 200.0),
+                         _configure_ramp_trapezoidal(200.0, 2, 1.8, 5, 200.0))
+
+    def test_configure_ramp_registry(self):
+        self.assertEqual(
+            _configure_ramp("sigmoidal", 200.0, 2, 1.8, 5, 200.0),
+            _configure_ramp_sigmoidal(200.0, 2, 1.8, 5, 200.0))
+        with self.assertRaises(ValueError):
+            _configure_ramp("polynomial", 200.0, 2, 1.8, 5, 200.0)
+
+    def test_step_period(self):
+        s = Stepper("X", 8)
+        dt = 0.0005
+        clock = [1000.0]
+
+        def tick():
+            # Every reading of the clock takes 1 us
+            clock[0] += 1e-6
+            return clock[0]
+
+        gpio_sim.reset()
+        with mock.patch("time.time", tick):
+            t = time.time()
+            self.assertEqual(s.step([(1, dt)] * 200 + [(0, dt)] * 20), 200)
+            elapsed = time.time() - t
+        # The interval is the full period of a step
+        self.assertAlmostEqual(elapsed, 220 * dt, delta=1e-5)
+        pin = cfg.steppers["X"]["gpios"]["step"]
+        edges = gpio_sim.rising_edges(pin)
+        self.assertEqual(len(edges), 200)
+        for a, b in zip(edges, edges[1:]):
+            self.assertAlmostEqual(b - a, dt, delta=1e-5)
+        # Pin is held high for the pulse width only
+        high = [t for t, p, value in gpio_sim.events if p == pin and value]
+        low = [t for t, p, value in gpio_sim.events if p == pin and not value]
+        self.assertLess(max(l - h for h, l in zip(high, low)), dt / 2)
+
+    def test_driver_pulse_width(self):
+        for driver, driver_cfg in cfg.drivers.items():
+            self.assertGreater(driver_cfg.get("pulse_width", 0.0), 0.0, driver)
+
+
+class TestBlockPlanner(unittest.TestCase):
+
+    def setUp(self):
+        lines = ["G00 X10 Y20", "G01 X20 Z10 F600",
+                 "G18", "G00 Z5", "G28", "G00 Y1.5"]
+        self.gcodes = [GCode(GCodeParser.parse_line(line)) for line in lines]
+        self.coordinates = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+
+    def test_resolve_blocks(self):
+        blocks = list(resolve_blocks(self.gcodes, self.coordinates))
+        self.assertEqual([plane for _, _, plane in blocks],
+                         ["XY", "XY", "XY", "XZ", "XZ", "XZ"])
+        self.assertEqual(blocks[1][1], {"X": 10.0, "Y": 20.0, "Z": 0.0})
+        self.assertEqual(blocks[3][1], {"X": 20.0, "Y": 20.0, "Z": 10.0})
+        self.assertEqual(blocks[5][1], {"X": 0.0, "Y": 0.0, "Z": 0.0})
+
+    def test_plan_block(self):
+        block = plan_block(self.gcodes[1], {"X": 10.0, "Y": 20.0, "Z": 0.0})
+        self.assertEqual(block.end, {"X": 20.0, "Y": 20.0, "Z": 10.0})
+        self.assertEqual((len(block.ix), len(block.iy), len(block.iz)),
+                         (3200, 0, 3200))
+        self.assertTrue(block.is_feed_move())
+
+        block = plan_block(self.gcodes[2], self.coordinates)
+        self.assertEqual(block.plane, "XZ")
+        self.assertEqual((block.ix, block.iy, block.iz), ([], [], []))
+
+    def test_plan_rapid_mode(self):
+        gcode = GCode(GCodeParser.parse_line("G00 X30 Y5"))
+        start = {"X": 0.0125, "Y": 0.0, "Z": 0.0}
+        fine = plan_block(gcode, start)
+        modes = (cfg.STEPPER_RAPID_MODE_X, cfg.STEPPER_RAPID_MODE_Y)
+        cfg.STEPPER_RAPID_MODE_X = cfg.STEPPER_RAPID_MODE_Y = 2
+        try:
+            block = plan_block(gcode, start)
+        finally:
+            cfg.STEPPER_RAPID_MODE_X, cfg.STEPPER_RAPID_MODE_Y = modes
+
+        # X switches after 4 fine steps to the full step position 0.025 mm
+        switches = [n for n, (sign, _) in enumerate(block.ix) if sign == MODE_SWITCH]
+        self.assertEqual(switches[0], 4)
+        self.assertEqual([block.ix[n][1] for n in switches], [2.0, 8.0])
+        steps = sum(4 if switches[0] < n < switches[1] else 1
+                    for n, (sign, _) in enumerate(block.ix) if sign != MODE_SWITCH)
+        self.assertEqual(steps, len(fine.ix))
+        self.assertAlmostEqual(sum(dt for sign, dt in block.ix if sign != MODE_SWITCH),
+                               sum(dt for _, dt in fine.ix))
+        # Short moves stay in fine mode
+        self.assertEqual(block.iy, fine.iy)
+
+        s = Stepper("X", 8, debug=True)
+        self.assertEqual(s.step(block.ix[:8]), 7)
+        self.assertEqual(s.get_mode(), 2)
+
+    def test_abort_rapid_mode(self):
+        s = Stepper("X", 8, debug=True)
+        abort = multiprocessing.RawValue("b", 0)
+        intervals = [(MODE_SWITCH, 2.0)] + [(1, 0.01)] * 20 + [(MODE_SWITCH, 8.0)]
+        threading.Timer(0.05, lambda: setattr(abort, "value", 1)).start()
+        self.assertLess(s.step(intervals, abort=abort), 20)
+        # Mode the block started in is restored
+        self.assertEqual(s.get_mode(), 8)
+
+    def test_plan_arc_feed_limit(self):
+        start = {"X": 10.0, "Y": 10.0, "Z": 0.0}
+        block = plan_block(GCode(GCodeParser.parse_line("G02 X12 Y10 R1 F1200")), start)
+        # [v = sqrt(0.8 * 80 mm/s^2 * 1 mm) = 8 mm/s], halved for 200% override
+        self.assertAlmostEqual(block.feed_limit, 240.0)
+        report = simulator.simulate([block]).reports[0]
+        self.assertLessEqual(max(report.velocity.values()), 4.0 * 1.01)
+        # Y reverses at the top of the arc, its estimate is dominated by the step resolution
+        self.assertLessEqual(report.acceleration["X"] * 4.0, cfg.AXIS_ACCELERATION_X * 1.01)
+
+        block = plan_block(GCode(GCodeParser.parse_line("G02 X70 Y10 R30 F1200")), start)
+        self.assertIsNone(block.feed_limit)
+
+    def test_plan_parallel(self):
+        serial = list(BlockPlanner(1).plan(self.gcodes, self.coordinates))
+        parallel = list(BlockPlanner(2, window=3).plan(
+            self.gcodes, self.coordinates))
+        self.assertEqual(len(serial), len(parallel))
+        for a, b in zip(serial, parallel):
+            self.assertEqual(a.gcode, b.gcode)
+            self.assertEqual((a.start, a.end, a.plane), (b.start, b.end, b.plane))
+            self.assertEqual((a.ix, a.iy, a.iz), (b.ix, b.iy, b.iz))
+
+
+class TestController(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.coord_file = cfg.coord_file
+        cfg.coord_file = os.path.join(self.tmp.name, "coord.json")
+        with open(cfg.coord_file, "w") as outf:
+            json.dump({"X": 0.0, "Y": 0.0, "Z": 0.0}, outf)
+        self.files = []
+        for n, text in enumerate(("G00 X10 Y20\nG01 X20 Y10 F600\n",
+                                  "G00 X30\nG28\n")):
+            filename = os.path.join(self.tmp.name, "job{}.nc".format(n))
+            with open(filename, "w") as outf:
+                outf.write(text)
+            self.files.append(filename)
+
+    def tearDown(self):
+        cfg.coord_file = self.coord_file
+        self.tmp.cleanup()
+
+    def test_jobs(self):
+        socket_path = os.path.join(self.tmp.name, "controller.sock")
+        controller = Controller(True, socket_path)
+
+        async def request(reader, writer, **kwargs):
+            writer.write(json.dumps(kwargs).encode() + b"\n")
+            return json.loads(await reader.readline())
+
+        async def client():
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            responses = [await request(reader, writer, cmd="submit", file=f)
+                         for f in self.files]
+            responses.append(await request(reader, writer, cmd="submit", file="missing.nc"))
+            # Valid JSON that is not a request object
+            for line in (b"[]\n", b'"x"\n'):
+                writer.write(line)
+                responses.append(json.loads(await reader.readline()))
+            while True:
+                status = await request(reader, writer, cmd="status")
+                if all(job["status"] == "done" for job in status["jobs"]):
+                    break
+                await asyncio.sleep(0.01)
+            responses.append(await request(reader, writer, cmd="clear_fault"))
+            await request(reader, writer, cmd="shutdown")
+            writer.close()
+            return responses, status
+
+        async def run():
+            results = await asyncio.gather(controller.serve(), client())
+            return results[1]
+
+        responses, status = asyncio.run(run())
+        self.assertEqual([r["ok"] for r in responses], [True, True, False, False, False, True])
+        self.assertEqual(responses[-2]["error"], "Request is not a JSON object")
+        self.assertEqual([job["blocks_done"] for job in status["jobs"]], [2, 2])
+        self.assertEqual(status["coordinates"], {"X": 0.0, "Y": 0.0, "Z": 0.0})
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_out_of_bounds(self):
+        socket_path = os.path.join(self.tmp.name, "controller.sock")
+        controller = Controller(True, socket_path)
+        filename = os.path.join(self.tmp.name, "bounds.nc")
+        with open(filename, "w") as outf:
+            outf.write("G00 X10\nG00 X-5\n")
+
+        async def client():
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            for f in (filename, self.files[0]):
+                writer.write(json.dumps({"cmd": "submit", "file": f}).encode() + b"\n")
+                await reader.readline()
+            while True:
+                writer.write(b'{"cmd": "status"}\n')
+                status = json.loads(await reader.readline())
+                if all(job["status"] in ("done", "failed") for job in status["jobs"]):
+                    break
+                await asyncio.sleep(0.01)
+            writer.write(b'{"cmd": "shutdown"}\n')
+            await reader.readline()
+            writer.close()
+            return status
+
+        async def run():
+            results = await asyncio.gather(controller.serve(), client())
+            return results[1]
+
+        status = asyncio.run(run())
+        # The job fails while queued, before any of its blocks runs
+        self.assertEqual([job["status"] for job in status["jobs"]], ["failed", "done"])
+        self.assertEqual(status["jobs"][0]["blocks_done"], 0)
+        self.assertIn("line 2 X-5.0", status["jobs"][0]["error"])
+
+
+class FakeMachine(object):
+    """Machine stand-in recording executed blocks."""
+
+    def __init__(self):
+        self.blocks = []
+
+    def get_coordinates(self):
+        return {"X": 0.0, "Y": 0.0, "Z": 0.0}
+
+    def get_plane(self):
+        return "XY"
+
+    def run_block(self, block):
+        self.blocks.append(block)
+
+
+class TestStreamServer(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ["% Start", "G00 X1 Y2", "G01 X2 Y1 F600",
+                      "G05", "G18"] + ["G00 Z{}".format(z % 10) for z in range(40)]
+
+    def _run(self, server_fd, host_fd, mode, close):
+        machine = FakeMachine()
+        server = StreamServer(server_fd, machine, rx_buffer_size=64, queue_size=2)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        responses, lps = stream(host_fd, self.lines, mode, rx_buffer_size=64)
+        close()
+        thread.join()
+        return server, machine, responses, lps
+
+    def _check(self, server, machine, responses, lps):
+        self.assertEqual(len(responses), len(self.lines))
+        self.assertEqual(responses[3], "error:Unsupported G-code")
+        self.assertEqual(responses.count("ok"), len(self.lines) - 1)
+        self.assertEqual((server.lines, server.errors), (len(self.lines) - 1, 1))
+        self.assertEqual(len(machine.blocks), len(self.lines) - 2)
+        self.assertEqual(machine.blocks[1].start, {"X": 1.0, "Y": 2.0, "Z": 0.0})
+        self.assertEqual(machine.blocks[-1].plane, "XZ")
+        self.assertGreater(lps, 0)
+        self.assertGreater(server.lines_per_second(), 0)
+
+    def test_socket_character_counting(self):
+        server_sock, host_sock = socket.socketpair()
+        result = self._run(server_sock.fileno(), host_sock.fileno(), "count",
+                           lambda: host_sock.shutdown(socket.SHUT_WR))
+        self._check(*result)
+        server_sock.close()
+        host_sock.close()
+
+    def test_pty_ok(self):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        result = self._run(slave, master, "ok", lambda: os.close(master))
+        self._check(*result)
+        os.close(slave)
+
+    def test_machine_error(self):
+        machine = FakeMachine()
+        machine.run_block = mock.Mock(side_effect=RuntimeError("fault"))
+        server_sock, host_sock = socket.socketpair()
+        server = StreamServer(server_sock.fileno(), machine, rx_buffer_size=64, queue_size=2)
+        host_sock.sendall("".join(line + "\n" for line in self.lines).encode())
+        # Stream stays open, the receiver and planner are stopped anyway
+        with self.assertRaises(RuntimeError):
+            server.run()
+        server_sock.close()
+        host_sock.close()
+
+    def test_planner_error(self):
+        server_sock, host_sock = socket.socketpair()
+        server = StreamServer(server_sock.fileno(), FakeMachine(), rx_buffer_size=64, queue_size=2)
+        host_sock.sendall(b"G00 X1 Y2\n")
+        with mock.patch("stream_server.plan_block", side_effect=ValueError("plan")):
+            with self.assertRaises(ValueError):
+                server.run()
+        server_sock.close()
+        host_sock.close()
+
+    def test_line_exceeds_buffer(self):
+        with self.assertRaises(ValueError):
+            stream(-1, ["% " + "x" * 200], rx_buffer_size=128)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_render(self):
+        counter = metrics.Counter("blocks_total", "Blocks", ("gcode",), self.registry)
+        gauge = metrics.Gauge("rate", "Rate", registry=self.registry)
+        histogram = metrics.Histogram("latency_seconds", "Latency",
+                                      registry=self.registry, buckets=(0.1, 1.0))
+        counter.inc(gcode="00")
+        counter.inc(2, gcode="01")
+        gauge.set(1.5)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP blocks_total Blocks",
+            "# TYPE blocks_total counter",
+            'blocks_total{gcode="00"} 1.0',
+            'blocks_total{gcode="01"} 2.0',
+            "# HELP rate Rate",
+            "# TYPE rate gauge",
+            "rate 1.5",
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{le="0.1"} 1.0',
+            'latency_seconds_bucket{le="1.0"} 2.0',
+            'latency_seconds_bucket{le="+Inf"} 3.0',
+            "latency_seconds_sum 5.55",
+            "latency_seconds_count 3.0",
+        ]) + "\n")
+
+    def test_shared_counter(self):
+        counter = metrics.SharedCounter("steps_total", "Steps", "axis", ("X", "Y"), self.registry)
+        p = Process(target=counter.inc, args=(5,), kwargs={"axis": "Y"})
+        p.start()
+        p.join()
+        counter.inc(axis="unknown")
+        self.assertEqual(counter.get(axis="Y"), 5.0)
+        self.assertEqual(counter.get(axis="X"), 0.0)
+
+    def test_serve(self):
+        metrics.Counter("served_total", "Served", registry=self.registry).inc()
+        port = self.registry.serve(0)
+        body = urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(port)).read()
+        self.registry.shutdown()
+        self.assertIn(b"served_total 1.0", body)
+
+    def test_instrumentation(self):
+        lines = metrics.LINES_PARSED.get()
+        errors = metrics.PARSE_ERRORS.get(error="UnsupportedGCodeError")
+        GCodeParser.parse_line("G00 X10")
+        with self.assertRaises(UnsupportedGCodeError):
+            GCodeParser.parse_line("G05")
+        self.assertEqual(metrics.LINES_PARSED.get(), lines + 1)
+        self.assertEqual(metrics.PARSE_ERRORS.get(error="UnsupportedGCodeError"), errors + 1)
+
+        steps = metrics.STEPS.get(axis="Y")
+        Stepper("Y", 8).step([(1, 0.0), (0, 0.0), (-1, 0.0)])
+        self.assertEqual(metrics.STEPS.get(axis="Y"), steps + 2)
+
+
+class TestFeedOverride(unittest.TestCase):
+
+    def setUp(self):
+        self.override = FeedOverride(
+            "test_feed_override_{}".format(os.getpid()), create=True)
+
+    def tearDown(self):
+        self.override.close()
+
+    def test_factor_ramp(self):
+        self.assertEqual(self.override.factor(), 1.0)
+        self.override.set(150)
+        start, target, t0 = self.override._read()
+        self.assertEqual(target, 1.5)
+        # Ramp of 100% per second
+        self.assertAlmostEqual(self.override.factor(t0), start)
+        self.assertAlmostEqual(self.override.factor(t0 + 0.25), start + 0.25)
+        self.assertEqual(self.override.factor(t0 + 1.0), 1.5)
+
+        self.override.set(50)
+        t0 = self.override._read()[2]
+        self.assertLess(self.override.factor(t0 + 0.5), 1.5)
+        self.assertEqual(self.override.factor(t0 + 2.0), 0.5)
+
+    def test_limits(self):
+        self.override.set(500)
+        self.assertEqual(self.override.get(), 200.0)
+        self.override.set(0)
+        self.assertEqual(self.override.get(), 10.0)
+
+    def test_attach(self):
+        other = FeedOverride(self.override._name)
+        other.set(120)
+        self.assertEqual(self.override.get(), 120.0)
+        other.close()
+
+    def test_stale_segment(self):
+        name = "test_stale_override_{}".format(os.getpid())
+        # Segment of a crashed run, never unlinked
+        SharedMemory(name, create=True, size=4).close()
+        override = FeedOverride(name, create=True, percent=80)
+        self.assertEqual(override.get(), 80.0)
+        # The segment of a running process is not taken over
+        with self.assertRaises(RuntimeError):
+            FeedOverride(name, create=True)
+        self.assertEqual(override.get(), 80.0)
+        override.close()
+        with self.assertRaises(FileNotFoundError):
+            SharedMemory(name)
+
+        # Segment created by a process that has exited
+        process = Process(target=time.sleep, args=(0,))
+        process.start()
+        process.join()
+        stale = SharedMemory(name, create=True, size=40)
+        struct.pack_into("<q", stale.buf, 32, process.pid)
+        stale.close()
+        override = FeedOverride(name, create=True, percent=50)
+        self.assertEqual(override.get(), 50.0)
+        override.close()
+
+    def test_step_override(self):
+        s = Stepper("X", 8)
+        interval = [(1, 0.001)] * 40
+        override = FeedOverride(
+            "test_step_override_{}".format(os.getpid()), create=True, percent=200)
+
+        t = time.time()
+        s.step(interval)
+        t_normal = time.time() - t
+        t = time.time()
+        s.step(interval, override)
+        t_override = time.time() - t
+        override.close()
+
+        self.assertLess(t_override, 0.75 * t_normal)
+
 
 class TestMotionPlanner(unittest.TestCase):
 
@@ -201,6 +775,22 @@ class TestMotionPlanner(unittest.TestCase):
             (1, 0.1)
         ]
         self.assertEqual(_overlay_ramp(20, ramp, 1), interval)
+
+    def test_overlay_ramp_end_velocity(self):
+        ramp = [0.1, 0.05, 0.01]
+        ramp_down = [0.05, 0.01]
+        interval = [
+            (-1, 0.1),
+            (-1, 0.05),
+            (-1, 0.01),
+            (-1, 0.01),
+            (-1, 0.01),
+            (-1, 0.05)
+        ]
+        self.assertEqual(_overlay_ramp(6, ramp, -1, ramp_down), interval)
+
+        interval = [(1, 0.1), (1, 0.05), (1, 0.05)]
+        self.assertEqual(_overlay_ramp(3, ramp, 1, ramp_down), interval)
         
     def test_move(self):
 
@@ -257,6 +847,84 @@ class TestMotionPlanner(unittest.TestCase):
         #z = [(-1, 0.02)] * 3
         self.assertEqual(_plan_move(-8, 4, -3, 200, 100, 50), (x, y, z))
 
+    def test_synchronize(self):
+        intervals = [(1, 0.1), (1, 0.2), (1, 0.3), (1, 0.4)]
+        i = [(-1, 0.3), (-1, 0.7)]
+        self.assertEqual(
+            [(sign, round(dt, 6)) for sign, dt in _synchronize(-2, intervals)], i)
+
+        i = [(1, 0.166667), (1, 0.333333), (1, 0.5)]
+        self.assertEqual(
+            [(sign, round(dt, 6)) for sign, dt in _synchronize(3, intervals)], i)
+
+        self.assertEqual(_synchronize(4, intervals), intervals)
+        self.assertEqual(_synchronize(0, intervals), [])
+
+    def test_arc_limits(self):
+        feed, accel = _arc_limits(("x", "y"), 10.0)
+        # Headroom for the max feed override of 200%
+        self.assertAlmostEqual(feed, math.sqrt(0.8 * 80.0 * 10.0) * 60.0 / 2.0)
+        self.assertAlmostEqual(accel, 0.6 * 80.0 / 4.0)
+        self.assertAlmostEqual(_arc_limits(("x", "z"), -10.0)[0], feed)
+
+    def test_ramp_path(self):
+        # 100 steps of 0.01 mm at 10 mm/s on a path of 1 mm
+        intervals = [[(1, 0.001)] * 100, [(-1, 0.002)] * 50]
+        ramped = _ramp_path(intervals, 10.0, 100.0)
+        self.assertEqual([len(i) for i in ramped], [100, 50])
+        self.assertEqual(ramped[1][0][0], -1)
+        # Ramps of 0.5 mm meet at 10 mm/s in the middle of the path
+        self.assertAlmostEqual(sum(dt for _, dt in ramped[0]), 0.2)
+        self.assertAlmostEqual(sum(dt for _, dt in ramped[1]), 0.2)
+        self.assertAlmostEqual(ramped[0][0][1], math.sqrt(2 * 0.01 / 100.0))
+        self.assertAlmostEqual(ramped[0][49][1], 0.001, places=4)
+        # Longer paths cruise at the planned velocity between the ramps
+        ramped = _ramp_path([[(1, 0.001)] * 1000], 10.0, 100.0)
+        self.assertAlmostEqual(sum(dt for _, dt in ramped[0]), 0.1 + 9.0 / 10.0 + 0.1)
+        self.assertAlmostEqual(ramped[0][500][1], 0.001)
+
+    def test_switch_mode(self):
+        intervals = [(-1, 0.001 * n) for n in range(1, 21)]
+        # Position 3 is 3 fine steps past a full step in negative direction
+        i = _switch_mode(intervals, 3, 4, 2)
+        self.assertEqual(i[:3], intervals[:3])
+        self.assertEqual(i[3], (MODE_SWITCH, 2.0))
+        self.assertEqual(i[-2], (MODE_SWITCH, 4.0))
+        self.assertEqual(i[-1], intervals[-1])
+        self.assertEqual(len(i), 3 + 1 + 8 + 1 + 1)
+        self.assertEqual([sign for sign, _ in i[4:12]], [-1] * 8)
+        self.assertAlmostEqual(i[4][1], 0.004 + 0.005)
+        self.assertAlmostEqual(sum(dt for sign, dt in i if sign != MODE_SWITCH),
+                               sum(dt for _, dt in intervals))
+
+        # Moves without a full step are not switched
+        self.assertEqual(_switch_mode(intervals[:5], 1, 8, 1), intervals[:5])
+        self.assertEqual(_switch_mode([], 0, 8, 1), [])
+        with self.assertRaises(ValueError):
+            _switch_mode(intervals, 0, 8, 3)
+
+    def test_coordinated_move(self):
+        ramp = [0.1, 0.05, 0.01]
+        ix, iy, iz = _plan_coordinated_move([8, -4, 0], ramp)
+        self.assertEqual(ix, _overlay_ramp(8, ramp, 1))
+        self.assertEqual([sign for sign, _ in iy], [-1] * 4)
+        self.assertAlmostEqual(sum(dt for _, dt in ix), sum(dt for _, dt in iy))
+        self.assertEqual(iz, [])
+
+        self.assertEqual(_plan_coordinated_move([0, 0, 0], ramp), [[], [], []])
+
+    def test_plan_coordinated_move(self):
+        mp = MotionPlanner()
+        ds = (("x", 30.0), ("y", -10.0), ("z", 0.0))
+        v = (("x", 2000.0), ("y", 500.0), ("z", 2000.0))
+        ix, iy, iz = mp.plan_coordinated_move(ds, v)
+        self.assertEqual((len(ix), len(iy), len(iz)), (9600, 3200, 0))
+        # All axes start and stop together
+        self.assertAlmostEqual(sum(dt for _, dt in ix), sum(dt for _, dt in iy))
+        # Y is the most constrained axis and limits peak velocity
+        self.assertAlmostEqual(min(dt for _, dt in iy), 60.0 / 500.0 / 320.0, places=5)
+        self.assertGreater(min(dt for _, dt in iy), 60.0 / 500.0 / 320.0)
+
     def test_interpolated_line(self):
         x = [(1, 0.005)] * 8
         y = [(1, 0.01)] * 4
@@ -283,6 +951,25 @@ class TestMotionPlanner(unittest.TestCase):
         self.assertEqual(_plan_interpolated_line(
             -1, 8, 100, 200), (x, y))
 
+    def test_plan_interpolated_line_ramped(self):
+        mp = MotionPlanner()
+        ix, iy = mp.plan_interpolated_line((("x", 60.0), ("y", -30.0)), 1200.0)
+        self.assertEqual((len(ix), len(iy)), (19200, 9600))
+        self.assertEqual(iy[0][0], -1)
+        self.assertAlmostEqual(sum(dt for _, dt in ix), sum(dt for _, dt in iy))
+        # Cruise at feed rate along the path, slow start and stop
+        cruise = 60.0 / (1200.0 * 60.0 / 67.08204) / 320.0
+        self.assertAlmostEqual(ix[len(ix) // 2][1], cruise, places=5)
+        self.assertGreater(ix[0][1], 5 * cruise)
+        self.assertGreater(ix[-1][1], 5 * cruise)
+        # Sped up by the max feed override of 200%, X stays within its acceleration
+        v = [2.0 / (320.0 * dt) for _, dt in ix]
+        accel = max(abs(b - a) * b * 320.0 / 2.0 for a, b in zip(v, v[1:]))
+        self.assertLessEqual(accel, cfg.AXIS_ACCELERATION_X * 1.01)
+        # Y steps on every second X step during ramps as well as cruise
+        self.assertAlmostEqual(iy[0][1], ix[0][1] + ix[1][1])
+        self.assertAlmostEqual(iy[-1][1], ix[-1][1] + ix[-2][1])
+
     def test_interpolated_arc_cw_full(self):
         x = [
             (1, 0.0451),
@@ -772,5 +1459,683 @@ class TestMotionPlanner(unittest.TestCase):
             (ix, iy), (x, y))
 
 
+
+class TestTracing(unittest.TestCase):
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span("parse"):
+            pass
+        tracer.add("plan", 0.0, 1.0)
+        self.assertEqual(tracer.events(), [])
+
+    def test_write(self):
+        tracer = Tracer()
+        tracer.start()
+        with tracer.span("parse", "parse", line=1):
+            pass
+        tracer.add("plan", 1.0, 0.5, "plan", pid=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            tracer.write(path)
+            with open(path) as inf:
+                events = json.load(inf)["traceEvents"]
+        self.assertEqual([e["name"] for e in events], ["parse", "plan"])
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"], {"line": 1})
+        self.assertEqual((events[1]["ts"], events[1]["dur"], events[1]["pid"]),
+                         (1e6, 0.5e6, 1))
+
+    def test_profile(self):
+        gcodes = [GCode({"G": "01", "X": "1", "Y": "1"}),
+                  GCode({"G": "01", "X": "2", "Y": "1"})]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "job.pstats")
+            planner = BlockPlanner(1, profile=(1, 2), profile_path=path)
+            blocks = list(planner.plan(gcodes, {"X": 0.0, "Y": 0.0, "Z": 0.0}))
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[1].planner, "plan_interpolated_line")
+
+
+
+class TestLogQueue(unittest.TestCase):
+
+    def test_listener(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "test.log")
+            listener = LogListener({
+                "version": 1,
+                "disable_existing_loggers": False,
+                "formatters": {"simple": {"format": "%(levelname)s %(message)s"}},
+                "handlers": {"file": {"class": "logging.FileHandler",
+                                      "formatter": "simple", "filename": path}},
+                "loggers": {"test_log_queue": {"level": "INFO", "handlers": ["file"]}},
+            })
+            logger = logging.getLogger("test_log_queue")
+            logger.info("Executing '%s'", GCode({"G": "01", "X": "1"}))
+            logger.debug("Dropped %d", 1)
+            logger.warning("Limit %d of %.1f", 2, 3.0)
+            listener.stop()
+            with open(path) as inf:
+                lines = inf.read().splitlines()
+            self.assertEqual(logger.handlers, [])
+        self.assertEqual(lines, ["INFO Executing '{}'".format(GCode({"G": "01", "X": "1"})),
+                                 "WARNING Limit 2 of 3.0"])
+
+    def test_config_loggers(self):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging.json")) as inf:
+            config = json.load(inf)
+        names = ["main", "MotionPlanner"] + [name for name in cfg.steppers if name != "default"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "test.log")
+            config["handlers"] = {"file": {"class": "logging.FileHandler",
+                                           "formatter": "simple", "filename": path}}
+            for logger_cfg in config["loggers"].values():
+                logger_cfg["handlers"] = ["file"]
+            listener = LogListener(config)
+            for name in names:
+                logging.getLogger(name).warning("Logged by %s", name)
+            listener.stop()
+            with open(path) as inf:
+                lines = inf.read().splitlines()
+        self.assertEqual(lines, ["WARNING Logged by {}".format(name) for name in names])
+
+
+
+class TestOptimizer(unittest.TestCase):
+
+    def setUp(self):
+        self.coordinates = {"X": 0.0, "Y": 0.0, "Z": 10.0}
+        self.gcodes = [GCode({"G": "00", "X": "0", "Y": "0", "Z": "10"})]
+        for x, y in ((300, 0), (10, 0), (300, 10), (10, 10)):
+            self.gcodes += [GCode({"G": "00", "X": str(x)}),
+                            GCode({"G": "00", "Y": str(y)}),
+                            GCode({"G": "01", "Z": "5"}),
+                            GCode({"G": "01", "X": str(x + 5)}),
+                            GCode({"G": "00", "Z": "10"})]
+        self.gcodes += [GCode({"G": "00", "Y": "50"}), GCode({"G": "28"})]
+
+    def _plunges(self, gcodes):
+        return sorted((start["X"], start["Y"])
+                      for gcode, start, _ in resolve_blocks(gcodes, self.coordinates)
+                      if gcode.get("Z") == 5.0)
+
+    def test_travel_time(self):
+        v = (("x", cfg.AXIS_TRAVERSAL_MM_PER_MIN_X), ("y", cfg.AXIS_TRAVERSAL_MM_PER_MIN_Y),
+             ("z", cfg.AXIS_TRAVERSAL_MM_PER_MIN_Z))
+        rapid_mode = cfg.RAPID_MODE
+        try:
+            for mode in ("coordinated", "independent"):
+                cfg.RAPID_MODE = mode
+                travel = optimizer.RapidTravel()
+                planner = _rapid_planner()
+                for dx, dy in ((0.1, 0), (5, 0), (100, 0), (30, -40), (200, 3)):
+                    intervals = planner((("x", dx), ("y", dy), ("z", 0.0)), v)
+                    self.assertAlmostEqual(travel.time((0, 0), (dx, dy)),
+                                           max(sum(dt for _, dt in i) for i in intervals))
+        finally:
+            cfg.RAPID_MODE = rapid_mode
+        # Ramps to the traversal speed of 2000 mm/min
+        self.assertGreater(travel.time((0, 0), (100, 0)), 3.0)
+
+    def test_optimize(self):
+        gcodes, before, after = optimizer.optimize(self.gcodes, self.coordinates)
+        self.assertLess(after, before)
+        self.assertEqual(self._plunges(gcodes), self._plunges(self.gcodes))
+        self.assertEqual(resolve_end(gcodes, self.coordinates),
+                         resolve_end(self.gcodes, self.coordinates))
+        self.assertEqual(gcodes[1], GCode({"G": "00", "X": "10.0", "Y": "0.0"}))
+        self.assertEqual(gcodes[-1], GCode({"G": "28"}))
+
+    def test_barrier(self):
+        gcodes = self.gcodes[:11] + [GCode({"G": "18"})] + self.gcodes[11:]
+        optimized, _, _ = optimizer.optimize(gcodes, self.coordinates)
+        # Operations are not moved across the plane selection
+        index = optimized.index(GCode({"G": "18"}))
+        self.assertEqual(self._plunges(optimized[:index]), self._plunges(gcodes[:11]))
+
+    def test_order_operations(self):
+        travel = optimizer.RapidTravel()
+        points = [(0.0, 0.0), (12.5, 3.0), (300.0, 7.5)]
+        table = travel.table(points)
+        self.assertEqual(table[points[1], points[2]], travel.time(points[1], points[2]))
+
+        # Holes on a grid visited row by row in alternating direction
+        operations = [optimizer.Operation([], (x * 10.0, y * 10.0), (x * 10.0, y * 10.0))
+                      for y in range(10) for x in (range(10) if y % 2 else range(9, -1, -1))]
+        order = optimizer.order_operations(operations, (0.0, 0.0), (0.0, 0.0), travel)
+        self.assertEqual(sorted(order), list(range(100)))
+        times = travel.table([(0.0, 0.0)] + [op.entry for op in operations])
+        self.assertLess(optimizer._path_time(times, (0.0, 0.0), order, operations, (0.0, 0.0)),
+                        optimizer._path_time(times, (0.0, 0.0), list(range(100)), operations,
+                                             (0.0, 0.0)))
+
+        budget = cfg.OPTIMIZER_TIME_BUDGET
+        cfg.OPTIMIZER_TIME_BUDGET = 0.05
+        try:
+            operations = [optimizer.Operation([], (x * 1.5, y * 2.5), (x * 1.5, y * 2.5))
+                          for x in range(30) for y in range(20)]
+            t = time.time()
+            order = optimizer.order_operations(operations, (0.0, 0.0), (0.0, 0.0), travel)
+            self.assertLess(time.time() - t, 3.0)
+        finally:
+            cfg.OPTIMIZER_TIME_BUDGET = budget
+        self.assertEqual(sorted(order), list(range(600)))
+
+
+    def test_coalesce(self):
+        coordinates = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+        gcodes = [GCode({"G": "00", "Z": "0"}),
+                  GCode({"G": "01", "X": "10", "Y": "10"}),
+                  GCode({"G": "01", "X": "20", "Y": "20.001"}),
+                  GCode({"G": "01", "X": "30", "Y": "30"}),
+                  GCode({"G": "01", "X": "40", "Y": "30"}),
+                  GCode({"G": "01", "X": "50", "Y": "30", "F": "600"}),
+                  GCode({"G": "01", "X": "40", "Y": "30", "F": "600"}),
+                  GCode({"G": "00", "X": "40.001"})]
+        coalesced, eliminated = optimizer.coalesce(gcodes, coordinates)
+        self.assertEqual(eliminated, 4)
+        self.assertEqual(coalesced, [gcodes[3], gcodes[4], gcodes[5], gcodes[6]])
+        coalesced, eliminated = optimizer.coalesce(gcodes[1:4], coordinates, tolerance=0.0001)
+        self.assertEqual(eliminated, 0)
+
+
+
+def _consume(name, result):
+    schedule = ScheduleBuffer(name, create=False, capacity=64)
+    start = schedule.read_start()
+    result.put((start, list(schedule.read_block()), schedule.read_start()))
+    schedule.close()
+
+
+class TestScheduleBuffer(unittest.TestCase):
+
+    def test_wrap_around(self):
+        schedule = ScheduleBuffer(capacity=8, chunk=4)
+        try:
+            records = [(1, 0.5), (-1, 0.25), (0, 0.125)]
+            for _ in range(5):
+                self.assertEqual(schedule.write(records), 3)
+                schedule.write_marker(schedule_buffer.BLOCK_END)
+                self.assertEqual(list(schedule.read_block()), records)
+                self.assertEqual(schedule.pending(), 0)
+            # Writes stop when the buffer is full
+            self.assertEqual(schedule.write(records * 4), 8)
+            self.assertEqual(schedule.write(records), 0)
+        finally:
+            schedule.close()
+
+    def test_consumer_process(self):
+        schedule = ScheduleBuffer(capacity=64)
+        result = multiprocessing.Queue()
+        consumer = Process(target=_consume, args=(schedule.name, result))
+        consumer.start()
+        records = [(1 if n % 3 else -1, n * 1e-6) for n in range(1000)]
+        schedule.write_marker(schedule_buffer.FEED_START, 12.5)
+        offset = 0
+        while offset < len(records):
+            offset += schedule.write(records, offset)
+        schedule.write_marker(schedule_buffer.BLOCK_END)
+        schedule.write_marker(schedule_buffer.STOP)
+        start, read, stop = result.get(timeout=10)
+        consumer.join()
+        schedule.close()
+        self.assertEqual(start, (schedule_buffer.FEED_START, 12.5))
+        self.assertEqual(read, records)
+        self.assertIsNone(stop)
+
+    def test_machine(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            coord_file = cfg.coord_file
+            cfg.coord_file = os.path.join(tmp, "coord.json")
+            with open(cfg.coord_file, "w") as outf:
+                json.dump({"X": 0.0, "Y": 0.0, "Z": 0.0}, outf)
+            steps = metrics.STEPS.get(axis="X")
+            machine = Machine(Stepper("X", 8), Stepper("Y", 8), Stepper("Z", 8), False)
+            try:
+                block = Block(GCode({"G": "00", "X": "1"}), machine.get_coordinates(), "XY")
+                block.end = {"X": 1.0, "Y": 0.0, "Z": 0.0}
+                block.ix = [(1, 1e-6)] * 500
+                machine.run_block(block)
+                machine.run_block(block)
+            finally:
+                machine.close()
+                cfg.coord_file = coord_file
+        self.assertEqual(metrics.STEPS.get(axis="X") - steps, 1000)
+
+
+
+def _enter_realtime(cores, result):
+    applied = realtime.enter(cores, lock=False)
+    result.put((applied, gc.isenabled()))
+
+
+class TestRealtime(unittest.TestCase):
+
+    def test_fallback(self):
+        # Cores which are not available are neither pinned nor get SCHED_FIFO
+        result = multiprocessing.Queue()
+        p = Process(target=_enter_realtime, args=([max(os.sched_getaffinity(0)) + 1], result))
+        p.start()
+        applied, gc_enabled = result.get(timeout=10)
+        p.join()
+        self.assertEqual(applied, {"pin": False, "fifo": False, "mlock": False, "gc": True})
+        self.assertFalse(gc_enabled)
+
+    def test_pretouch(self):
+        buf = memoryview(bytearray(b"abc" * 5000))
+        realtime.pretouch(buf, write=True, page_size=7)
+        realtime.pretouch(buf)
+        self.assertEqual(bytes(buf), b"abc" * 5000)
+
+    def test_jitter(self):
+        mean, p99, peak = realtime.measure_jitter(0.0001, 100)
+        self.assertTrue(0.0 <= p99 <= peak)
+        self.assertTrue(0.0 <= mean <= peak)
+
+
+
+class TestDRV8711(unittest.TestCase):
+
+    def setUp(self):
+        self.drv = DRV8711.DRV8711()
+        self.device = self.drv.device
+
+    def tearDown(self):
+        self.drv.close()
+
+    def test_frames(self):
+        self.drv.set("TORQUE", 0x80)
+        self.drv.flush()
+        self.assertEqual(self.device.registers[1], 0x180)
+        self.device.registers[0] = 0x123
+        self.assertEqual(self.drv.get_control(refresh=True), 0x123)
+        self.assertEqual(self.drv.get("MODE"), 0x4)
+
+    def test_configure(self):
+        settings = cfg.drivers["DRV8711"]["registers"]
+        # Each configured register is written with one frame
+        self.assertEqual(self.drv.configure(settings), 7)
+        self.assertEqual(self.device.transfers, 7)
+        self.assertEqual(self.device.registers[4], 5 << 8 | 0x10)
+        # Unchanged settings are not written again
+        self.assertEqual(self.drv.configure(settings), 0)
+        self.drv.set_mode(32)
+        self.assertEqual(self.device.transfers, 8)
+        self.assertEqual(self.device.registers[0] >> 3 & 0xF, 5)
+        with self.assertRaises(ValueError):
+            self.drv.set("MODE", 16)
+
+    def test_shadow(self):
+        self.drv.refresh()
+        transfers = self.device.transfers
+        for name in DRV8711.REGISTERS:
+            self.drv.read_register(name)
+        self.assertEqual(self.device.transfers, transfers)
+        self.device.inject(0x40)
+        self.assertFalse(self.drv.get_status(refresh=False)["STD"])
+        self.assertTrue(self.drv.get_status()["STD"])
+        self.drv.clear_status()
+        self.assertFalse(any(self.drv.get_status().values()))
+
+
+
+class TestFaultMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.device = DRV8711.DRV8711()
+        self.abort = multiprocessing.RawValue("b", 0)
+        self.monitor = FaultMonitor({"X": self.device}, self.abort, rate=1000.0)
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.device.close()
+
+    def test_poll(self):
+        self.assertIsNone(self.monitor.poll())
+        self.device.device.inject(0x01)
+        fault = self.monitor.poll()
+        self.assertIsInstance(fault, DriverFault)
+        self.assertEqual(fault.axis, "X")
+        self.assertTrue(fault.status["OTS"])
+        self.assertEqual(self.abort.value, 1)
+        self.assertIsNone(self.monitor.clear())
+        self.assertEqual(self.abort.value, 0)
+        self.assertIsNone(self.monitor.fault)
+
+        # A fault that persists is reported again by the STATUS read back
+        self.device.device.inject(0x01)
+        self.monitor.poll()
+        with mock.patch.object(self.device, "clear_status"):
+            fault = self.monitor.clear()
+        self.assertIsInstance(fault, DriverFault)
+        self.assertIs(self.monitor.fault, fault)
+        self.assertEqual(self.abort.value, 1)
+
+    def test_stop_latency(self):
+        stepper = Stepper("X", 8)
+        dt = 0.0001
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            stepper.step([(1, dt)] * 100000, abort=self.abort)))
+        self.monitor.start()
+        thread.start()
+        time.sleep(0.05)
+        injected = time.time()
+        self.device.device.inject(0x40)
+        thread.join()
+        stopped = time.time()
+        self.assertLess(self.monitor.detected - injected, 0.05)
+        self.assertLess(stopped - injected, 0.1)
+        # Each step takes dt, so at most 0.1 s / 0.1 ms steps after injection
+        self.assertLess(result[0], (0.05 + 0.1) / dt)
+
+
+class TestKinematics(unittest.TestCase):
+
+    def test_axes(self):
+        x = kinematics.axis("x")
+        self.assertIs(x, kinematics.AXES["X"])
+        self.assertEqual(x.steps_per_mm, 320.0)
+        self.assertEqual(x.limits, cfg.AXIS_LIMITS_X)
+        self.assertEqual(x.mm_to_steps(10.0), _mm_to_steps(
+            10.0, cfg.STEPPER_STEP_ANGLE_X, cfg.STEPPER_MODE_X, cfg.AXIS_LEAD_X))
+        self.assertEqual(x.mm_per_min_to_pps(600.0), _mm_per_min_to_pps(
+            600.0, cfg.STEPPER_STEP_ANGLE_X, cfg.STEPPER_MODE_X, cfg.AXIS_LEAD_X))
+        self.assertTrue(kinematics.axis("z").inverted)
+
+    def test_arrays(self):
+        x = kinematics.axis("x")
+        values = [0.0, 0.0125, -2.5, 799.99]
+        self.assertEqual(list(x.mm_to_steps(values)), [x.mm_to_steps(v) for v in values])
+        self.assertEqual(list(x.in_limits([-0.1, 0.0, 800.0, 800.1])),
+                         [False, True, True, False])
+        self.assertAlmostEqual(list(x.steps_to_mm(x.mm_to_steps(values)))[2], -2.5)
+
+    def test_rotary_axis(self):
+        params = {"STEPPER_STEP_ANGLE_A": 1.8, "STEPPER_MODE_A": 16, "AXIS_LEAD_A": 360.0,
+                  "AXIS_TRAVERSAL_MM_PER_MIN_A": 3600.0, "AXIS_FEED_MM_PER_MIN_A": 1800.0,
+                  "AXIS_ACCELERATION_A": 720.0, "AXIS_JERK_A": 7200.0,
+                  "AXIS_RAMP_TYPE_A": "trapezoidal", "AXIS_LIMITS_A": (-360.0, 360.0),
+                  "AXIS_POLARITY_A": False}
+        for name, value in params.items():
+            setattr(cfg, name, value)
+        try:
+            a = kinematics.Axis.from_config("A")
+        finally:
+            for name in params:
+                delattr(cfg, name)
+        # 3200 steps per revolution of 360 degrees
+        self.assertEqual(a.mm_to_steps(90.0), 800)
+        self.assertAlmostEqual(a.max_pps, 60.0 * 3200 / 360)
+
+    def test_ramp_cache(self):
+        ramp = _configure_ramp_ax("x", 5000.0)
+        self.assertIs(_configure_ramp_ax("x", 5000.0), ramp)
+        self.assertIsNot(_configure_ramp_ax("x", 5000.0, accel=40.0), ramp)
+        x = kinematics.axis("x")
+        for n in range(kinematics.RAMP_CACHE_SIZE + 1):
+            x.cache_ramp(n, [])
+        self.assertLessEqual(len(x.ramps), kinematics.RAMP_CACHE_SIZE)
+
+
+class TestProgram(unittest.TestCase):
+
+    def setUp(self):
+        lines = ["G00 X10 Y20", "G01 X20 Z10 F600", "G18", "M03",
+                 "G02 X30 Z20 R10", "G28", "G00 Y1.5"]
+        self.gcodes = [GCode(GCodeParser.parse_line(line)) for line in lines]
+        self.start = {"X": 5.0, "Y": 0.0, "Z": 0.0}
+        self.program = Program.from_gcodes(self.gcodes)
+
+    def test_gcodes(self):
+        self.assertEqual(len(self.program), 7)
+        self.assertEqual(self.program.rows["g"][3], -1)
+        self.assertEqual(self.program.rows["m"][3], 3)
+        for a, b in zip(self.gcodes, self.program.gcodes()):
+            self.assertEqual(a.keys(), b.keys())
+            for key in a.keys():
+                self.assertEqual(a.get(key), b.get(key))
+
+    def test_positions(self):
+        positions = self.program.positions(self.start)
+        self.assertEqual(list(positions["X"]), [10.0, 20.0, 20.0, 20.0, 30.0, 0.0, 0.0])
+        self.assertEqual(list(positions["Y"]), [20.0, 20.0, 20.0, 20.0, 20.0, 0.0, 1.5])
+        deltas = self.program.deltas(self.start)
+        self.assertEqual(list(deltas["X"]), [5.0, 10.0, 0.0, 0.0, 10.0, -30.0, 0.0])
+        steps = self.program.steps(self.start)
+        self.assertEqual(list(steps["Z"]), [0, 3200, 0, 0, 3200, -6400, 0])
+
+        blocks = list(resolve_blocks(self.gcodes, self.start))
+        for n, (_, start, _) in enumerate(blocks[1:]):
+            self.assertEqual(start, {key: positions[key][n] for key in start})
+
+    def test_violations(self):
+        gcodes = [GCode(GCodeParser.parse_line(line, check_limits=False))
+                  for line in ("G00 X10", "G01 X-1 Y5", "G00 Z120", "G28")]
+        p = Program.from_gcodes(gcodes, lines=[3, 5, 8, 9])
+        self.assertEqual(p.violations(self.start), [(5, "X", -1.0), (8, "Z", 120.0)])
+        with self.assertRaises(GCodeOutOfBoundsError):
+            p.validate(self.start)
+        self.program.validate(self.start)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "part.nc")
+            with open(path, "w") as outf:
+                outf.write("%\nG00 X10 Y20\nG01 X20 Z10 F600\n")
+            parsed = Program.load(path)
+            self.assertTrue(os.path.exists(path + ".cache"))
+            cached = Program.load(path)
+            self.assertFalse(cached.rows.flags.writeable)
+            self.assertEqual(cached.rows.tobytes(), parsed.rows.tobytes())
+            self.assertEqual(list(cached.rows["line"]), [2, 3])
+
+            # Changed sources and corrupt caches are parsed again
+            with open(path, "a") as outf:
+                outf.write("G28\n")
+            self.assertEqual(len(Program.load(path)), 3)
+            self.assertFalse(Program.load(path).rows.flags.writeable)
+            with open(path + ".cache", "r+b") as outf:
+                outf.truncate(program.CACHE_HEADER.size + 10)
+            self.assertEqual(len(Program.load(path)), 3)
+            self.assertEqual(len(Program.load(path, cache=False)), 3)
+
+    def test_validate_large(self):
+        n = 1000000
+        rows = np.zeros(n, dtype=program.DTYPE)
+        rows["line"] = np.arange(1, n + 1)
+        rows["g"] = 1
+        rows["present"] = program.FLAGS["X"] | program.FLAGS["Y"]
+        rows["X"] = np.arange(n) % 700
+        rows["Y"] = np.arange(n) % 500
+        rows["X"][n - 10] = 900.0
+        p = Program(rows)
+        t = time.time()
+        self.assertEqual(p.violations(self.start), [(n - 9, "X", 900.0)])
+        p.steps(self.start)
+        self.assertLess(time.time() - t, 1.0)
+
+
+class TestSimulator(unittest.TestCase):
+
+    def test_trace_axis(self):
+        intervals = [(1, 0.1), (MODE_SWITCH, 2.0), (1, 0.2), (0, 0.1), (-1, 0.1),
+                     (MODE_SWITCH, 8.0), (-1, 0.1)]
+        trace = simulator.trace_axis("x", intervals, 1.0)
+        step = 1 / 320.0
+        # Steps are taken at the start of their interval
+        self.assertEqual([round(t, 6) for t in trace.times], [0.0, 0.0, 0.1, 0.4, 0.5])
+        self.assertAlmostEqual(trace.end, 0.6)
+        self.assertEqual([round(p, 6) for p in trace.positions],
+                         [round(p, 6) for p in (1.0, 1.0 + step, 1.0 + 5 * step,
+                                                1.0 + step, 1.0)])
+
+    def test_simulate(self):
+        lines = ["G00 X10 Y20", "G01 X20 Y25 F600", "G02 X30 Y35 R10 F600"]
+        gcodes = [GCode(GCodeParser.parse_line(line)) for line in lines]
+        blocks = list(BlockPlanner(1).plan(gcodes, {"X": 0.0, "Y": 0.0, "Z": 0.0}))
+        simulation = simulator.simulate(blocks)
+        rapid, line, arc = simulation.reports
+
+        self.assertAlmostEqual(simulation.duration, sum(r.duration for r in simulation.reports))
+        self.assertAlmostEqual(line.duration, sum(dt for _, dt in blocks[1].ix))
+        # Steps stay within a step of the programmed path
+        self.assertLess(line.deviation, 2 / 320.0)
+        self.assertLess(arc.deviation, 2 / 320.0)
+        # Last steps of the axes start their last intervals
+        self.assertAlmostEqual(line.desync, blocks[1].iy[-1][1] - blocks[1].ix[-1][1])
+        self.assertLessEqual(line.velocity["X"], 600 / 60.0 * 1.01)
+
+        summary = simulation.summary()
+        self.assertEqual(summary["blocks"], 3)
+        self.assertEqual(summary["velocity"]["X"], max(r.velocity["X"] for r in simulation.reports))
+
+        times, positions = simulation.traces()
+        self.assertEqual(list(positions[-1]), [30.0, 35.0, 0.0])
+        self.assertAlmostEqual(times[-1], simulation.duration - blocks[2].ix[-1][1])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.npz")
+            simulation.export(path)
+            self.assertEqual(len(np.load(path)["t"]), len(times))
+
+
+class TestCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.coordinates = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+        jobs = {"a.nc": "G00 X10 Y20\nG01 X20 Z10 F600\nG01 X30 Z20 F600\n",
+                "b.nc": "G00 X10\nG00 Z-5\n",
+                "c.nc": "G01 X10\n"}
+        for name, text in jobs.items():
+            with open(os.path.join(self.tmp.name, name), "w") as outf:
+                outf.write(text)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_compile_directory(self):
+        output = os.path.join(self.tmp.name, "compiled")
+        results = compiler.compile_directory(self.tmp.name, output, self.coordinates, processes=2)
+        self.assertEqual([os.path.basename(r["file"]) for r in results], ["a.nc", "b.nc", "c.nc"])
+        a, b, c = results
+        self.assertIsNone(a["error"])
+        self.assertEqual(a["blocks"], 2)
+        self.assertGreater(a["duration"], 0)
+        self.assertIn("out of bounds", b["error"])
+        self.assertIsNone(b["artifact"])
+        self.assertIn("Either XY, XZ, YZ allowed", c["error"])
+        with open(os.path.join(output, compiler.SUMMARY_FILE)) as inf:
+            self.assertEqual(json.load(inf)["files"], results)
+
+        gcodes = [GCode(GCodeParser.parse_line(line))
+                  for line in ("G00 X10 Y20", "G01 X30 Z20 F600")]
+        planned = list(BlockPlanner(1).plan(gcodes, self.coordinates))
+        loaded = list(compiler.load_artifact(a["artifact"], self.coordinates))
+        for p, l in zip(planned, loaded):
+            for key in ("G", "X", "Y", "Z", "F"):
+                self.assertEqual(p.gcode.get(key), l.gcode.get(key))
+            self.assertEqual((p.start, p.end, p.plane), (l.start, l.end, l.plane))
+            self.assertEqual((p.ix, p.iy, p.iz), (l.ix, l.iy, l.iz))
+
+        # Blocks depending on a different start are re-planned
+        start = {"X": 5.0, "Y": 0.0, "Z": 2.0}
+        loaded = list(compiler.load_artifact(a["artifact"], start))
+        self.assertEqual(len(loaded[0].ix), 5 * 320)
+        self.assertEqual(loaded[0].start, start)
+        self.assertEqual(len(loaded[1].iz), 18 * 320)
+
+    def test_load_artifact_limits(self):
+        result = compiler.compile_file(os.path.join(self.tmp.name, "a.nc"), self.tmp.name,
+                                       self.coordinates)
+        fingerprint = compiler.config_fingerprint()
+        limits = cfg.AXIS_LIMITS_X
+        cfg.AXIS_LIMITS_X = kinematics.AXES["X"].limits = (0.0, 25.0)
+        try:
+            self.assertNotEqual(compiler.config_fingerprint(), fingerprint)
+            # Checked before any block is returned
+            with self.assertRaises(GCodeOutOfBoundsError):
+                compiler.load_artifact(result["artifact"], self.coordinates)
+        finally:
+            cfg.AXIS_LIMITS_X = kinematics.AXES["X"].limits = limits
+
+
+class TestCruise(unittest.TestCase):
+
+    def setUp(self):
+        # As in real-time executors, a collection would delay the end of a segment
+        gc.collect()
+        gc.disable()
+
+    def tearDown(self):
+        gc.enable()
+
+    def test_cruise_segments(self):
+        intervals = [(1, 0.3), (1, 0.2)] + [(1, 0.1)] * 5 + [(1, 0.2), (-1, 0.1), (-1, 0.1)]
+        self.assertEqual(_cruise_segments(intervals, 3),
+                         [(1, 0.3), (1, 0.2), (CRUISE, 5.0), (1, 0.1), (1, 0.2),
+                          (-1, 0.1), (-1, 0.1)])
+        self.assertEqual(_cruise_segments(intervals, 6), intervals)
+        self.assertEqual(_cruise_segments([(0, 0.1)] * 5, 3), [(0, 0.1)] * 5)
+
+    def test_step_cruise(self):
+        s = Stepper("X", 8)
+        ramp = [(-1, 0.001), (-1, 0.0005)]
+        intervals = _cruise_segments(ramp + [(-1, 0.00025)] * 400 + ramp[::-1], 100)
+        self.assertEqual(len(intervals), 6)
+        gpio_sim.reset()
+        t = time.time()
+        self.assertEqual(s.step(intervals), 404)
+        elapsed = time.time() - t
+        self.assertEqual(len(gpio_sim.rising_edges(cfg.steppers["X"]["gpios"]["step"])), 404)
+        self.assertEqual(s.get_direction(), "CCW")
+        # 400 steps of 0.25 ms and the ramps
+        self.assertGreater(elapsed, 0.1 + 0.003)
+        self.assertLess(elapsed, 0.15)
+
+    def test_cruise_abort(self):
+        s = Stepper("X", 8)
+        abort = multiprocessing.RawValue("b", 0)
+        threading.Timer(0.05, lambda: setattr(abort, "value", 1)).start()
+        t = time.time()
+        steps = s.step(_cruise_segments([(1, 0.0005)] * 1000, 100), abort=abort)
+        self.assertLess(time.time() - t, 0.1)
+        self.assertTrue(90 <= steps <= 110)
+
+    def test_cruise_sleep_latency(self):
+        s = Stepper("X", 8)
+        sleep = time.sleep
+        pin = cfg.steppers["X"]["gpios"]["step"]
+        for latency in (0.01, 0.015):
+            gpio_sim.reset()
+            with mock.patch("time.sleep", lambda t: sleep(t + latency)):
+                steps = s.step(_cruise_segments([(1, 0.0002)] * 1003, 100))
+            # Oversleeping would run 50 steps too far
+            self.assertEqual(steps, 1003)
+            self.assertEqual(len(gpio_sim.rising_edges(pin)), 1003)
+
+    def test_execute_miscount(self):
+        class LossyStepper(object):
+            def step(self, records, override, abort):
+                # Loses one step of the segment
+                return sum(int(dt) if i == CRUISE else 0 for i, dt in records) - 1
+
+        schedule = ScheduleBuffer(capacity=64)
+        abort = multiprocessing.RawValue("b", 0)
+        miscount = multiprocessing.RawValue("b", 0)
+        try:
+            schedule.write_marker(schedule_buffer.BLOCK_START, time.time())
+            schedule.write(_cruise_segments([(1, 0.001)] * 300, 100))
+            schedule.write_marker(schedule_buffer.BLOCK_END)
+            schedule.write_marker(schedule_buffer.STOP)
+            _execute(LossyStepper(), schedule, None, abort=abort, miscount=miscount)
+        finally:
+            schedule.close()
+        self.assertEqual(abort.value, 1)
+        self.assertEqual(miscount.value, 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,113 @@
 #!/usr/bin/env python
 
+import json
+import logging
+import logging.config
+import os
+import socket
+import tempfile
+import threading
+import time
 import timeit
 
+from block_planner import BlockPlanner
+from gcode_parser import GCodeParser
+import log_queue
+from stepper import Stepper
+from stream_server import StreamServer
+from stream_server import stream
+
+
+class _NullMachine(object):
+    """Machine stand-in discarding planned blocks."""
+
+    def get_coordinates(self):
+        return {"X": 0.0, "Y": 0.0, "Z": 0.0}
+
+    def get_plane(self):
+        return "XY"
+
+    def run_block(self, block):
+        pass
+
+
+def planner_throughput(gcode_file, processes):
+    """Measures blocks planned per second with number of processes."""
+    gcodes = GCodeParser.read_lines(gcode_file)
+    coordinates = {"X": 0.0, "Y": 0.0, "Z": 0.0}
+    t = time.time()
+    n = sum(1 for _ in BlockPlanner(processes).plan(gcodes, coordinates))
+    return n / (time.time() - t)
+
+
+def stream_throughput(gcode_file, mode):
+    """Measures lines per second ingested by stream server over a loopback socket."""
+    with open(gcode_file) as inf:
+        lines = [line for line in inf if line.strip()]
+    server_sock, host_sock = socket.socketpair()
+    server = StreamServer(server_sock.fileno(), _NullMachine())
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    _, lines_per_second = stream(host_sock.fileno(), lines, mode)
+    host_sock.shutdown(socket.SHUT_WR)
+    thread.join()
+    server_sock.close()
+    host_sock.close()
+    return lines_per_second
+
+
+def _logging_config(tmp):
+    """Loads logging configuration writing to files in tmp instead of stdout."""
+    with open("logging.json") as log_cfg:
+        config = json.load(log_cfg)
+    config["handlers"]["console"] = {
+        "class": "logging.FileHandler",
+        "level": config["handlers"]["console"]["level"],
+        "formatter": config["handlers"]["console"]["formatter"],
+        "filename": os.path.join(tmp, "console.log"),
+    }
+    config["handlers"]["file"]["filename"] = os.path.join(tmp, "router.log")
+    return config
+
+
+def block_gaps(gcode_file, mode, passes=100):
+    """Measures time between blocks spent in the router loop and steppers logging.
+
+    Parameters:
+        gcode_file (str): Path of GCode file
+        mode (str): "off" logging disabled, "sync" handlers in process,
+            "queue" handlers in listener process
+        passes (int): Number of passes over the planned blocks
+
+    Returns:
+        tuple: Mean and max gap in seconds
+    """
+    gcodes = GCodeParser.read_lines(gcode_file)
+    blocks = list(BlockPlanner(1).plan(gcodes, {"X": 0.0, "Y": 0.0, "Z": 0.0}))
+    with tempfile.TemporaryDirectory() as tmp:
+        config = _logging_config(tmp)
+        listener = None
+        if mode == "off":
+            logging.disable(logging.CRITICAL)
+        elif mode == "sync":
+            logging.config.dictConfig(config)
+        else:
+            listener = log_queue.LogListener(config)
+        logger = logging.getLogger("main")
+        stepper = Stepper("X", 2, True)
+        gaps = []
+        for block in blocks * passes:
+            t = time.perf_counter()
+            logger.info("Executing '%s'", block.gcode)
+            stepper.set_direction("CW" if stepper.get_direction() == "CCW" else "CCW")
+            gaps.append(time.perf_counter() - t)
+        if listener is not None:
+            listener.stop()
+        logging.disable(logging.NOTSET)
+        for name in config["loggers"]:
+            logging.getLogger(name).handlers = []
+    return sum(gaps) / len(gaps), max(gaps)
+
 
 def main():
 
@@ -27,6 +133,19 @@ def main():
     print("Interpolated Arc: {} loops, best of {}; {:.2f} usec per loop".format(
         n, r, min(t2) / n * 1000000))
 
+    for processes in sorted(set((1, os.cpu_count() or 1))):
+        print("Block Planner: {} processes; {:.1f} blocks per second".format(
+            processes, planner_throughput("templates/test_xy.nc", processes)))
+
+    for mode in ("ok", "count"):
+        print("Stream Server: {} mode; {:.1f} lines per second".format(
+            mode, stream_throughput("templates/create_mounting_plate.nc", mode)))
+
+    for mode in ("off", "sync", "queue"):
+        mean, peak = block_gaps("templates/test_x.nc", mode)
+        print("Block Gap: logging {}; {:.2f} usec mean, {:.2f} usec max".format(
+            mode, mean * 1000000, peak * 1000000))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import json
+import os
+import threading
+import time
+
+
+class _NullSpan(object):
+    """Span used while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    """Span recording its duration on exit."""
+
+    def __init__(self, tracer, name, cat, args):
+        self._tracer = tracer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self._tracer.add(self._name, self._start, time.time() - self._start,
+                         self._cat, **self._args)
+        return False
+
+
+class Tracer(object):
+    """
+    Records spans in Chrome trace event format.
+
+    Tracing is disabled by default; spans are then no-ops.
+    The written file can be opened in chrome://tracing or Perfetto.
+
+    Attributes:
+        enabled (bool): Record spans
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts recording spans."""
+        self._events = []
+        self.enabled = True
+
+    def stop(self):
+        """Stops recording spans."""
+        self.enabled = False
+
+    def span(self, name, cat="", **args):
+        """Returns context manager recording a span."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, cat, args)
+
+    def add(self, name, start, duration, cat="", pid=None, tid=None, **args):
+        """Adds span measured elsewhere, e.g. in a worker process.
+
+        Parameters:
+            name (str): Span name
+            start (float): Start timestamp in seconds since epoch
+            duration (float): Duration in seconds
+            cat (str): Category
+            pid (int): Process id, defaults to current process
+            tid (int): Thread id, defaults to current thread
+        """
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid if pid is not None else os.getpid(),
+            "tid": tid if tid is not None else threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def events(self):
+        """Gets recorded events."""
+        return list(self._events)
+
+    def write(self, path):
+        """Writes recorded spans as Chrome trace event JSON."""
+        with open(path, "w") as outf:
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, outf)
+
+
+TRACER = Tracer()